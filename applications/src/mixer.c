@@ -4,6 +4,7 @@
 #include <ncurses.h>
 #include <pthread.h>
 #include <math.h>
+#include <string.h>
 
 #define PORT    0
 #define STAR    1
@@ -131,7 +132,8 @@ static int rate(void) {
     return 0;
 }
 
-static char data[64];
+/* Requests hold up to six "<Axis> <value>" pairs, about 90 characters */
+static char data[256];
 int main(void) {
     Seawolf_loadConfig("../conf/seawolf.conf");
     Seawolf_init("PID Mixer");
@@ -147,8 +149,9 @@ int main(void) {
     float req_forward = 0.0;
     float req_yaw     = 0.0;
 
-    /* Notify buffers */
-    char requester[16], value[16];
+    /* Request parsing */
+    char *requester, *value, *save;
+    bool updated;
 
     /* Zero thrusters */
     setThrusters(out);
@@ -161,25 +164,36 @@ int main(void) {
 
     while(true) {
         Notify_get(NULL, data);
-        Util_split(data, ' ', requester, value);
 
         count++;
 
-        /* Parse request */
-        if (strcmp(requester, "Yaw") == 0) {
-            req_yaw = atof(value);
-        } else if(strcmp(requester, "Forward") == 0) {
-            req_forward = atof(value);
-        } else if(strcmp(requester, "Pitch") == 0) {
-            req_pitch = atof(value);
-        } else if(strcmp(requester, "Depth") == 0) {
-            //printf("depth = %f\n", atof(value));
-            req_depth = atof(value);
-        } else if(strcmp(requester, "Strafe") == 0) {
-            req_strafe = atof(value);
-        } else if(strcmp(requester, "Roll") == 0) {
-            req_roll = atof(value);
-        } else {
+        /* Parse request. sw3.mixer batches several axes into one request, as
+           in "Forward 0.5000 Yaw -0.2000", so read every pair. */
+        updated = false;
+        for(requester = strtok_r(data, " ", &save);
+            requester != NULL && (value = strtok_r(NULL, " ", &save)) != NULL;
+            requester = strtok_r(NULL, " ", &save)) {
+
+            if (strcmp(requester, "Yaw") == 0) {
+                req_yaw = atof(value);
+            } else if(strcmp(requester, "Forward") == 0) {
+                req_forward = atof(value);
+            } else if(strcmp(requester, "Pitch") == 0) {
+                req_pitch = atof(value);
+            } else if(strcmp(requester, "Depth") == 0) {
+                //printf("depth = %f\n", atof(value));
+                req_depth = atof(value);
+            } else if(strcmp(requester, "Strafe") == 0) {
+                req_strafe = atof(value);
+            } else if(strcmp(requester, "Roll") == 0) {
+                req_roll = atof(value);
+            } else {
+                continue;
+            }
+            updated = true;
+        }
+
+        if(!updated) {
             continue;
         }
 
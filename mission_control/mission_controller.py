@@ -51,15 +51,15 @@ class MissionController(object):
         if self.wait_for_go:
             print "Waiting for GO signal..."
             while not seawolf.notify.available():
-                seawolf.var.set("MissionReset", 0)
+                sw3.variables.set("MissionReset", 0)
                 sleep(0.1)
                 self.process_manager.ping()
             action, param = seawolf.notify.get()
 
         # Avoid resetting mission if conductor isn't running (not
         # --wait-for-go)
-        elif seawolf.var.get("MissionReset"):
-            seawolf.var.set("MissionReset", 0)
+        elif sw3.variables.get("MissionReset"):
+            sw3.variables.set("MissionReset", 0)
 
         try:
             # Run missions
@@ -1,7 +1,8 @@
 
-import seawolf
+import heapq
+import itertools
 
-from time import time
+import sw3
 
 
 class MissionControlReset(Exception):
@@ -14,6 +15,12 @@ class MissionBase(object):
 
     '''A base class for missions.'''
 
+    # Entity outputs from frames captured more than this many seconds ago are
+    # discarded instead of being passed to step(), as if nothing was seen.
+    # Override it, or call set_max_data_age(), for a different limit.  None
+    # accepts any age.
+    max_data_age = 0.5
+
     def register_mission_controller(self, mission_controller):
         ''' Called by the mission controller when the mission is added.'''
         self.mission_controller = mission_controller
@@ -33,36 +40,40 @@ class MissionBase(object):
         '''
         self._entity_timeout = timeout
 
+    def set_max_data_age(self, max_age):
+        '''Gives the maximum age, in seconds, of entity outputs passed to step().
+
+        Age is measured from when the frame was captured, so detections made
+        from frames that sat in a queue are rejected.
+        '''
+        self.max_data_age = max_age
+
     def execute(self):
         '''Runs the mission.
 
         This is a blocking call that returns when the mission completes.
         '''
 
-        if not hasattr(self, "timers"):
-            self.timers = {}
+        self._init_timers()
 
         self._entity_timeout = getattr(self, "_entity_timeout", None)
         self._mission_done = getattr(self, "_mission_done", False)
         self._mission_fail = getattr(self, "_mission_fail", False)
-        last_entity_timestamp = time()
+        last_entity_timestamp = sw3.clock.now()
 
         while not self._mission_done:
 
-            if seawolf.var.get("MissionReset"):
+            # Read from the sw3 variable cache, not the hub, every step
+            if sw3.variables.get("MissionReset"):
                 print "MISSION RESET"
                 raise MissionControlReset()
 
-            vision_data = self.process_manager.get_data(delay=0.05)
+            vision_data = self.process_manager.get_data(delay=0.05,
+                                                        max_age=self.max_data_age)
 
             self.step(vision_data)
 
-            # Timer callbacks
-            current_time = time()
-            for name, (t, delay, callback, args) in self.timers.items():
-                if t + delay <= current_time:
-                    self.delete_timer(name)
-                    callback(*args)
+            self._run_timers()
 
             if self._mission_fail:
                 return False
@@ -93,17 +104,40 @@ class MissionBase(object):
         raise NotImplementedError("A subclass must implement this method.")
 
     def set_timer(self, name, delay, callback, *args):
-        if not hasattr(self, "timers"):
-            self.timers = {}
-        self.timers[name] = (time(), delay, callback, args)
+        '''Calls callback(*args) after delay seconds, between steps.
+
+        Setting a timer with the same name as a pending one replaces it.
+        '''
+        self._init_timers()
+        entry = (sw3.clock.now() + delay, self._timer_count.next(), name, callback, args)
+        self.timers[name] = entry
+        heapq.heappush(self._timer_heap, entry)
 
     def delete_timer(self, name):
+        self._init_timers()
+        # Its heap entry is skipped when it comes due
+        self.timers.pop(name, None)
+
+    def _init_timers(self):
+        # Subclasses don't always call MissionBase.__init__, so the timers are
+        # created when first used
         if not hasattr(self, "timers"):
-            self.timers = {}
-        try:
+            self.timers = {}  # Maps name -> pending heap entry
+            self._timer_heap = []  # (due time, sequence number, name, callback, args)
+            self._timer_count = itertools.count()
+
+    def _run_timers(self):
+        '''Calls the callbacks of the timers that are due, in due order.'''
+        current_time = sw3.clock.now()
+        heap = self._timer_heap
+        while heap and heap[0][0] <= current_time:
+            entry = heapq.heappop(heap)
+            due, sequence, name, callback, args = entry
+            if self.timers.get(name) is not entry:
+                # Deleted or replaced since
+                continue
             del self.timers[name]
-        except KeyError:
-            pass
+            callback(*args)
 
 
 class SearchMission(MissionBase):
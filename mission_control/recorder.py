@@ -0,0 +1,102 @@
+'''
+Records what missions see, so they can be replayed with replay.py.
+
+A recording holds every vision output the missions got from
+ProcessManager.get_data(), and every value of a seawolf variable that came
+from the hub through sw3.variables, each with the time it arrived.  Values
+the missions set themselves aren't recorded, since a replay makes its own.
+
+    recorder = MissionRecorder("gate.rec")
+    process_manager = RecordingProcessManager(vision.ProcessManager(), recorder)
+    ...
+    recorder.close()
+
+run.py does this with --record.  The file is a stream of pickled events:
+
+    ("header", time, {"version": RECORDING_VERSION})
+    ("vision", time, {process name: output})
+    ("vars", time, {variable name: value})
+
+'''
+
+import cPickle as pickle
+import threading
+from time import time
+
+import sw3
+
+RECORDING_VERSION = 1
+
+
+class MissionRecorder(object):
+
+    '''Writes vision outputs and seawolf variable values to a recording.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.lock = threading.Lock()
+        self.events = 0
+        self.write(("header", time(), {"version": RECORDING_VERSION}))
+        sw3.variables.add_listener(self.record_variables)
+
+    def record_vision(self, vision_data):
+        self.write(("vision", time(), vision_data))
+
+    def record_variables(self, values, timestamp):
+        self.write(("vars", timestamp, dict(values)))
+
+    def write(self, event):
+        with self.lock:
+            if self.file is None:
+                return
+            pickle.dump(event, self.file, pickle.HIGHEST_PROTOCOL)
+            self.events += 1
+
+    def close(self):
+        sw3.variables.remove_listener(self.record_variables)
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def __repr__(self):
+        return "<MissionRecorder %s events=%d>" % (self.path, self.events)
+
+
+class RecordingProcessManager(object):
+
+    '''Wraps a ProcessManager, recording every output get_data() returns.'''
+
+    def __init__(self, process_manager, recorder):
+        self.process_manager = process_manager
+        self.recorder = recorder
+
+    def get_data(self, *process_names, **kwargs):
+        vision_data = self.process_manager.get_data(*process_names, **kwargs)
+        if vision_data is not None:
+            self.recorder.record_vision(vision_data)
+        return vision_data
+
+    def __getattr__(self, name):
+        return getattr(self.process_manager, name)
+
+
+def load_recording(path):
+    '''Returns the header and the list of (kind, time, values) events of a
+    recording.'''
+    events = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                events.append(pickle.load(f))
+            except EOFError:
+                break
+
+    if not events or events[0][0] != "header":
+        raise ValueError("%s is not a mission recording." % path)
+    header = events[0][2]
+    if header.get("version") != RECORDING_VERSION:
+        raise ValueError("%s is a version %s recording.  Only version %d is supported." % (
+            path, header.get("version"), RECORDING_VERSION))
+    return header, events[1:]
@@ -0,0 +1,663 @@
+#!/usr/bin/env python
+
+'''
+Replays recorded missions deterministically, faster than real time.
+
+Record a live run with "run.py --record <file>", then replay it against a
+mission from missions.mission_classes:
+
+    ./replay.py gate.rec -m gate
+
+Or replay every <mission name>.rec in a directory, write the results, and
+compare them against an earlier results file:
+
+    ./replay.py recordings/ -o results.json -b baseline.json
+
+Each mission runs in its own process against deterministic stand-ins:
+
+    - A ReplayProcessManager returns the recorded vision outputs, at the
+      times they were recorded.
+    - seawolf.var and seawolf.notify are replaced.  Variables follow the
+      recorded timeline, and everything the mission sets or sends is
+      recorded instead of going to the hub.
+    - A virtual sw3 clock keeps the time.  Sleeping and waiting for vision
+      data jump straight to the next event.  Missions that use the time
+      module directly are switched over to the clock too.
+    - The sw3 scheduler, variable cache and mixer run in step with the
+      clock instead of on their own threads.
+
+For every mission the decisions it took are reported: nav routines started,
+variables set and notifies sent, with their times into the recording.  So is
+the latency of the step loop, the real time the mission spent between calls
+to get_data().  Compared against a baseline, a mission is a regression if its
+decisions changed, or if its step latency grew by more than the tolerance.
+
+Replay is open loop.  Sensor values follow the recording, whatever the
+mission decides.
+'''
+
+from __future__ import division
+import sys
+import os
+import json
+import bisect
+import time
+import types
+import traceback
+from optparse import OptionParser
+from multiprocessing import Process, Pipe
+
+parent_directory = os.path.realpath(os.path.join(
+    os.path.abspath(__file__),
+    "../.."
+))
+sys.path.append(os.path.join(parent_directory, "vision/"))
+sys.path.append(parent_directory)
+
+try:
+    import seawolf
+except ImportError:
+    # Replay never talks to the hub, so it runs without libseawolf
+    seawolf = types.ModuleType("seawolf")
+    sys.modules["seawolf"] = seawolf
+
+import sw3
+from sw3.scheduler import scheduler
+from sw3.variables import variables
+from sw3.data import HISTORY_VARS, HISTORY_LENGTH, HISTORY_MAX_EXTRAPOLATION
+from sw3.mixer import mixer, MAX_RATE as MIXER_MAX_RATE
+from sw3.ratelimit import KeyedRateLimiter
+from recorder import load_recording
+
+RECORDING_EXTENSION = ".rec"
+LATENCY_PERCENTILES = (50, 90, 99)
+
+# Modules whose references to the time module, time.time and time.sleep are
+# switched over to the virtual clock
+CLOCK_MODULES = ("missions", "mission_controller")
+
+# Routine attributes shown in the decisions
+ROUTINE_ATTRS = ("depth", "angle", "amount", "rate", "location")
+
+_real_time = time.time
+
+
+class ReplayFinished(Exception):
+
+    '''Raised in the mission when the recording runs out.'''
+    pass
+
+
+class ReplayClock(sw3.clock.VirtualClock):
+
+    '''The virtual clock of a replay.
+
+    Advancing it stops at every variable change and scheduled call on the
+    way, so they happen at the times they would have live.
+    '''
+
+    def __init__(self, engine, start):
+        super(ReplayClock, self).__init__(start)
+        self.engine = engine
+
+    def advance_to(self, target):
+        engine = self.engine
+
+        # What the mission did since the last tick happens before time moves
+        engine.tick()
+
+        while True:
+            times = [t for t in (engine.timeline.next_time(), scheduler.next_time())
+                     if t is not None and t <= target]
+            super(ReplayClock, self).advance_to(min(times) if times else target)
+            engine.tick()
+            if not times:
+                return
+
+
+class VariableTimeline(object):
+
+    '''The recorded values of seawolf variables over time.'''
+
+    def __init__(self, events):
+        self.events = events  # (time, {name: value}), in time order
+        self.index = 0
+        self.first = {}  # Maps name -> first recorded value
+        for timestamp, values in events:
+            for name, value in values.iteritems():
+                self.first.setdefault(name, value)
+
+    def next_time(self):
+        if self.index < len(self.events):
+            return self.events[self.index][0]
+        return None
+
+    def advance(self, now):
+        '''Returns the values that changed by now.'''
+        changes = {}
+        while self.index < len(self.events) and self.events[self.index][0] <= now:
+            changes.update(self.events[self.index][1])
+            self.index += 1
+        return changes
+
+
+class ReplayHistory(object):
+
+    '''Stands in for the sensor history of sw3.data.
+
+    The pose at a time is taken from the recorded variables, instead of from
+    samples taken in the background.  Like the live history, it only covers
+    the last HISTORY_LENGTH seconds, and nothing before it was started.
+    '''
+
+    def __init__(self, engine, variables=HISTORY_VARS):
+        self.engine = engine
+        self.variables = variables
+        self.started = None
+
+        # The values of the variables after each recorded change to them
+        self.times = []
+        self.poses = []
+        pose = dict((var, engine.timeline.first.get(var, 0.0)) for var in variables)
+        for timestamp, values in engine.timeline.events:
+            changed = dict((var, values[var]) for var in variables if var in values)
+            if changed:
+                pose = dict(pose, **changed)
+                self.times.append(timestamp)
+                self.poses.append(pose)
+
+    def start(self):
+        if self.started is None:
+            self.started = self.engine.clock.now()
+
+    def stop(self):
+        pass
+
+    def at(self, timestamp):
+        now = self.engine.clock.now()
+        if self.started is None or timestamp > now + HISTORY_MAX_EXTRAPOLATION or \
+                timestamp < max(self.started, now - HISTORY_LENGTH):
+            return None
+        i = bisect.bisect_right(self.times, min(timestamp, now)) - 1
+        if i < 0:
+            return None
+        return dict(self.poses[i])
+
+
+class ReplayVar(object):
+
+    '''Stands in for seawolf.var.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.values = {}
+
+    def get(self, name):
+        if name in self.values:
+            return self.values[name]
+        # Read before the live run first read it
+        return self.engine.timeline.first.get(name, 0.0)
+
+    def set(self, name, value):
+        self.values[name] = value
+        self.engine.decide("set", "%s %s" % (name, value))
+
+    def subscribe(self, name):
+        pass
+
+    def stale(self, name):
+        return False
+
+    def sync(self):
+        raise RuntimeError("seawolf.var.sync() can't be used during a replay.")
+
+
+class ReplayNotify(object):
+
+    '''Stands in for seawolf.notify.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def send(self, action, data):
+        self.engine.decide("notify", "%s %s" % (action, data))
+
+    def filter(self, *args):
+        pass
+
+    def available(self):
+        return False
+
+    def get(self):
+        # Nothing will ever come
+        raise ReplayFinished("The mission waited for a notify.")
+
+
+class ReplayController(object):
+
+    '''What a mission needs of its MissionController.'''
+
+    def __init__(self, process_manager):
+        self.process_manager = process_manager
+
+
+class ReplayProcessManager(object):
+
+    '''Stands in for vision.ProcessManager, returning recorded outputs.'''
+
+    def __init__(self, engine, events):
+        self.engine = engine
+        self.events = events  # (time, {process name: output}), in time order
+        self.index = 0
+        self.process_list = {}  # Maps name -> entity class
+        self.freeze_sensors = True
+
+        # Real seconds the mission spent between calls to get_data()
+        self.step_latencies = []
+        self._returned = None
+
+    def start_process(self, proc_cls, name, *args, **kwargs):
+        self.process_list[name] = proc_cls
+
+    def start_fused(self, camera_name, entity_specs, **kwargs):
+        for proc_cls, name in entity_specs:
+            self.process_list[name] = proc_cls
+
+    def get_data(self, *process_names, **kwargs):
+        if self._returned is not None:
+            self.step_latencies.append(_real_time() - self._returned)
+        try:
+            return self._get_data(*process_names, **kwargs)
+        finally:
+            self._returned = _real_time()
+
+    def _get_data(self, *process_names, **kwargs):
+        force = kwargs.pop("force", False)
+        delay = kwargs.pop("delay", 0)
+        max_age = kwargs.pop("max_age", None)
+
+        if not process_names:
+            process_names = self.process_list.keys()
+        for process_name in process_names:
+            if process_name not in self.process_list:
+                raise ValueError("Attempted to get data from a non-existant process")
+
+        clock = self.engine.clock
+        deadline = None if force else clock.now() + delay
+        vision_data = dict((name, None) for name in process_names)
+        while True:
+            if self.index >= len(self.events):
+                end = self.engine.end_time
+                self.engine.advance_to(end if deadline is None else min(deadline, end))
+                if clock.now() >= end:
+                    raise ReplayFinished()
+                return None
+
+            timestamp, outputs = self.events[self.index]
+            if deadline is not None and timestamp > deadline:
+                self.engine.advance_to(deadline)
+                return None
+            self.index += 1
+            self.engine.advance_to(timestamp)
+
+            # Outputs sent while the mission was busy arrive together, and
+            # only the newest of each process is kept
+            for name in process_names:
+                output = outputs.get(name)
+                if output is not None and not self._too_old(output, max_age):
+                    vision_data[name] = output
+            if self.index < len(self.events) and self.events[self.index][0] <= clock.now():
+                continue
+
+            found = [output is not None for output in vision_data.itervalues()]
+            if all(found) if force else any(found):
+                break
+
+        # As live, sensors are frozen at the time the frame was captured
+        if self.freeze_sensors:
+            for name, output in vision_data.iteritems():
+                if output is None:
+                    continue
+                capture_time = getattr(output, "capture_time", None)
+                if capture_time is not None:
+                    sw3.data.freeze_at(name, capture_time)
+                else:
+                    sw3.data.freeze(name)
+        return vision_data
+
+    def _too_old(self, output, max_age):
+        capture_time = getattr(output, "capture_time", None)
+        return max_age is not None and capture_time is not None and \
+            self.engine.clock.now() - capture_time > max_age
+
+    def send_data(self, message, *process_names):
+        pass
+
+    def filenos(self):
+        return []
+
+    def ping(self):
+        pass
+
+    def kill(self):
+        self.process_list = {}
+
+
+class ReplayEngine(object):
+
+    '''Runs a mission against a recording.
+
+    Arguments:
+
+        events - The (kind, time, values) events of the recording, as
+            returned by recorder.load_recording().
+
+    '''
+
+    def __init__(self, events):
+        vision_events = [(t, values) for kind, t, values in events if kind == "vision"]
+        var_events = [(t, values) for kind, t, values in events if kind == "vars"]
+        vision_events.sort(key=lambda event: event[0])
+        var_events.sort(key=lambda event: event[0])
+        times = [t for kind, t, values in events]
+        if not times:
+            raise ValueError("The recording is empty.")
+
+        self.start_time = min(times)
+        self.end_time = max(times)
+        self.clock = ReplayClock(self, self.start_time)
+        self.timeline = VariableTimeline(var_events)
+        self.history = ReplayHistory(self)
+        self.process_manager = ReplayProcessManager(self, vision_events)
+        self.var = ReplayVar(self)
+        self.notify = ReplayNotify(self)
+        self.decisions = []  # [seconds into the recording, kind, detail]
+        self._patched = []
+        self._module_patches = []
+        self._real_clock = None
+
+    def decide(self, kind, detail):
+        self.decisions.append([round(self.clock.now() - self.start_time, 3), kind, detail])
+
+    def advance_to(self, target):
+        '''Moves the clock to target, feeding the variable timeline and running
+        the scheduled nav routine calls on the way.'''
+        self.clock.advance_to(target)
+
+    def tick(self):
+        '''Catches up with the clock.'''
+        now = self.clock.now()
+        changes = self.timeline.advance(now)
+        if changes:
+            self.var.values.update(changes)
+            variables.update(changes)
+        scheduler.run_due(now)
+        # One mixer command per tick
+        mixer.flush()
+
+    def install(self):
+        '''Replaces the real hub, clock and background threads.'''
+        self._patch(seawolf, "var", self.var)
+        self._patch(seawolf, "notify", self.notify)
+        self._patch(scheduler, "threaded", False)
+        self._patch(variables, "threaded", False)
+        self._patch(mixer, "limiter", KeyedRateLimiter(MIXER_MAX_RATE, mixer.send,
+                                                       threaded=False))
+        self._patch(mixer, "sent", {})
+        self._patch(sw3.data, "history", self.history)
+
+        real_do = sw3.nav.do
+
+        def do(routine):
+            self.decide("nav", describe_routine(routine))
+            real_do(routine)
+        self._patch(sw3.nav, "do", do)
+
+        self._real_clock = sw3.clock.set_clock(self.clock)
+        self._module_patches = sw3.clock.patch_modules(CLOCK_MODULES)
+
+    def uninstall(self):
+        sw3.clock.unpatch_modules(self._module_patches)
+        self._module_patches = []
+        sw3.clock.set_clock(self._real_clock)
+        for target, attr, value in reversed(self._patched):
+            setattr(target, attr, value)
+        self._patched = []
+
+    def _patch(self, target, attr, value):
+        self._patched.append((target, attr, getattr(target, attr, None)))
+        setattr(target, attr, value)
+
+
+def describe_routine(routine):
+    '''Returns a short description of a nav routine, like "SetDepth(depth=4)".'''
+    if hasattr(routine, "routines"):
+        arguments = [describe_routine(r) for r in routine.routines]
+    else:
+        arguments = ["%s=%s" % (attr, getattr(routine, attr))
+                     for attr in ROUTINE_ATTRS if hasattr(routine, attr)]
+    return "%s(%s)" % (type(routine).__name__, ", ".join(arguments))
+
+
+def latency_stats(latencies):
+    latencies = sorted(l * 1000 for l in latencies)
+    if not latencies:
+        return None
+    stats = {
+        "mean": sum(latencies) / len(latencies),
+        "max": latencies[-1],
+    }
+    for percentile in LATENCY_PERCENTILES:
+        index = min(int(round(percentile / 100 * (len(latencies) - 1))), len(latencies) - 1)
+        stats["p%d" % percentile] = latencies[index]
+    return stats
+
+
+def replay_mission(mission_name, path):
+    '''Replays the recording at path against a mission.
+
+    Returns a dict of results.  This should be called in its own process,
+    since it replaces parts of seawolf and sw3 for as long as it runs.
+    '''
+    import missions
+
+    header, events = load_recording(path)
+    engine = ReplayEngine(events)
+    engine.install()
+    try:
+        mission = missions.mission_classes[mission_name]()
+        mission.register_mission_controller(ReplayController(engine.process_manager))
+
+        real_start = _real_time()
+        try:
+            mission.init()
+            result = "finished" if mission.execute() else "failed"
+        except ReplayFinished:
+            result = "recording ended"
+        except missions.MissionControlReset:
+            result = "reset"
+        real_seconds = _real_time() - real_start
+    finally:
+        engine.uninstall()
+
+    virtual_seconds = engine.clock.now() - engine.start_time
+    latencies = engine.process_manager.step_latencies
+    return {
+        "result": result,
+        "steps": len(latencies),
+        "virtual_seconds": virtual_seconds,
+        "real_seconds": real_seconds,
+        "speedup": virtual_seconds / real_seconds if real_seconds > 0 else None,
+        "step_latency_ms": latency_stats(latencies),
+        "decisions": engine.decisions,
+    }
+
+
+def _run_replay(conn, mission_name, path):
+    try:
+        result = replay_mission(mission_name, path)
+    except Exception:
+        result = {"error": traceback.format_exc()}
+    conn.send(result)
+
+
+def run_replay(mission_name, path):
+    '''Replays a mission in a child process and returns its results.'''
+    parent_conn, child_conn = Pipe()
+    process = Process(target=_run_replay, args=(child_conn, mission_name, path))
+    process.start()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {"error": "Replay process died with exit code %s" % process.exitcode}
+    process.join()
+    return result
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Prints how each mission did against the baseline.  Returns a list of the
+    names of missions whose decisions changed, or whose p90 step latency grew
+    by more than tolerance percent.
+    '''
+    regressions = []
+    print "%-16s %-10s %12s %12s %8s" % (
+        "mission", "decisions", "p90 ms", "base p90 ms", "change")
+    for name in sorted(results):
+        result = results[name]
+        base = baseline.get(name)
+        if "error" in result or base is None or "error" in base:
+            continue
+
+        flag = ""
+        difference = first_difference(result["decisions"], base["decisions"])
+        if difference is not None or result["result"] != base["result"]:
+            regressions.append(name)
+            flag = "  REGRESSION"
+
+        p90 = (result["step_latency_ms"] or {}).get("p90")
+        base_p90 = (base["step_latency_ms"] or {}).get("p90")
+        if p90 is not None and base_p90:
+            change = (p90 - base_p90) / base_p90 * 100
+            if change > tolerance and name not in regressions:
+                regressions.append(name)
+                flag = "  REGRESSION"
+            latency = "%12.2f %12.2f %+7.1f%%" % (p90, base_p90, change)
+        else:
+            latency = "%12s %12s %8s" % ("-", "-", "-")
+
+        print "%-16s %-10s %s%s" % (
+            name, "same" if difference is None else "changed", latency, flag)
+        if difference is not None:
+            print "    first difference at decision %d:" % difference[0]
+            print "      now:  %s" % format_decision(difference[1])
+            print "      base: %s" % format_decision(difference[2])
+        if result["result"] != base["result"]:
+            print "    result: %s, base: %s" % (result["result"], base["result"])
+    return regressions
+
+
+def first_difference(decisions, base_decisions):
+    '''Returns (index, decision, base decision) of the first decision that
+    differs, or None if they are the same.'''
+    for i in xrange(max(len(decisions), len(base_decisions))):
+        decision = decisions[i] if i < len(decisions) else None
+        base_decision = base_decisions[i] if i < len(base_decisions) else None
+        if decision != base_decision:
+            return i, decision, base_decision
+    return None
+
+
+def format_decision(decision):
+    if decision is None:
+        return "(none)"
+    return "%.3f s  %s  %s" % tuple(decision)
+
+
+def print_result(result):
+    if "error" in result:
+        print "  FAILED:"
+        print result["error"]
+        return
+
+    latency = result["step_latency_ms"] or {}
+    print "  %s after %.1f s in %.2f s real time, %d steps, p50 %s ms, p90 %s ms, %d decisions" % (
+        result["result"], result["virtual_seconds"], result["real_seconds"],
+        result["steps"],
+        "%.2f" % latency["p50"] if latency else "-",
+        "%.2f" % latency["p90"] if latency else "-",
+        len(result["decisions"]))
+
+
+def main():
+    opt_parser = OptionParser(usage="%prog [options] <recording or directory>")
+    opt_parser.add_option("-m", "--mission", action="append", dest="missions",
+                          default=[], metavar="<mission name>",
+                          help="Mission to replay the recording against, from "
+                          "missions.mission_classes.  May be given more than once.  "
+                          "Required when replaying a single recording.")
+    opt_parser.add_option("-o", "--output", dest="output",
+                          help="Write results as JSON to this file.")
+    opt_parser.add_option("-b", "--baseline", dest="baseline",
+                          help="Compare against results written earlier with -o.")
+    opt_parser.add_option("-t", "--tolerance", type="float",
+                          dest="tolerance", default=25.0,
+                          help="Step latency increase, in percent, that counts as a "
+                          "regression.  Default 25.")
+    options, args = opt_parser.parse_args()
+
+    if len(args) != 1:
+        opt_parser.error("Expected one recording or directory of recordings.")
+    source = args[0]
+
+    import missions
+    for name in options.missions:
+        if name not in missions.mission_classes:
+            opt_parser.error("'%s' is not a valid mission. Please check missions.mission_classes "
+                             "for valid names" % name)
+
+    # Maps mission name -> recording
+    if os.path.isdir(source):
+        replays = {}
+        for filename in sorted(os.listdir(source)):
+            name, extension = os.path.splitext(filename)
+            if extension == RECORDING_EXTENSION and name in missions.mission_classes and \
+                    (not options.missions or name in options.missions):
+                replays[name] = os.path.join(source, filename)
+        if not replays:
+            opt_parser.error("No <mission name>%s recordings in %s." % (RECORDING_EXTENSION, source))
+    elif os.path.exists(source):
+        if not options.missions:
+            opt_parser.error("Give the mission to replay %s against with -m." % source)
+        replays = dict((name, source) for name in options.missions)
+    else:
+        opt_parser.error("Recording '%s' does not exist." % source)
+
+    results = {}
+    for name in sorted(replays):
+        print "Replaying %s against %s..." % (replays[name], name)
+        result = run_replay(name, replays[name])
+        results[name] = result
+        print_result(result)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump({
+                "source": os.path.abspath(source),
+                "time": time.time(),
+                "missions": results,
+            }, f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)["missions"]
+        print
+        regressions = compare(results, baseline, options.tolerance)
+        if regressions:
+            print
+            print "Regressions: %s" % ", ".join(regressions)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
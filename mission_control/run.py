@@ -42,6 +42,47 @@ if __name__ == "__main__":
     opt_parser.add_option("-s", "--simulator", action="store_true",
                           default=False, dest="simulator",
                           help="Connect to the simulator instead of starting vision processes.")
+    opt_parser.add_option("-p", "--profile", action="store_true",
+                          default=False, dest="profile",
+                          help="Profile vision entities.  Stage timings are written to "
+                          "profile/<process name>.json.")
+    opt_parser.add_option("-D", "--drop-policy", type="choice",
+                          choices=["newest", "every_nth", "deadline"],
+                          dest="drop_policy", default=None,
+                          help="Grab frames in the background and only process the newest, "
+                          "dropping frames by the given policy: newest, every_nth or "
+                          "deadline.  By default every frame is processed.")
+    opt_parser.add_option("--every-nth", type="int",
+                          dest="every_nth", default=2,
+                          help="Process every nth frame with --drop-policy every_nth.  Default 2.")
+    opt_parser.add_option("--frame-deadline", type="float",
+                          dest="frame_deadline", default=0.1,
+                          help="Maximum frame age, in seconds, with --drop-policy deadline.  "
+                          "Default 0.1.")
+    opt_parser.add_option("-o", "--debug-output", action="append",
+                          type="string", dest="debug_output", default=None,
+                          metavar="<sink>",
+                          help="Publish vision debug frames to this sink: svr, window, "
+                          "disk:<directory> or ring[:<size>].  May be given more than once.  "
+                          "Default is svr, plus window unless --non-graphical.")
+    opt_parser.add_option("--debug-rate", type="float",
+                          dest="debug_rate", default=5.0,
+                          help="Maximum vision debug frames/sec published per stream.  "
+                          "Default 5.")
+    opt_parser.add_option("-F", "--fuse", action="store_true",
+                          default=False, dest="fuse",
+                          help="Run every vision entity on a camera in one process, sharing "
+                          "the capture and preprocessing.  Each entity runs in its own "
+                          "process by default.")
+    opt_parser.add_option("-r", "--record", dest="record", default=None,
+                          metavar="<file>",
+                          help="Record the vision outputs and seawolf variables the missions "
+                          "see to this file, for replay.py.")
+    opt_parser.add_option("--clock-speed", type="float",
+                          dest="clock_speed", default=None,
+                          help="Run the mission clock this many times faster than real time, "
+                          "for a simulator that can keep up.  Missions sleep and time out "
+                          "on this clock.  Default is real time.")
     options, args = opt_parser.parse_args(sys.argv)
 
     if len(args) > 1:
@@ -72,6 +113,7 @@ import vision
 import missions
 #import acoustics
 from mission_controller import MissionController
+from recorder import MissionRecorder, RecordingProcessManager
 
 BUOY_DEPTH = 4
 #
@@ -160,11 +202,30 @@ if __name__ == "__main__":
 
     if options.logfile:
         sys.stdout = open(logfile, "a")
+
+    if options.clock_speed is not None:
+        if options.clock_speed <= 0:
+            opt_parser.error("--clock-speed must be positive.")
+        sw3.clock.set_clock(sw3.clock.ScaledClock(options.clock_speed))
+        # Missions that still use the time module directly
+        sw3.clock.patch_modules(["missions", "mission_controller"])
+
     process_manager = vision.ProcessManager(extra_kwargs={
         "delay": options.delay,
         "cameras": cameras_dict,
         "debug": options.graphical,
-    })
+        "profile": options.profile,
+        "drop_policy": options.drop_policy,
+        "every_nth": options.every_nth,
+        "frame_deadline": options.frame_deadline,
+        "debug_output": options.debug_output,
+        "debug_rate": options.debug_rate,
+    }, fuse_cameras=options.fuse)
+
+    recorder = None
+    if options.record:
+        recorder = MissionRecorder(options.record)
+        process_manager = RecordingProcessManager(process_manager, recorder)
 
     try:
         while True:
@@ -202,3 +263,5 @@ if __name__ == "__main__":
     finally:
         process_manager.kill()
         mission_controller.kill()
+        if recorder is not None:
+            recorder.close()
@@ -4,7 +4,10 @@ import sys
 if sys.version_info < (2, 6):
     raise RuntimeError("Python version 2.6 or greater required!")
 
+import clock
 from data import data
+from scheduler import scheduler
+from variables import variables
 from routines import *
 from navqueue import NavQueue
 
@@ -0,0 +1,203 @@
+'''
+The time source of mission control.
+
+sw3 and missions.base read the time and sleep through the current clock
+instead of the time module, so missions can run on something other than
+the wall clock:
+
+    WallClock - Real time.  The default.
+    ScaledClock(speed) - Runs speed times faster than real time, for
+        simulations and tests that can keep up.
+    VirtualClock(start) - Only moves when advanced.  For replays and tests,
+        which jump straight from one event to the next.
+
+    sw3.clock.set_clock(sw3.clock.ScaledClock(10))
+    start = sw3.clock.now()
+    sw3.clock.sleep(5)  # Half a second of real time
+
+Code that waits on a threading.Condition with a timeout waits through
+wait(), so the timeout is in clock seconds too.  wait() may return early,
+so callers check the time again afterwards, as they would for a spurious
+wakeup.
+
+Missions that use the time module directly can be switched over with
+patch_modules().
+'''
+
+from __future__ import division
+
+import sys
+import threading
+import time
+
+__all__ = ["WallClock", "ScaledClock", "VirtualClock", "get_clock", "set_clock",
+           "now", "sleep", "wait", "patch_modules", "unpatch_modules"]
+
+# Real seconds between checks of the time, for threads waiting on a virtual
+# clock that another thread advances
+VIRTUAL_WAIT_INTERVAL = 0.01
+
+
+class WallClock(object):
+
+    '''Real time.'''
+
+    def now(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(max(seconds, 0))
+
+    def wait(self, condition, timeout=None):
+        condition.wait(timeout)
+
+    def __repr__(self):
+        return "<WallClock>"
+
+
+class ScaledClock(object):
+
+    '''Time that runs speed times faster than real time.
+
+    Arguments:
+
+        speed - How many clock seconds pass per real second.
+
+        start - The time now, in clock seconds.  Defaults to the real time.
+
+    '''
+
+    def __init__(self, speed, start=None):
+        if speed <= 0:
+            raise ValueError("Clock speed must be positive, not %s." % speed)
+        self.speed = speed
+        self.real_start = time.time()
+        self.start = self.real_start if start is None else start
+
+    def now(self):
+        return self.start + (time.time() - self.real_start) * self.speed
+
+    def sleep(self, seconds):
+        time.sleep(max(seconds, 0) / self.speed)
+
+    def wait(self, condition, timeout=None):
+        if timeout is not None:
+            timeout = max(timeout, 0) / self.speed
+        condition.wait(timeout)
+
+    def __repr__(self):
+        return "<ScaledClock speed=%s>" % self.speed
+
+
+class VirtualClock(object):
+
+    '''Time that only moves when advance_to() is called.
+
+    The thread that creates the clock drives it.  When that thread sleeps or
+    waits, the clock is advanced by that much at once.  Other threads that
+    sleep block until the clock has been advanced far enough.
+    '''
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self.thread = threading.current_thread()
+        self._advanced = threading.Condition()
+
+    def now(self):
+        return self._now
+
+    def advance_to(self, target):
+        '''Moves the clock forward to target.  It never moves back.'''
+        with self._advanced:
+            if target > self._now:
+                self._now = target
+            self._advanced.notify_all()
+
+    def sleep(self, seconds):
+        target = self._now + max(seconds, 0)
+        if threading.current_thread() is self.thread:
+            self.advance_to(target)
+            return
+        with self._advanced:
+            while self._now < target:
+                self._advanced.wait()
+
+    def wait(self, condition, timeout=None):
+        if threading.current_thread() is self.thread:
+            if timeout is None:
+                raise RuntimeError("Nothing else advances this clock, so waiting "
+                                   "without a timeout would never end.")
+            self.advance_to(self._now + max(timeout, 0))
+        else:
+            condition.wait(VIRTUAL_WAIT_INTERVAL)
+
+    def __repr__(self):
+        return "<VirtualClock now=%.3f>" % self._now
+
+
+_clock = WallClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    '''Makes clock the time source of mission control.  Returns the old one.'''
+    global _clock
+    old_clock, _clock = _clock, clock
+    return old_clock
+
+
+def now():
+    '''Returns the current time, in seconds, from the current clock.'''
+    return _clock.now()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+
+def wait(condition, timeout=None):
+    '''Waits on a held threading.Condition for up to timeout clock seconds.'''
+    _clock.wait(condition, timeout)
+
+
+class _ClockTime(object):
+
+    '''Looks like the time module, but time() and sleep() use the current clock.'''
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def time(self):
+        return now()
+
+    def sleep(self, seconds):
+        sleep(seconds)
+
+
+def patch_modules(prefixes):
+    '''Makes already imported modules use the current clock instead of the
+    time module.
+
+    In every module whose name starts with one of prefixes, references to the
+    time module, time.time and time.sleep are replaced.  Returns the patches,
+    for unpatch_modules().
+    '''
+    replacements = {id(time): _ClockTime(), id(time.time): now, id(time.sleep): sleep}
+    originals = (time, time.time, time.sleep)
+    patches = []  # (module, attribute, original value)
+    for name, module in sys.modules.items():
+        if module is None or not name.startswith(tuple(prefixes)):
+            continue
+        for attr, value in vars(module).items():
+            if any(value is original for original in originals):
+                patches.append((module, attr, value))
+                setattr(module, attr, replacements[id(value)])
+    return patches
+
+
+def unpatch_modules(patches):
+    for module, attr, value in reversed(patches):
+        setattr(module, attr, value)
@@ -1,10 +1,104 @@
+from __future__ import division
 
-import seawolf as sw
+import threading
+from collections import deque
+from time import time, sleep
+
+from util import add_angle
+from variables import variables as var_cache
 
 __all__ = ["data"]
 
 VARS_TO_FREEZE = ["SEA.Yaw", "Depth"]
 
+# Variables recorded by the sensor history, and the ones among them that are
+# angles in degrees, which wrap around at +/-180.
+HISTORY_VARS = ["SEA.Yaw", "SEA.Pitch", "SEA.Roll", "Depth"]
+CIRCULAR_VARS = ["SEA.Yaw"]
+
+HISTORY_RATE = 50  # Samples per second
+HISTORY_LENGTH = 2  # Seconds of samples kept
+
+# A freeze for a time this far past the newest sample reads the variables
+# directly instead.
+HISTORY_MAX_EXTRAPOLATION = 0.1
+
+
+class SensorHistory(object):
+
+    '''Records timestamped samples of the robot's pose in the background.
+
+    Vision outputs carry the time their frame was captured.  at() gives the
+    pose at such a time, interpolated between the samples around it.
+
+    Vision processes stamp frames with the wall clock, so samples are stamped
+    with it too, rather than with sw3.clock.
+    '''
+
+    def __init__(self, variables=HISTORY_VARS, rate=HISTORY_RATE,
+                 length=HISTORY_LENGTH):
+        self.variables = variables
+        self.period = 1 / rate
+        self.samples = deque(maxlen=int(rate * length))  # (timestamp, values)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        '''Starts sampling, if it isn't already running.'''
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.__sampler)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def __sampler(self):
+        while self.running:
+            start = time()
+            values = [var_cache.get(var) for var in self.variables]
+            end = time()
+            with self.lock:
+                self.samples.append(((start + end) / 2, values))
+            sleep(max(0, self.period - (end - start)))
+
+    def at(self, timestamp):
+        '''
+        Returns a dictionary mapping each variable to its value at the given
+        time, or None if the history doesn't cover that time.
+        '''
+        with self.lock:
+            if not self.samples:
+                return None
+            newest_time, newest = self.samples[-1]
+            if timestamp >= newest_time:
+                if timestamp - newest_time > HISTORY_MAX_EXTRAPOLATION:
+                    return None
+                return dict(zip(self.variables, newest))
+
+            # Samples are in time order, and timestamps are usually recent,
+            # so search from the newest end.
+            after_time, after = newest_time, newest
+            for before_time, before in reversed(self.samples):
+                if before_time <= timestamp:
+                    break
+                after_time, after = before_time, before
+            else:
+                # Older than the whole history
+                return None
+
+        fraction = (timestamp - before_time) / (after_time - before_time)
+        pose = {}
+        for var, a, b in zip(self.variables, before, after):
+            if var in CIRCULAR_VARS:
+                pose[var] = add_angle(a, add_angle(b, -a) * fraction)
+            else:
+                pose[var] = a + (b - a) * fraction
+        return pose
+
 
 class Imu(object):
 
@@ -26,6 +120,7 @@ class Data(object):
     def __init__(self):
         self.imu = Imu(self)
         self.freezes = {}  # Map freeze name to variable dictionary
+        self.history = SensorHistory()
 
     def depth(self, freeze_name=None):
         return self.var_get("Depth", freeze_name=None)
@@ -37,15 +132,44 @@ class Data(object):
         if freeze_name in self.freezes and var in self.freezes[freeze_name]:
             return self.freezes[freeze_name][var]
         else:
-            return sw.var.get(var)
+            return var_cache.get(var)
 
     def freeze(self, freeze_name=None):
         variables = {}
         for var in VARS_TO_FREEZE:
-            variables[var] = sw.var.get(var)
+            variables[var] = var_cache.get(var)
+        self.freezes[freeze_name] = variables
+
+        # Set Default Freeze
+        self.freezes[None] = variables
+
+    def freeze_at(self, freeze_name, timestamp):
+        '''Freezes the variables at their values at the given time.
+
+        Values are interpolated from the sensor history, which is started on
+        the first call.  If the history doesn't cover the time, the current
+        values are frozen instead, like freeze().
+        '''
+        self.history.start()
+        pose = self.history.at(timestamp)
+        if pose is None:
+            self.freeze(freeze_name)
+            return
+
+        variables = {}
+        for var in VARS_TO_FREEZE:
+            variables[var] = pose[var]
         self.freezes[freeze_name] = variables
 
         # Set Default Freeze
         self.freezes[None] = variables
 
+    def pose_at(self, timestamp):
+        '''
+        Returns a dictionary of the history variables at the given time, or
+        None if the sensor history doesn't cover it.
+        '''
+        self.history.start()
+        return self.history.at(timestamp)
+
 data = Data()
@@ -1,13 +1,78 @@
 
 import seawolf as sw
 
+import clock
+from ratelimit import KeyedRateLimiter
+
 __all__ = ["mixer"]
 
+# Most THRUSTER_REQUEST notifies sent per second
+MAX_RATE = 20
+
+# A value that hasn't changed is only sent again after this many seconds, in
+# case another program changed it in the meantime
+RESEND_INTERVAL = 1.0
+
+# Order the axes are sent in.  The C mixer accepts any order.
+AXES = ("Forward", "Yaw", "Depth", "Pitch", "Strafe", "Roll")
+
 
 class Mixer(object):
 
+    """ Sends thruster requests to the C mixer
+
+    Setting an axis doesn't send anything right away.  Axes set between two
+    control ticks are coalesced into one THRUSTER_REQUEST, like
+    "Forward 0.5000 Yaw -0.2000", sent at most max_rate times per second.
+    Axes set to the value last sent are left out.  Setting an axis to zero
+    sends right away, as does flush().
+    """
+
+    def __init__(self, max_rate=MAX_RATE, resend_interval=RESEND_INTERVAL):
+        self.resend_interval = resend_interval
+        self.requested = {}  # Maps axis -> last value set
+        self.sent = {}  # Maps axis -> (formatted value, time sent)
+        self.limiter = KeyedRateLimiter(max_rate, self.send)
+
+    def request(self, axis, rate):
+        self.requested[axis] = rate
+        self.limiter.provide(axis, rate)
+        if rate == 0:
+            # Stopping can't wait for the next tick
+            self.limiter.flush()
+
+    def flush(self, force=False):
+        """ Send the pending requests now.  If force is True, values are sent
+        even if they are unchanged. """
+        if force:
+            self.sent = {}
+        self.limiter.flush()
+
+    def zero(self):
+        """ Zero every axis with a single request """
+        for axis in AXES:
+            self.requested[axis] = 0
+            self.limiter.provide(axis, 0)
+        self.flush(force=True)
+
+    def send(self, rates):
+        now = clock.now()
+        pairs = []
+        for axis in AXES:
+            if axis not in rates:
+                continue
+            value = "%.4f" % (rates[axis],)
+            last = self.sent.get(axis)
+            if last is not None and last[0] == value and \
+                    now - last[1] < self.resend_interval:
+                continue
+            self.sent[axis] = (value, now)
+            pairs.append("%s %s" % (axis, value))
+        if pairs:
+            sw.notify.send("THRUSTER_REQUEST", " ".join(pairs))
+
     def set_forward(self, rate):
-        sw.notify.send("THRUSTER_REQUEST", "Forward %.4f" % (rate,))
+        self.request("Forward", rate)
 
     # def set_strafet(self, rate):
     #     sw.notify.send("THRUSTER_REQUEST", "StrafeT %.4f" % (rate,))
@@ -16,27 +81,27 @@ class Mixer(object):
     #     sw.notify.send("THRUSTER_REQUEST", "StrafeB %.4f" % (rate,))
 
     def set_roll(self, rate):
-        sw.notify.send("THRUSTER_REQUEST", "Roll %.4f" % (rate,))
+        self.request("Roll", rate)
 
     def set_yaw(self, rate):
-        sw.notify.send("THRUSTER_REQUEST", "Yaw %.4f" % (rate,))
+        self.request("Yaw", rate)
 
     def set_depth(self, rate):
-        sw.notify.send("THRUSTER_REQUEST", "Depth %.4f" % (rate,))
+        self.request("Depth", rate)
 
     def set_pitch(self, rate):
-        sw.notify.send("THRUSTER_REQUEST", "Pitch %.4f" % (rate,))
-        
+        self.request("Pitch", rate)
+
     def set_strafe(self, rate):
-        sw.notify.send("THRUSTER_REQUEST", "Strafe %.4f" % (rate,))
+        self.request("Strafe", rate)
 
-    forward = property(lambda self: 0, set_forward)
+    forward = property(lambda self: self.requested.get("Forward", 0), set_forward)
     # strafet = property(lambda self: 0, set_strafet)
     # strafeb = property(lambda self: 0, set_strafeb)
-    roll = property(lambda self: 0, set_roll)
-    yaw = property(lambda self: 0, set_yaw)
-    depth = property(lambda self: 0, set_depth)
-    pitch = property(lambda self: 0, set_pitch)
-    strafe = property(lambda self: 0, set_strafe)
+    roll = property(lambda self: self.requested.get("Roll", 0), set_roll)
+    yaw = property(lambda self: self.requested.get("Yaw", 0), set_yaw)
+    depth = property(lambda self: self.requested.get("Depth", 0), set_depth)
+    pitch = property(lambda self: self.requested.get("Pitch", 0), set_pitch)
+    strafe = property(lambda self: self.requested.get("Strafe", 0), set_strafe)
 
 mixer = Mixer()
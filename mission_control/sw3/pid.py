@@ -1,5 +1,5 @@
 
-import seawolf as sw
+from variables import variables
 
 __all__ = ["yaw", "pitch", "depth", "roll"]
 
@@ -12,17 +12,17 @@ class PIDInterface(object):
 
     @property
     def heading(self):
-        return sw.var.get(self.namespace + ".Heading")
+        return variables.get(self.namespace + ".Heading")
 
     @heading.setter
     def heading(self, value):
         if self.setter is None:
-            sw.var.set(self.namespace + ".Heading", value)
+            variables.set(self.namespace + ".Heading", value)
         else:
             self.setter(value)
 
     def pause(self):
-        sw.var.set(self.namespace + ".Paused", 1.0)
+        variables.set(self.namespace + ".Paused", 1.0)
 
 
 def set_yaw(value):
@@ -30,7 +30,7 @@ def set_yaw(value):
     max = 180
 
     if min <= value <= max:
-        sw.var.set("YawPID.Heading", value)
+        variables.set("YawPID.Heading", value)
     else:
         raise ValueError(
             "Value for yaw heading must be in range {low} to {high}".format(low=min, high=max)
@@ -42,7 +42,7 @@ def set_pitch(value):
     max = 25
 
     if min <= value <= max:
-        sw.var.set("PitchPID.Heading", value)
+        variables.set("PitchPID.Heading", value)
     else:
         raise ValueError(
             "Value for pitch heading must be in range {low} to {high}".format(low=min, high=max)
@@ -54,7 +54,7 @@ def set_roll(value):
     max = 180
 
     if min <= value <= max:
-        sw.var.set("RollPID.Heading", value)
+        variables.set("RollPID.Heading", value)
     else:
         raise ValueError(
             "Value for roll heading must be in range {low} to {high}".format(low=min, high=max)
@@ -66,7 +66,7 @@ def set_depth(value):
     max = 20
 
     if min <= value <= max:
-        sw.var.set("DepthPID.Heading", value)
+        variables.set("DepthPID.Heading", value)
     else:
         raise ValueError(
             "Value for depth heading must be in range {low} to {high}".format(low=min, high=max)
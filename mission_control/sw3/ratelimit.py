@@ -1,6 +1,7 @@
 
 import threading
-import time
+
+import clock
 
 
 class RateLimiter(object):
@@ -14,10 +15,11 @@ class RateLimiter(object):
     comes in faster than the maximum rate.
     """
 
-    def __init__(self, max_rate, callback):
+    def __init__(self, max_rate, callback, threaded=True):
         """ Create a new rate limiter
 
-        Use the given max_rate and callback as described above
+        Use the given max_rate and callback as described above.  If threaded
+        is False, the callback is only ever called by flush().
         """
 
         self.wait_time = 1.0 / max_rate
@@ -26,19 +28,32 @@ class RateLimiter(object):
         self.item_available = threading.Condition()
         self.item = None
 
-        self.thread.daemon = True
-        self.thread.start()
+        # Held while calling the callback, so flush() can't overtake a call
+        # already under way
+        self.callback_lock = threading.Lock()
+
+        if threaded:
+            self.thread.daemon = True
+            self.thread.start()
 
     def __caller(self):
         while True:
-            my_item = None
             with self.item_available:
                 while self.item is None:
                     self.item_available.wait() # awaits notify() in self.provide()
-                my_item = self.item
-                self.item = None
-            self.callback(my_item)
-            time.sleep(self.wait_time)
+            with self.callback_lock:
+                my_item = self._take()
+                if my_item is None:
+                    # flush() got to it first
+                    continue
+                self.callback(my_item)
+            clock.sleep(self.wait_time)
+
+    def _take(self):
+        with self.item_available:
+            my_item = self.item
+            self.item = None
+        return my_item
 
     def provide(self, obj):
         """ Offer a new input
@@ -49,3 +64,34 @@ class RateLimiter(object):
         with self.item_available:
             self.item = obj
             self.item_available.notify()
+
+    def flush(self):
+        """ Call the callback with the pending input right away
+
+        Ignores the maximum rate.  Does nothing if no input is pending.
+        """
+
+        with self.callback_lock:
+            my_item = self._take()
+            if my_item is not None:
+                self.callback(my_item)
+
+
+class KeyedRateLimiter(RateLimiter):
+
+    """ Rate limit incoming data for multiple keys at once
+
+    Like a RateLimiter, but input is provided for a key, and the most recent
+    value of each key is kept.  The callback is called at most max_rate times
+    per second with a dictionary mapping each key provided since the last call
+    to its most recent value.
+    """
+
+    def provide(self, key, value):
+        """ Offer a new input value for key """
+
+        with self.item_available:
+            if self.item is None:
+                self.item = {}
+            self.item[key] = value
+            self.item_available.notify()
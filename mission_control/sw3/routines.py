@@ -1,16 +1,17 @@
 
 import threading
-import time
 import collections
 
 import seawolf as sw
 
 import sw3
+import clock
 import pid
 import util
 from mixer import mixer
 from data import data
 from pneumatics import missiles
+from scheduler import scheduler
 
 
 class NavRoutine(object):
@@ -22,6 +23,10 @@ class NavRoutine(object):
 
     interactions = ()
 
+    # Seawolf variables _poll looks at.  The routine is polled as soon as one
+    # of them changes, instead of waiting out the polling interval.
+    watches = ()
+
     def __init__(self, timeout=-1):
         self.state = NavRoutine.RESET
         self.timeout_length = timeout
@@ -31,9 +36,14 @@ class NavRoutine(object):
         self.on_done_callbacks = []
         self.done_event = threading.Event()
 
-        self.polling_thread = None
+        # Polls and the timeout run on the sw3 scheduler thread
+        self.poll_call = None
+        self.timeout_call = None
         self.polling_interval = 0.1
 
+        # Counts starts, so calls left over from an earlier run are ignored
+        self.run_number = 0
+
     def _start(self):
         """ Start the routine """
         pass
@@ -46,34 +56,51 @@ class NavRoutine(object):
         with self.routine_lock:
             self.done_event.clear()
             self.state = NavRoutine.RUNNING
+            self.run_number += 1
             if self.timeout_length > 0:
-                #print "[routines.py] Starting Timer:", self.timeout_length
-                threading.Timer(self.timeout_length, self.timeout).start()
+                self.timeout_call = scheduler.call_later(
+                    self.timeout_length, self.__timeout, self.run_number)
             self._start()
-            if hasattr(self, "_poll"):
-                self.__start_poller()
+            if hasattr(self, "_poll") and self.state == NavRoutine.RUNNING:
+                self.__schedule_poll(0)
+
+    def __schedule_poll(self, delay):
+        """ Have the scheduler call self._poll in delay seconds, or sooner if
+        one of self.get_watches() changes """
+        self.poll_call = scheduler.call_later(delay, self.__poll, self.run_number,
+                                              watch=self.get_watches())
 
-    def __poller(self):
-        """ Polling thread. Will call self._poll every self.polling_interval
+    def __poll(self, run_number):
+        """ Calls self._poll, then polls again every self.polling_interval
         seconds until self._poll indicates the routine has been completed """
-        while not self.done_event.is_set() and self.state == self.RUNNING:
-            new_state = self._poll()
+        if run_number != self.run_number or self.state != NavRoutine.RUNNING:
+            return
 
-            if new_state == NavRoutine.COMPLETED:
-                self.completed()
-            elif new_state == NavRoutine.CANCELED:
-                self.cancel()
-            self.done_event.wait(self.polling_interval)
+        new_state = self._poll()
+        if new_state == NavRoutine.COMPLETED:
+            self.completed()
+        elif new_state == NavRoutine.CANCELED:
+            self.cancel()
+
+        with self.routine_lock:
+            if run_number == self.run_number and self.state == NavRoutine.RUNNING:
+                self.__schedule_poll(self.polling_interval)
+
+    def __timeout(self, run_number):
+        if run_number == self.run_number:
+            self.timeout()
 
-    def __start_poller(self):
-        """ Start the polling thread """
-        self.polling_thread = threading.Thread(target=self.__poller)
-        self.polling_thread.daemon = True
-        self.polling_thread.start()
+    def __cancel_calls(self):
+        for call in (self.poll_call, self.timeout_call):
+            if call is not None:
+                call.cancel()
+        self.poll_call = None
+        self.timeout_call = None
 
     def __finished(self, new_state):
         with self.routine_lock:
             if self.state == NavRoutine.RUNNING:
+                self.__cancel_calls()
                 self._cleanup()
 
                 self.state = new_state
@@ -104,6 +131,9 @@ class NavRoutine(object):
     def get_interactions(self):
         return set(self.interactions)
 
+    def get_watches(self):
+        return set(self.watches)
+
     def is_running(self):
         return (self.state == NavRoutine.RUNNING)
 
@@ -191,6 +221,7 @@ class CompoundRoutine(NavRoutine):
             raise CompoundInterferenceException("Illegal conflict in navigation routine interactions")
 
         self.interactions = set().union(*interactions)
+        self.watches = set().union(*[r.get_watches() for r in self.routines])
 
     def _poll(self):
         # A CompoundRoutine is completed when all its constituent parts have
@@ -234,12 +265,7 @@ class ZeroThrusters(NavRoutine):
         pid.roll.pause()
 
         # Zero the mixer
-        mixer.depth = 0
-        mixer.pitch = 0
-        mixer.yaw = 0
-        mixer.forward = 0
-        mixer.strafe = 0
-        mixer.roll = 0
+        mixer.zero()
 
         # Zero the thrusters
         for v in ("Port", "Star", "Bow", "Stern", "StrafeT", "StrafeB"):
@@ -248,6 +274,7 @@ class ZeroThrusters(NavRoutine):
 
 class SetDepth(NavRoutine):
     interactions = ("Depth",)
+    watches = ("Depth",)
 
     def __init__(self, depth, timeout=-1, tolerance=0.5):
         super(SetDepth, self).__init__(timeout)
@@ -265,6 +292,7 @@ class SetDepth(NavRoutine):
 
 class RelativeDepth(NavRoutine):
     interactions = ("Depth",)
+    watches = ("Depth",)
 
     def __init__(self, amount, timeout=-1, tolerance=0.5):
         super(RelativeDepth, self).__init__(timeout)
@@ -288,7 +316,8 @@ class HoldDepth(RelativeDepth):
         super(HoldDepth, self).__init__(0, timeout)
 
     def _poll(self):
-        self.wait()
+        # Holds until canceled or timed out
+        return NavRoutine.RUNNING
 
 
 class SetRotate(NavRoutine):
@@ -300,20 +329,24 @@ class SetRotate(NavRoutine):
 
     def _start(self):
         pid.yaw.pause()
-        sw.notify.send("THRUSTER_REQUEST", "Yaw %.2f" % (self.rate,))
+        mixer.yaw = self.rate
 
     def _cleanup(self):
-        sw.notify.send("THRUSTER_REQUEST", "Yaw %.2f" % (0))
+        mixer.yaw = 0
 
 
 class SetYaw(NavRoutine):
     interactions = ("Yaw",)
+    watches = ("SEA.Yaw",)
+
+    # Seconds the yaw must stay within tolerance before the routine completes
+    settle_time = 1.5
 
     def __init__(self, angle, timeout=-1, tolerance=5):
         super(SetYaw, self).__init__(timeout)
         self.angle = angle
         self.tolerance = tolerance
-        self.i = 0
+        self.settled_since = None
 
     def _poll(self):
         target_yaw = self.angle + 180
@@ -325,21 +358,26 @@ class SetYaw(NavRoutine):
             current_yaw = (current_yaw + 180) % 360
             diff = abs(target_yaw - current_yaw)
 
-        if diff <= self.tolerance:
-            self.i += 1
-        else:
-            self.i = 0
+        # Polls come whenever the yaw changes, so time the settling rather
+        # than counting polls
+        if diff > self.tolerance:
+            self.settled_since = None
+        elif self.settled_since is None:
+            self.settled_since = clock.now()
 
-        if self.i >= 15:
+        if self.settled_since is not None and \
+                clock.now() - self.settled_since >= self.settle_time:
             return NavRoutine.COMPLETED
         return NavRoutine.RUNNING
 
     def _start(self):
+        self.settled_since = None
         pid.yaw.heading = self.angle
 
 
 class RelativeYaw(NavRoutine):
     interactions = ("Yaw",)
+    watches = ("SEA.Yaw",)
 
     def __init__(self, amount, timeout=-1, tolerance=5):
         super(RelativeYaw, self).__init__(timeout)
@@ -377,7 +415,8 @@ class HoldYaw(RelativeYaw):
         super(HoldYaw, self).__init__(0, timeout)
 
     def _poll(self):
-        self.wait()
+        # Holds until canceled or timed out
+        return NavRoutine.RUNNING
 
 
 def TurnRight():
@@ -464,11 +503,13 @@ class EmergencyBreech(ZeroThrusters):
         # Zero the thrusters by calling to the super class
         super(EmergencyBreech, self)._start()
         mixer.depth = -1.0
+        mixer.flush(force=True)
 
     def _poll(self):
         # Set the mixer depth value each time polled incase a rogue program puts
         # it back
         mixer.depth = -1.0
+        mixer.flush(force=True)
         return NavRoutine.RUNNING
 
     def _stop(self):
@@ -525,6 +566,7 @@ class LoopRoutine(NavRoutine):
         # Calculate interactions
         interactions = [r.get_interactions() for r in self.routines]
         self.interactions = set().union(*interactions)
+        self.watches = set().union(*[r.get_watches() for r in self.routines])
 
     def _poll(self):
 
@@ -578,6 +620,7 @@ class SequentialRoutine(NavRoutine):
         # Calculate interactions
         interactions = [r.get_interactions() for r in self.routines]
         self.interactions = set().union(*interactions)
+        self.watches = set().union(*[r.get_watches() for r in self.routines])
 
     def get_current_routine(self):
         return self.routine_counter
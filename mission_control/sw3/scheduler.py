@@ -0,0 +1,203 @@
+'''
+One thread that runs the polls and timeouts of every nav routine.
+
+Nav routines used to start a thread each to call their _poll every
+polling_interval, plus a threading.Timer for each timeout.  Nested routines
+multiplied those threads, and each one slept a fixed interval between polls,
+however soon the robot reached its target.  Now every routine schedules its
+polls and timeouts on the scheduler, which keeps them in a heap ordered by
+time and runs each one when it is due:
+
+    call = scheduler.call_later(2.5, routine.timeout)
+    call.cancel()
+
+A call may also watch seawolf variables.  When variables_changed() is told
+that one of them changed, the call runs right away instead of waiting until
+it is due.  That is how routines react to a new depth or heading without
+sleeping through the rest of their polling interval.
+
+Calls run one at a time on the scheduler thread, so they must not block.
+
+With threaded set to False no thread is started, and calls only run when
+run_due() is called.  Mission replay uses this to run routines in step with
+its virtual clock.
+'''
+
+import heapq
+import itertools
+import threading
+import traceback
+
+import clock
+
+__all__ = ["scheduler"]
+
+
+class ScheduledCall(object):
+
+    '''A call waiting on the scheduler.  Returned by Scheduler.call_at().'''
+
+    def __init__(self, when, callback, args, watch):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.watch = watch
+        self.cancelled = False
+        self.done = False
+
+    def cancel(self):
+        '''Keeps the call from running, if it hasn't yet.'''
+        self.cancelled = True
+
+    @property
+    def pending(self):
+        return not (self.cancelled or self.done)
+
+    def __repr__(self):
+        return "<ScheduledCall %s at %.3f%s>" % (
+            getattr(self.callback, "__name__", self.callback), self.when,
+            " cancelled" if self.cancelled else "")
+
+
+class Scheduler(object):
+
+    '''Runs calls at given times from a single background thread.
+
+    The thread is started by the first call scheduled, unless threaded is
+    False.
+    '''
+
+    def __init__(self, threaded=True):
+        self.threaded = threaded
+        self._heap = []  # (time, sequence number, ScheduledCall)
+        self._sequence = itertools.count()
+        self._watchers = {}  # Maps variable name -> set of ScheduledCall
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def call_at(self, when, callback, *args, **kwargs):
+        '''Runs callback(*args) at time when, as given by clock.now().
+
+        Arguments:
+
+            watch - Names of seawolf variables.  If variables_changed() is
+                called with one of them first, the call runs right away.
+
+        Returns a ScheduledCall, which can be cancelled.
+        '''
+        watch = tuple(kwargs.pop("watch", ()))
+        if kwargs:
+            raise ValueError("Unexpected keyword arguments: %s" % kwargs)
+
+        call = ScheduledCall(when, callback, args, watch)
+        with self._condition:
+            self._push(when, call)
+            for var in watch:
+                self._watchers.setdefault(var, set()).add(call)
+            self._start()
+            self._condition.notify()
+        return call
+
+    def call_later(self, delay, callback, *args, **kwargs):
+        '''Runs callback(*args) in delay seconds.  See call_at().'''
+        return self.call_at(clock.now() + delay, callback, *args, **kwargs)
+
+    def variables_changed(self, variables):
+        '''Runs the calls watching any of the given variables right away.'''
+        with self._condition:
+            now = clock.now()
+            woken = False
+            for var in variables:
+                for call in self._watchers.pop(var, ()):
+                    if call.pending and call.when > now:
+                        # The old heap entry is skipped once the call is done
+                        self._push(now, call)
+                        woken = True
+            if woken:
+                self._condition.notify()
+
+    def _push(self, when, call):
+        heapq.heappush(self._heap, (when, next(self._sequence), call))
+
+    def run_due(self, now=None):
+        '''Runs every call due by now in the calling thread.
+
+        Calls scheduled by these calls run too, if they are due by now.
+        Returns the number of calls run.
+        '''
+        if now is None:
+            now = clock.now()
+        count = 0
+        while True:
+            with self._condition:
+                call = self._pop_due(now)
+            if call is None:
+                return count
+            self._run(call)
+            count += 1
+
+    def next_time(self):
+        '''Returns when the next call is due, or None if nothing is scheduled.'''
+        with self._condition:
+            self._discard_done()
+            return self._heap[0][0] if self._heap else None
+
+    def _start(self):
+        if self.threaded and self._thread is None:
+            self._thread = threading.Thread(target=self.__runner)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _discard_done(self):
+        while self._heap and not self._heap[0][2].pending:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now):
+        '''Takes the next call due by now off the heap, or returns None.'''
+        self._discard_done()
+        if not self._heap or self._heap[0][0] > now:
+            return None
+
+        call = heapq.heappop(self._heap)[2]
+        call.done = True
+        for var in call.watch:
+            watchers = self._watchers.get(var)
+            if watchers is not None:
+                watchers.discard(call)
+                if not watchers:
+                    del self._watchers[var]
+        return call
+
+    def _next_due(self):
+        '''Waits for the next due call, and returns it.'''
+        with self._condition:
+            while True:
+                call = self._pop_due(clock.now())
+                if call is not None:
+                    return call
+                if not self._heap:
+                    self._condition.wait()
+                else:
+                    clock.wait(self._condition, self._heap[0][0] - clock.now())
+
+    def _run(self, call):
+        try:
+            call.callback(*call.args)
+        except Exception:
+            # One broken routine must not stop every other routine
+            traceback.print_exc()
+
+    def __runner(self):
+        while True:
+            self._run(self._next_due())
+
+    def __len__(self):
+        '''Returns the number of calls waiting to run.'''
+        with self._condition:
+            return len(set(id(call) for _, _, call in self._heap if call.pending))
+
+    def __repr__(self):
+        return "<Scheduler pending=%d>" % len(self)
+
+
+scheduler = Scheduler()
@@ -0,0 +1,193 @@
+'''
+A local cache of seawolf variables.
+
+Reading a variable with sw.var.get asks the hub for it, so every check in a
+routine's _poll or in a mission's step costs a round trip.  The cache
+subscribes to each variable the first time it is read.  From then on a single
+background thread waits in sw.var.sync() for the hub to send changes, and
+reads are served locally:
+
+    depth = variables.get("Depth")
+    if variables.age("Depth") > 1:
+        print "Depth hasn't changed in over a second"
+
+Waiting for a variable to change doesn't need a polling loop either:
+
+    variables.wait_changed(["Depth"], timeout=5)
+
+Every change also wakes the sw3 scheduler calls watching the variable, so
+nav routines are polled as soon as what they wait for changes.
+
+Listeners added with add_listener() see every value that comes from the
+hub, which is how mission recordings capture the variables a mission read.
+With threaded set to False no background thread is started, and values only
+change through update().  Mission replay feeds recorded values that way.
+'''
+
+import threading
+import traceback
+
+import seawolf as sw
+
+import clock
+from scheduler import scheduler
+
+__all__ = ["variables"]
+
+# Seconds to wait before syncing again after sw.var.sync() fails
+SYNC_RETRY_DELAY = 0.5
+
+
+class VariableCache(object):
+
+    '''Serves seawolf variables from a cache kept up to date in the background.
+
+    The background thread is started by the first variable read, unless
+    threaded is False.
+    '''
+
+    def __init__(self, threaded=True):
+        self.threaded = threaded
+        self._values = {}  # Maps name -> value
+        self._updated = {}  # Maps name -> time of the last change
+        self._versions = {}  # Maps name -> number of changes
+        self._changed = threading.Condition()
+        self._thread = None
+        self._listeners = []
+
+    def subscribe(self, *names):
+        '''Starts caching the given variables, if they aren't already.'''
+        new_names = [name for name in names if name not in self._values]
+        if not new_names:
+            return
+        for name in new_names:
+            sw.var.subscribe(name)
+            # The first value has to be asked for.  Changes come by sync.
+            value = sw.var.get(name)
+            with self._changed:
+                if name in self._values:
+                    continue
+                self._values[name] = value
+                self._updated[name] = clock.now()
+                self._versions[name] = 0
+            self._notify_listeners({name: value})
+        self._start()
+
+    def get(self, name):
+        '''Returns the cached value of a variable.'''
+        try:
+            return self._values[name]
+        except KeyError:
+            self.subscribe(name)
+            return self._values[name]
+
+    def set(self, name, value):
+        '''Sets a variable on the hub, and in the cache right away.'''
+        sw.var.set(name, value)
+        self._store({name: value})
+
+    def updated(self, name):
+        '''Returns the time the variable last changed, or None if not cached.'''
+        return self._updated.get(name)
+
+    def age(self, name):
+        '''Returns the seconds since the variable last changed.'''
+        self.subscribe(name)
+        return clock.now() - self._updated[name]
+
+    def version(self, name):
+        '''Returns how many times the variable has changed since cached.'''
+        self.subscribe(name)
+        return self._versions[name]
+
+    def wait_changed(self, names, timeout=None):
+        '''Blocks until one of the given variables changes.
+
+        Returns the names of the variables that changed, or an empty list if
+        timeout seconds passed first.
+        '''
+        if isinstance(names, basestring):
+            names = [names]
+        self.subscribe(*names)
+
+        deadline = None if timeout is None else clock.now() + timeout
+        with self._changed:
+            start = dict((name, self._versions[name]) for name in names)
+            while True:
+                changed = [name for name in names
+                           if self._versions[name] != start[name]]
+                if changed:
+                    return changed
+                if deadline is None:
+                    self._changed.wait()
+                else:
+                    remaining = deadline - clock.now()
+                    if remaining <= 0:
+                        return []
+                    clock.wait(self._changed, remaining)
+
+    def update(self, values):
+        '''Takes new values of variables from the hub.
+
+        values maps variable names to values.  Variables that aren't cached
+        are ignored.
+        '''
+        values = self._store(values)
+        if values:
+            self._notify_listeners(values)
+
+    def add_listener(self, callback):
+        '''Calls callback(values, timestamp) with every value from the hub.'''
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def _store(self, values):
+        with self._changed:
+            now = clock.now()
+            values = dict((name, value) for name, value in values.iteritems()
+                          if name in self._values)
+            for name, value in values.iteritems():
+                self._values[name] = value
+                self._updated[name] = now
+                self._versions[name] += 1
+            self._changed.notify_all()
+        if values:
+            scheduler.variables_changed(values.keys())
+        return values
+
+    def _notify_listeners(self, values):
+        now = clock.now()
+        for callback in self._listeners:
+            callback(values, now)
+
+    def _start(self):
+        with self._changed:
+            if not self.threaded or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.__reader)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __reader(self):
+        while True:
+            try:
+                # Blocks until the hub sends a change to a subscribed variable
+                sw.var.sync()
+                changes = {}
+                for name in self._values.keys():
+                    if sw.var.stale(name):
+                        changes[name] = sw.var.get(name)
+            except Exception:
+                traceback.print_exc()
+                clock.sleep(SYNC_RETRY_DELAY)
+                continue
+            if changes:
+                self.update(changes)
+
+    def __repr__(self):
+        return "<VariableCache variables=%d>" % len(self._values)
+
+
+variables = VariableCache()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+
+'''Replays recorded footage through vision entities and measures throughput.
+
+The source argument is either a video file or a directory of recorded frames,
+such as one written by libvision.Camera's record_path ("<n>.jpg" files).  Each
+entity is run headless in its own process: no SVR connection is made and no
+windows are opened.  For every entity the frames/sec, the per-frame latency
+distribution and the peak RSS of the process are reported.
+
+Results can be written as JSON with -o, and compared against an earlier
+results file with -b.  When comparing, the exit status is nonzero if any
+entity got slower than the tolerance allows.
+
+With -s, every entity is also run with a libvision.ScalePolicy of each given
+scale, to measure what downscaling gains in speed and costs in accuracy.
+Accuracy is measured against the full resolution run: how many of its
+detections were also found (recall, within --match-distance pixels), how far
+off they were, and on how many frames both runs agreed whether anything was
+found at all.
+
+'''
+
+from __future__ import division
+import sys
+import os.path
+import json
+import time
+import resource
+import traceback
+from multiprocessing import Process, Pipe
+
+# Add repository root to sys.path
+parent_directory = os.path.realpath(os.path.join(
+    os.path.abspath(__file__),
+    "../.."
+))
+sys.path.append(parent_directory)
+
+import argparse
+import numpy as np
+import cv
+import cv2
+
+import svr
+
+import entities
+import libvision
+from vision.profiler import FrameProfiler
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".ppm", ".pgm")
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+
+# Output attributes holding image positions, for measuring accuracy.  These
+# are looked for on the output itself and on the objects in its lists.
+POSITION_ATTRS = (("centerx", "centery"), ("midx", "midy"))
+# Output attributes holding a horizontal position only
+X_POSITION_ATTRS = ("left_pole", "right_pole")
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument("source",
+                        type=str, help="A video file or a directory of recorded frames")
+
+    parser.add_argument("-e", "--entity",
+                        help="Entity to benchmark.  May be given more than once.  Default is every entity in entities.entity_classes",
+                        type=str, dest="entities", default=[], action="append")
+
+    parser.add_argument("-n", "--max-frames",
+                        help="Stop after this many frames",
+                        type=int, dest="max_frames", default=None)
+
+    parser.add_argument("-w", "--warmup",
+                        help="Number of frames processed before timing starts.  Default is 5",
+                        type=int, dest="warmup", default=5)
+
+    parser.add_argument("-o", "--output",
+                        help="Write results to this JSON file",
+                        type=str, dest="output", default=None)
+
+    parser.add_argument("-b", "--baseline",
+                        help="Compare results against this JSON results file",
+                        type=str, dest="baseline", default=None)
+
+    parser.add_argument("-t", "--tolerance",
+                        help="Allowed slowdown against the baseline, in percent.  Default is 10",
+                        type=float, dest="tolerance", default=10.0)
+
+    parser.add_argument("-s", "--scale",
+                        help="Also run each entity downscaled by this factor, and measure its accuracy.  May be given more than once",
+                        type=float, dest="scales", default=[], action="append")
+
+    parser.add_argument("--no-refine",
+                        help="When downscaling, don't refine detections at full resolution",
+                        dest="refine", default=True, action="store_false")
+
+    parser.add_argument("--match-distance",
+                        help="How close, in pixels, a downscaled detection must be to count as found.  Default is 10",
+                        type=float, dest="match_distance", default=10.0)
+
+    return parser
+
+
+class ReplayCapture(object):
+
+    '''Reads frames from a video file or a directory of image files.'''
+
+    def __init__(self, source, max_frames=None):
+        self.source = source
+        self.max_frames = max_frames
+
+    def frames(self):
+        '''Generates every frame of the source as a new cv image.'''
+        count = 0
+        for frame in self._frames():
+            if self.max_frames is not None and count >= self.max_frames:
+                return
+            count += 1
+            yield frame
+
+    def _frames(self):
+        if os.path.isdir(self.source):
+            for filename in frame_filenames(self.source):
+                yield cv.LoadImage(filename)
+        else:
+            capture = cv.CaptureFromFile(self.source)
+            while True:
+                frame = cv.QueryFrame(capture)
+                if not frame:
+                    return
+                # QueryFrame reuses its buffer between calls
+                yield cv.CloneImage(frame)
+
+
+def frame_filenames(directory):
+    '''Returns the image files in directory, in recording order.'''
+    def sort_key(filename):
+        stem = os.path.splitext(filename)[0]
+        try:
+            return (0, int(stem), filename)
+        except ValueError:
+            return (1, 0, filename)
+
+    filenames = [f for f in os.listdir(directory)
+                 if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS]
+    return [os.path.join(directory, f) for f in sorted(filenames, key=sort_key)]
+
+
+class BenchmarkPipe(object):
+
+    '''Stands in for the entity's pipe to mission control and counts outputs.
+
+    The positions reported by each output are recorded in self.detections,
+    under the frame number in self.frame.
+    '''
+
+    def __init__(self):
+        self.outputs = 0
+        self.frame = None
+        self.detections = {}
+
+    def poll(self, timeout=0):
+        return False
+
+    def send(self, data):
+        self.outputs += 1
+        # Entities keep changing the objects they sent, so the positions are
+        # read right away
+        if self.frame is not None:
+            self.detections[self.frame] = output_points(data)
+
+
+def output_points(output):
+    '''Returns the image positions an entity output reports, as (x, y) pairs.'''
+    objects = [output]
+    for value in vars(output).values():
+        if isinstance(value, (list, tuple)):
+            objects.extend(value)
+
+    points = []
+    for obj in objects:
+        for x_attr, y_attr in POSITION_ATTRS:
+            x = getattr(obj, x_attr, None)
+            y = getattr(obj, y_attr, None)
+            if x is not None and y is not None:
+                points.append((float(x), float(y)))
+        for x_attr in X_POSITION_ATTRS:
+            x = getattr(obj, x_attr, None)
+            if x is not None:
+                points.append((float(x), 0.0))
+    return points
+
+
+def accuracy(full, scaled, match_distance):
+    '''
+    Compares the detections of a downscaled run against those of the full
+    resolution run.  Both are dicts of frame number -> list of (x, y).
+    Returns a dict of results.
+    '''
+    frames = set(full) | set(scaled)
+    agreed = 0
+    found = 0
+    total = 0
+    errors = []
+    for frame in frames:
+        full_points = np.array(full.get(frame, []), float).reshape(-1, 2)
+        scaled_points = np.array(scaled.get(frame, []), float).reshape(-1, 2)
+        if bool(len(full_points)) == bool(len(scaled_points)):
+            agreed += 1
+        total += len(full_points)
+        if not len(full_points) or not len(scaled_points):
+            continue
+
+        distances = np.sqrt(((full_points[:, np.newaxis] - scaled_points[np.newaxis]) ** 2).sum(axis=2))
+        nearest = distances.min(axis=1)
+        matched = nearest <= match_distance
+        found += matched.sum()
+        errors.extend(nearest[matched])
+
+    return {
+        "frames_agreed": agreed / len(frames) if frames else 1.0,
+        "recall": found / total if total else 1.0,
+        "detections": total,
+        "mean_error_px": float(np.mean(errors)) if errors else None,
+        "max_error_px": float(np.max(errors)) if errors else None,
+    }
+
+
+def make_headless():
+    '''
+    Replaces the GUI and SVR debug functions that entities call with no-ops,
+    so entities can run without a display or an SVR server.  Only call this
+    in a benchmark process.
+    '''
+    def no_op(*args, **kwargs):
+        pass
+
+    svr.debug = no_op
+    cv.NamedWindow = no_op
+    cv.ShowImage = no_op
+    cv.CreateTrackbar = no_op
+    cv.WaitKey = no_op
+    cv2.namedWindow = no_op
+    cv2.imshow = no_op
+    cv2.waitKey = no_op
+
+
+def benchmark_entity(entity_cls, source, max_frames=None, warmup=5,
+                     scale_policy=None):
+    '''Runs every frame of source through a new entity_cls.
+
+    Returns a dict of results.  This should be called in its own process, so
+    that the peak RSS reported belongs to this entity alone.  If scale_policy
+    is given, the entity uses it instead of its own.
+    '''
+    make_headless()
+
+    pipe = BenchmarkPipe()
+    entity = entity_cls(pipe, "replay", cameras={"replay": source}, debug=False,
+                        debug_output=[], scale_policy=scale_policy)
+
+    # Keep stage timings for every frame, without writing a stats file
+    entity.profiler = FrameProfiler(entity_cls.__name__, window=None)
+
+    latencies = []
+    frames = 0
+    start = None
+    for frame in ReplayCapture(source, max_frames).frames():
+        frames += 1
+        if frames == warmup + 1:
+            start = time.time()
+
+        pipe.frame = frames
+        entity.profiler.start_frame()
+        frame_start = time.time()
+        entity.handle_frame(frame)
+        latency = time.time() - frame_start
+        entity.profiler.end_frame()
+
+        if frames > warmup:
+            latencies.append(latency)
+
+    if not latencies:
+        raise ValueError("No frames were timed.  The source has %d frames and "
+                         "%d warmup frames were requested." % (frames, warmup))
+    elapsed = time.time() - start
+
+    latencies = np.array(latencies) * 1000
+    latency_stats = {
+        "mean": float(latencies.mean()),
+        "max": float(latencies.max()),
+    }
+    for percentile, value in zip(LATENCY_PERCENTILES,
+                                 np.percentile(latencies, LATENCY_PERCENTILES)):
+        latency_stats["p%d" % percentile] = float(value)
+
+    return {
+        "frames": len(latencies),
+        "fps": len(latencies) / elapsed,
+        "latency_ms": latency_stats,
+        "stages": entity.profiler.stats(),
+        "outputs": pipe.outputs,
+        "detections": pipe.detections,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _run_benchmark(conn, entity_cls, source, max_frames, warmup, scale_policy):
+    try:
+        result = benchmark_entity(entity_cls, source, max_frames, warmup,
+                                  scale_policy)
+    except Exception:
+        result = {"error": traceback.format_exc()}
+    conn.send(result)
+
+
+def run_benchmark(entity_cls, source, max_frames=None, warmup=5,
+                  scale_policy=None):
+    '''Benchmarks entity_cls in a child process and returns its results.'''
+    parent_conn, child_conn = Pipe()
+    process = Process(target=_run_benchmark,
+                      args=(child_conn, entity_cls, source, max_frames, warmup,
+                            scale_policy))
+    process.start()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {"error": "Benchmark process died with exit code %s" % process.exitcode}
+    process.join()
+    return result
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Prints how each entity did against the baseline.  Returns a list of the
+    names of entities that got slower than tolerance percent allows.
+    '''
+    regressions = []
+    print "%-16s %10s %10s %8s %12s %12s %8s" % (
+        "entity", "fps", "base fps", "change", "p95 ms", "base p95 ms", "change")
+    for name in sorted(results):
+        result = results[name]
+        base = baseline.get(name)
+        if "error" in result or base is None or "error" in base:
+            continue
+
+        fps_change = (result["fps"] - base["fps"]) / base["fps"] * 100
+        p95 = result["latency_ms"]["p95"]
+        base_p95 = base["latency_ms"]["p95"]
+        p95_change = (p95 - base_p95) / base_p95 * 100
+
+        flag = ""
+        if fps_change < -tolerance or p95_change > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print "%-16s %10.1f %10.1f %+7.1f%% %12.2f %12.2f %+7.1f%%%s" % (
+            name, result["fps"], base["fps"], fps_change,
+            p95, base_p95, p95_change, flag)
+    return regressions
+
+
+def print_result(result):
+    if "error" in result:
+        print "  FAILED:"
+        print result["error"]
+        return
+
+    print "  %d frames, %.1f frames/sec, p50 %.2f ms, p95 %.2f ms, peak RSS %d kB" % (
+        result["frames"], result["fps"],
+        result["latency_ms"]["p50"], result["latency_ms"]["p95"],
+        result["peak_rss_kb"])
+    if "accuracy" in result:
+        acc = result["accuracy"]
+        error = acc["mean_error_px"]
+        print "  %.2fx speed, recall %.1f%% of %d detections, mean error %s px, frames agreed %.1f%%" % (
+            result["speedup"], acc["recall"] * 100, acc["detections"],
+            "-" if error is None else "%.1f" % error,
+            acc["frames_agreed"] * 100)
+
+
+def main():
+    parser = setup_parser()
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        parser.error("Source '%s' does not exist." % args.source)
+
+    entity_names = args.entities or sorted(entities.entity_classes.keys())
+    for name in entity_names:
+        if name not in entities.entity_classes:
+            parser.error("'%s' is not a valid entity. Please check entities.entity_classes for valid names" % name)
+
+    results = {}
+    for name in entity_names:
+        print "Benchmarking %s..." % name
+        result = run_benchmark(entities.entity_classes[name], args.source,
+                               args.max_frames, args.warmup)
+        results[name] = result
+        print_result(result)
+
+        for scale in args.scales:
+            print "Benchmarking %s at scale %s..." % (name, scale)
+            policy = libvision.ScalePolicy(scale, refine=args.refine)
+            scaled = run_benchmark(entities.entity_classes[name], args.source,
+                                   args.max_frames, args.warmup, policy)
+            results["%s@%s" % (name, scale)] = scaled
+            if "error" not in scaled and "error" not in result:
+                scaled["speedup"] = scaled["fps"] / result["fps"]
+                scaled["accuracy"] = accuracy(result["detections"],
+                                              scaled["detections"],
+                                              args.match_distance)
+            print_result(scaled)
+
+    # Detections are only needed for comparing runs
+    for result in results.values():
+        result.pop("detections", None)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "source": os.path.abspath(args.source),
+                "time": time.time(),
+                "entities": results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["entities"]
+        print
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print
+            print "Regressions: %s" % ", ".join(regressions)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+'''Times libvision.hough_line_reduce on line segments from recorded footage.
+
+The source argument is a video file or a directory of recorded frames, as for
+benchmark.py.  Every frame is run through PathsEntity headless, and the
+HoughLinesP segments it hands to the line reducer are recorded.  The line
+reducer is then timed alone on every recorded set of segments.
+
+Results can be written as JSON with -o, and compared against an earlier
+results file with -b.  When comparing, the exit status is nonzero if the line
+reducer got slower than the tolerance allows.
+
+'''
+
+from __future__ import division
+import sys
+import os.path
+import json
+import time
+
+# Add repository root to sys.path
+parent_directory = os.path.realpath(os.path.join(
+    os.path.abspath(__file__),
+    "../.."
+))
+sys.path.append(parent_directory)
+
+import argparse
+import numpy as np
+
+import libvision
+import entities
+from benchmark import ReplayCapture, BenchmarkPipe, make_headless, LATENCY_PERCENTILES
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument("source",
+                        type=str, help="A video file or a directory of recorded path frames")
+
+    parser.add_argument("-n", "--max-frames",
+                        help="Stop after this many frames",
+                        type=int, dest="max_frames", default=None)
+
+    parser.add_argument("-r", "--repeat",
+                        help="Number of times the line reducer is run on each frame's segments.  Default is 5",
+                        type=int, dest="repeat", default=5)
+
+    parser.add_argument("-o", "--output",
+                        help="Write results to this JSON file",
+                        type=str, dest="output", default=None)
+
+    parser.add_argument("-b", "--baseline",
+                        help="Compare results against this JSON results file",
+                        type=str, dest="baseline", default=None)
+
+    parser.add_argument("-t", "--tolerance",
+                        help="Allowed slowdown against the baseline, in percent.  Default is 10",
+                        type=float, dest="tolerance", default=10.0)
+
+    return parser
+
+
+def record_segments(source, max_frames=None):
+    '''
+    Runs the frames of source through PathsEntity and returns every set of
+    segments it passed to hough_line_reduce, along with its arguments.
+    '''
+    make_headless()
+
+    recorded = []
+    hough_line_reduce = libvision.hough_line_reduce
+
+    def recording_line_reduce(lines, *args, **kwargs):
+        recorded.append((lines.copy(), args, kwargs))
+        return hough_line_reduce(lines, *args, **kwargs)
+
+    libvision.hough_line_reduce = recording_line_reduce
+    try:
+        entity = entities.PathsEntity(BenchmarkPipe(), "replay",
+                                      cameras={"replay": source}, debug=False)
+        for frame in ReplayCapture(source, max_frames).frames():
+            entity.handle_frame(frame)
+    finally:
+        libvision.hough_line_reduce = hough_line_reduce
+
+    return recorded
+
+
+def time_line_reduce(recorded, repeat=5):
+    '''Times hough_line_reduce on each recorded set of segments.
+
+    The fastest of repeat runs is taken for each set.  Returns a dict of
+    results.
+    '''
+    latencies = []
+    for lines, args, kwargs in recorded:
+        best = None
+        for i in xrange(repeat):
+            start = time.time()
+            libvision.hough_line_reduce(lines, *args, **kwargs)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        latencies.append(best)
+
+    segments = np.array([lines.shape[1] for lines, args, kwargs in recorded])
+    latencies = np.array(latencies) * 1000
+    latency_stats = {
+        "mean": float(latencies.mean()),
+        "max": float(latencies.max()),
+    }
+    for percentile, value in zip(LATENCY_PERCENTILES,
+                                 np.percentile(latencies, LATENCY_PERCENTILES)):
+        latency_stats["p%d" % percentile] = float(value)
+
+    return {
+        "calls": len(recorded),
+        "segments_mean": float(segments.mean()),
+        "segments_max": int(segments.max()),
+        "latency_ms": latency_stats,
+    }
+
+
+def main():
+    parser = setup_parser()
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        parser.error("Source '%s' does not exist." % args.source)
+
+    print "Recording segments..."
+    recorded = record_segments(args.source, args.max_frames)
+    if not recorded:
+        print "No segments were found in any frame."
+        sys.exit(1)
+
+    print "Timing hough_line_reduce on %d frames..." % len(recorded)
+    result = time_line_reduce(recorded, args.repeat)
+    print "  %.1f segments/frame (max %d), mean %.2f ms, p95 %.2f ms, max %.2f ms" % (
+        result["segments_mean"], result["segments_max"],
+        result["latency_ms"]["mean"], result["latency_ms"]["p95"],
+        result["latency_ms"]["max"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "source": os.path.abspath(args.source),
+                "time": time.time(),
+                "line_reducer": result,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            base = json.load(f)["line_reducer"]
+        p95 = result["latency_ms"]["p95"]
+        base_p95 = base["latency_ms"]["p95"]
+        change = (p95 - base_p95) / base_p95 * 100
+        print
+        print "p95 %.2f ms, baseline %.2f ms (%+.1f%%)" % (p95, base_p95, change)
+        if change > args.tolerance:
+            print "Regression"
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
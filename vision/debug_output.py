@@ -0,0 +1,368 @@
+'''
+Background debug output.
+
+Showing a debug frame with cv2.imshow/cv2.waitKey, sending it with
+svr.debug or writing it to disk right in the frame loop slows the entity
+down and changes its timing.  A DebugOutput takes debug frames from the
+entity and publishes only as many as are wanted:
+
+    - Each stream is published at most max_rate times a second.  Frames in
+      between are dropped before anything is copied, so they cost next to
+      nothing.
+    - Frames are published to any number of sinks:
+
+        svr - Sent with svr.debug.
+        window - Shown with cv2.imshow.  Needs a display.
+        disk:<directory> - Written to <directory>/<stream>/<n>.jpg.
+        ring[:<size>] - The last size frames of each stream are kept in
+            memory, JPEG encoded.  See RingSink.
+
+    - The disk and ring sinks are written from a background thread, which
+      does their JPEG encoding.  At most queue_size frames wait for it.  If
+      it falls behind, new frames are dropped for those sinks rather than
+      making the entity wait.  The svr and window sinks still get them.
+    - svr and cv2's GUI functions must only be used from the thread that
+      captures the frames, so the svr and window sinks are written by
+      flush(), which the entity calls once per frame.  Only the newest frame
+      of each stream waits for it.  svr.debug takes a cv image and encodes
+      it itself, so sending to svr is still synchronous.  It is only kept
+      cheap by the rate limit.
+
+install_svr_debug() routes the svr.debug calls made throughout the entities
+through a DebugOutput with only an svr sink, once per process.  When debug
+output is off, entities get NULL_DEBUG_OUTPUT, whose publish() does nothing
+at all.
+'''
+
+import os
+import re
+import threading
+import time
+import logging
+from collections import deque
+
+import cv
+import cv2
+import numpy as np
+
+import svr
+import libvision
+
+DEFAULT_MAX_RATE = 5.0
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_RING_SIZE = 30
+
+# The svr.debug that install_svr_debug() replaced, and the DebugOutput that
+# replaced it
+_svr_debug = None
+_svr_debug_output = None
+
+
+class SvrSink(object):
+
+    '''Sends frames to svr.'''
+
+    main_thread = True
+
+    def write(self, name, frame, timestamp):
+        if isinstance(frame, np.ndarray):
+            frame = libvision.cv2_to_cv(frame)
+        (_svr_debug or svr.debug)(name, frame)
+
+    def __repr__(self):
+        return "<SvrSink>"
+
+
+class WindowSink(object):
+
+    '''Shows frames in a window per stream.'''
+
+    main_thread = True
+
+    def write(self, name, frame, timestamp):
+        cv2.imshow(name, as_array(frame))
+        cv2.waitKey(1)
+
+    def __repr__(self):
+        return "<WindowSink>"
+
+
+class DiskSink(object):
+
+    '''Writes frames to <directory>/<stream name>/<n><extension>.'''
+
+    main_thread = False
+
+    def __init__(self, directory, extension=".jpg"):
+        self.directory = directory
+        self.extension = extension
+        self._counts = {}
+
+    def write(self, name, frame, timestamp):
+        stream_directory = os.path.join(self.directory, safe_name(name))
+        count = self._counts.get(name, 0)
+        if count == 0 and not os.path.exists(stream_directory):
+            os.makedirs(stream_directory)
+        filename = os.path.join(stream_directory, "%d%s" % (count, self.extension))
+        cv2.imwrite(filename, as_array(frame))
+        self._counts[name] = count + 1
+
+    def __repr__(self):
+        return "<DiskSink directory=%s>" % self.directory
+
+
+class RingSink(object):
+
+    '''Keeps the last size frames of every stream in memory.
+
+    Frames are kept JPEG encoded, as (timestamp, data) pairs.  Useful for
+    looking at what an entity saw just before something went wrong.
+    '''
+
+    main_thread = False
+
+    def __init__(self, size=DEFAULT_RING_SIZE, extension=".jpg"):
+        self.size = size
+        self.extension = extension
+        self._lock = threading.Lock()
+        self._frames = {}  # Maps stream name -> deque of (timestamp, data)
+
+    def write(self, name, frame, timestamp):
+        ok, data = cv2.imencode(self.extension, as_array(frame))
+        if not ok:
+            return
+        with self._lock:
+            if name not in self._frames:
+                self._frames[name] = deque(maxlen=self.size)
+            self._frames[name].append((timestamp, data.tostring()))
+
+    def names(self):
+        with self._lock:
+            return sorted(self._frames.keys())
+
+    def frames(self, name):
+        '''Returns the (timestamp, encoded data) pairs of a stream, oldest first.'''
+        with self._lock:
+            return list(self._frames.get(name, ()))
+
+    def latest(self, name):
+        '''Returns the newest frame of a stream, decoded, or None.'''
+        frames = self.frames(name)
+        if not frames:
+            return None
+        data = np.frombuffer(frames[-1][1], np.uint8)
+        return cv2.imdecode(data, -1)
+
+    def __repr__(self):
+        return "<RingSink size=%d streams=%d>" % (self.size, len(self.names()))
+
+
+def make_sink(spec):
+    '''Returns the sink described by a string like "svr" or "disk:debug".'''
+    kind, _, argument = spec.partition(":")
+    if kind == "svr":
+        return SvrSink()
+    if kind == "window":
+        return WindowSink()
+    if kind == "disk":
+        if not argument:
+            raise ValueError("The disk debug sink needs a directory, as in 'disk:<directory>'.")
+        return DiskSink(argument)
+    if kind == "ring":
+        return RingSink(int(argument) if argument else DEFAULT_RING_SIZE)
+    raise ValueError("Unknown debug sink '%s'.  Must be svr, window, "
+                     "disk:<directory> or ring[:<size>]." % spec)
+
+
+class DebugOutput(object):
+
+    '''Publishes debug frames to sinks, rate limited.
+
+    Arguments:
+
+        sinks - Sink objects, or strings understood by make_sink().  Sinks
+            whose main_thread attribute is True are written by flush(), the
+            others from a background thread.
+
+        max_rate - Maximum frames per second published for each stream.
+
+        queue_size - Maximum frames waiting for the background thread.  Frames
+            dropped because it is full still go to the main thread sinks.
+
+    '''
+
+    enabled = True
+
+    def __init__(self, sinks, max_rate=DEFAULT_MAX_RATE,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        sinks = [make_sink(s) if isinstance(s, basestring) else s
+                 for s in sinks]
+        self.main_thread_sinks = [s for s in sinks if getattr(s, "main_thread", False)]
+        self.background_sinks = [s for s in sinks if not getattr(s, "main_thread", False)]
+        self.min_interval = 1.0 / max_rate if max_rate else 0
+        self.queue_size = queue_size
+
+        self._last_published = {}  # Maps stream name -> time
+        self._pending = {}  # Maps stream name -> (frame, time), for flush()
+        self._queue = deque()
+        self._not_empty = threading.Condition()
+        self._running = True
+
+        self.published = 0
+        self.rate_dropped = 0
+        self.queue_dropped = 0
+
+        self._thread = None
+        if self.background_sinks:
+            self._thread = threading.Thread(target=self._publish_loop)
+            self._thread.daemon = True
+            self._thread.start()
+
+    @property
+    def sinks(self):
+        return self.main_thread_sinks + self.background_sinks
+
+    def publish(self, name, frame):
+        '''Queues a cv image or NumPy array to be published as stream name.
+
+        Returns right away.  The frame is copied only if it will be
+        published, so the caller may keep modifying it.
+        '''
+        now = time.time()
+        last = self._last_published.get(name)
+        if last is not None and now - last < self.min_interval:
+            self.rate_dropped += 1
+            return
+
+        # A full queue only holds back the background sinks
+        queue = self.background_sinks and len(self._queue) < self.queue_size
+        if self.background_sinks and not queue:
+            self.queue_dropped += 1
+            if not self.main_thread_sinks:
+                return
+        self._last_published[name] = now
+        self.published += 1
+        frame = copy_frame(frame)
+
+        if self.main_thread_sinks:
+            self._pending[name] = (frame, now)
+        if queue:
+            with self._not_empty:
+                self._queue.append((name, frame, now))
+                self._not_empty.notify()
+
+    def flush(self):
+        '''Writes the frames published since the last flush to the sinks that
+        must be written from the main thread, like svr and window.  Call it
+        from the thread that captures frames.'''
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        for name, (frame, timestamp) in pending.iteritems():
+            self._write(self.main_thread_sinks, name, frame, timestamp)
+
+    def _publish_loop(self):
+        while True:
+            with self._not_empty:
+                while self._running and not self._queue:
+                    self._not_empty.wait(0.5)
+                if not self._queue:
+                    return
+                name, frame, timestamp = self._queue.popleft()
+            self._write(self.background_sinks, name, frame, timestamp)
+
+    def _write(self, sinks, name, frame, timestamp):
+        for sink in list(sinks):
+            try:
+                sink.write(name, frame, timestamp)
+            except Exception:
+                # A sink that fails once, like a window without a display,
+                # would most likely fail every time
+                logging.exception("Debug sink %r failed and was removed", sink)
+                sinks.remove(sink)
+
+    def close(self):
+        '''Publishes the frames still waiting, then stops the thread.  Call it
+        from the thread that captures frames.'''
+        self.flush()
+        with self._not_empty:
+            self._running = False
+            self._not_empty.notify()
+
+    def __repr__(self):
+        return "<DebugOutput sinks=%s published=%d dropped=%d>" % (
+            self.sinks, self.published, self.rate_dropped + self.queue_dropped)
+
+
+class NullDebugOutput(object):
+
+    '''Stands in for a DebugOutput when debug output is off.'''
+
+    enabled = False
+
+    def publish(self, name, frame):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return "<NullDebugOutput>"
+
+
+NULL_DEBUG_OUTPUT = NullDebugOutput()
+
+
+def default_sinks(sinks, debug):
+    '''Returns sinks, or if it is None the default sinks: svr, plus window in
+    debug mode.'''
+    if sinks is not None:
+        return sinks
+    return ["svr", "window"] if debug else ["svr"]
+
+
+def install_svr_debug(sinks=("svr",), max_rate=DEFAULT_MAX_RATE):
+    '''Routes svr.debug through a DebugOutput publishing to sinks.
+
+    Window sinks are left out, since only debug_stream() opens windows.  Only
+    the first call in a process replaces svr.debug, so call it where the
+    process starts, not per entity.  Returns the process's DebugOutput, which
+    has to be flushed from the thread that captures frames, as with
+    flush_svr_debug().
+    '''
+    global _svr_debug, _svr_debug_output
+    if _svr_debug_output is None:
+        sinks = [s for s in sinks if s != "window" and not isinstance(s, WindowSink)]
+        _svr_debug = svr.debug
+        if sinks:
+            _svr_debug_output = DebugOutput(sinks, max_rate)
+        else:
+            _svr_debug_output = NULL_DEBUG_OUTPUT
+        svr.debug = _svr_debug_output.publish
+    return _svr_debug_output
+
+
+def flush_svr_debug():
+    '''Sends the frames waiting in the svr.debug DebugOutput, if installed.'''
+    if _svr_debug_output is not None:
+        _svr_debug_output.flush()
+
+
+def copy_frame(frame):
+    if isinstance(frame, np.ndarray):
+        return frame.copy()
+    return cv.CloneImage(frame)
+
+
+def as_array(frame):
+    if isinstance(frame, np.ndarray):
+        return frame
+    return libvision.cv_to_cv2(frame)
+
+
+def safe_name(name):
+    '''Returns name with anything that doesn't belong in a filename replaced.'''
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "stream"
@@ -3,6 +3,11 @@ import os
 
 import libvision
 import vision
+from vision.profiler import FrameProfiler
+from vision.frame_grabber import LatestFrameCapture, DEFAULT_EVERY_NTH, DEFAULT_DEADLINE
+from vision.search_track import SearchTrackMode, DEFAULT_SEARCH_INTERVAL
+from vision.debug_output import DebugOutput, NULL_DEBUG_OUTPUT, DEFAULT_MAX_RATE, \
+    default_sinks, flush_svr_debug
 import svr
 
 import cv2
@@ -32,6 +37,14 @@ class VisionEntity(object):
     # A human readable name for this entity
     name = "VisionEntity"
 
+    # If True, the ProcessManager passes a shared FrameBus for this entity's
+    # camera in the frame_bus keyword argument.
+    uses_frame_bus = True
+
+    # At which resolution the entity detects its targets.  Entities that
+    # support coarse to fine detection read this.  See libvision/pyramid.py.
+    scale_policy = libvision.FULL_RESOLUTION
+
     """instantiates an entity
     args:
         camera_name -- string indicating which camera/stream the entity,
@@ -50,6 +63,52 @@ class VisionEntity(object):
     more details.
       
       debug: simple.
+
+      frame_bus -- a vision.frame_bus.FrameBus to read frames from.  When given,
+    the entity does not open its own camera or stream.
+
+      capture -- an already opened capture (anything with get_frame()) to use
+    instead of opening a camera or stream.
+
+      preprocess -- a libvision.FrameCache shared with other entities.  Its owner
+    is responsible for calling new_frame().  By default every entity has its
+    own.
+
+      process_name -- the name the ProcessManager runs the entity under.  Two
+    entities of the same class have different process names.
+
+      profile -- if True, time each stage of the frame loop and write rolling
+    percentiles to profile_path (default "profile/<process name>.json", or
+    "profile/<entity class>.json" without a process name).  See
+    vision/profiler.py.
+
+      drop_policy -- if given, frames are grabbed in the background and only
+    the newest is processed, dropping frames according to the policy:
+    "newest", "every_nth" (with every_nth) or "deadline" (with frame_deadline,
+    in seconds).  See vision/frame_grabber.py.  By default every frame is
+    processed in lockstep.  Ignored when a capture is given.
+
+      track_mode -- if True (the default), entities that support it process
+    only regions around their confirmed targets, with a full frame search
+    every search_interval frames or when a target is lost.  See
+    vision/search_track.py.
+
+      debug_output -- debug sinks to publish debug_stream() frames to, at
+    most debug_rate frames/sec per stream.  A list of "svr", "window",
+    "disk:<directory>" and "ring[:<size>]".  Defaults to svr, plus window in
+    debug mode.  The process started by the ProcessManager publishes
+    svr.debug frames to the same sinks, except window.  See
+    vision/debug_output.py.
+
+      threads -- number of threads the entity may use for processing parts
+    of a frame in parallel, 0 for one per CPU.  Worth raising when only one
+    entity is running.  Default is 1.  See libvision/parallel.py.
+
+      tiles -- a libvision.TilePool shared with other entities, used instead
+    of one with threads threads.  Its owner is responsible for closing it.
+
+      scale_policy -- a libvision.ScalePolicy to use instead of the entity's
+    own, for trying out downscaling.
       
     """
     def __init__(self, child_conn, camera_name, *args, **kwargs):
@@ -59,18 +118,85 @@ class VisionEntity(object):
         self.delay = kwargs.pop('delay', 0)
         self.waitforsync = kwargs.pop('waitforsync', False)
         self.binocular_child = kwargs.pop('binocularworker', False)
+        self.frame_bus = kwargs.pop('frame_bus', None)
+        self.process_name = kwargs.pop('process_name', None)
+        capture = kwargs.pop('capture', None)
+        preprocess = kwargs.pop('preprocess', None)
+        profile = kwargs.pop('profile', False)
+        profile_path = kwargs.pop('profile_path', None)
+        drop_policy = kwargs.pop('drop_policy', None)
+        every_nth = kwargs.pop('every_nth', DEFAULT_EVERY_NTH)
+        frame_deadline = kwargs.pop('frame_deadline', DEFAULT_DEADLINE)
+        track_mode = kwargs.pop('track_mode', True)
+        search_interval = kwargs.pop('search_interval', DEFAULT_SEARCH_INTERVAL)
+        scale_policy = kwargs.pop('scale_policy', None)
+        threads = kwargs.pop('threads', 1)
+        tiles = kwargs.pop('tiles', None)
+        debug_output = kwargs.pop('debug_output', None)
+        debug_rate = kwargs.pop('debug_rate', DEFAULT_MAX_RATE)
+        profile_name = self.process_name or self.__class__.__name__
+        if profile and profile_path is None:
+            profile_path = os.path.join("profile", "%s.json" % profile_name)
+
+        # Stage timing.  Subclasses mark sub-stages with self.profiler.lap()
+        self.profiler = FrameProfiler(profile_name, profile_path, enabled=profile)
+
+        # Scratch images for process_frame().  Everything borrowed from here
+        # is returned to the pool after each frame.
+        self.buffers = libvision.BufferPool()
+
+        # Worker threads for processing tiles and ROIs of a frame
+        self.shared_tiles = tiles is not None
+        if tiles is None:
+            tiles = libvision.TilePool(threads)
+        self.tiles = tiles
+
+        # Rate limited debug_stream() output
+        debug_output = default_sinks(debug_output, self.debug)
+        if debug_output:
+            self.debug_output = DebugOutput(debug_output, debug_rate)
+        else:
+            self.debug_output = NULL_DEBUG_OUTPUT
 
         # Line of communication to mission control
         self.child_conn = child_conn
 
+        # Memoized preprocessing stages of the current frame
+        self.shared_preprocess = preprocess is not None
+        if preprocess is None:
+            preprocess = libvision.FrameCache(self.tiles)
+        self.preprocess = preprocess
+
+        # Search the whole frame or only regions around known targets
+        self.search_track = SearchTrackMode(search_interval, enabled=track_mode)
+
+        if scale_policy is not None:
+            self.scale_policy = scale_policy
+
         # Open camera/stream
         self.camera_name = camera_name
-        if self.camera_name in self.cameras:
+        if capture is not None:
+            self.capture = capture
+        elif self.frame_bus is not None:
+            self.capture = self.frame_bus.reader()
+        elif self.camera_name in self.cameras:
             self.capture = libvision.Camera(self.cameras[self.camera_name], display=self.debug)
         else:
             self.capture = svr.Stream(self.camera_name)
             self.capture.unpause()
 
+        # Background frame grabber owned by this entity, stopped in close()
+        self.grabber = None
+        if drop_policy and capture is None:
+            # FrameBusReader frames are already copies
+            self.grabber = LatestFrameCapture(self.capture, drop_policy,
+                                              every_nth, frame_deadline,
+                                              copy=self.frame_bus is None)
+            self.capture = self.grabber
+
+        # When the frame being processed was captured, in seconds since the epoch
+        self.capture_time = None
+
         self.output = Container()
 
         # Initialization for subclass
@@ -109,15 +235,17 @@ class VisionEntity(object):
                         self.close()
                         return
 
-                # Tell mission control we are capturing a frame, and it should capture sensor data
-                if not self.binocular_child:
-                    self.child_conn.send(vision.process_manager.SensorCapture())
+                # Outputs carry their capture time, which mission control
+                # matches to the robot's pose at that instant.
 
                 #check if a new frame has been captured
+                self.profiler.start_frame()
                 frame = self.capture.get_frame()
+                self.profiler.lap("capture")
 
                 #process any new frame
-                self.process_frame(frame)
+                self.handle_frame(frame, getattr(self.capture, "last_timestamp", None))
+                self.profiler.end_frame()
                 
                 # track time
                 if PRINT_FRAMERATE:
@@ -140,9 +268,32 @@ class VisionEntity(object):
         finally:
             self.close()
 
+    def handle_frame(self, frame, capture_time=None):
+        """ runs process_frame() on a newly captured frame, along with the
+            per-frame bookkeeping around it.  capture_time defaults to now. """
+        self.capture_time = capture_time or time.time()
+        if not self.shared_preprocess:
+            self.preprocess.new_frame(frame)
+
+        process_start = time.time()
+        self.process_frame(frame)
+        self.buffers.release_all()
+        self.profiler.record("process_frame", time.time() - process_start)
+
+        # svr and windows may only be used from this thread
+        with self.profiler.section("debug"):
+            self.debug_output.flush()
+            flush_svr_debug()
+
     def return_output(self):
         #return output
-        self.child_conn.send(self.output)
+        # Lets mission control judge how stale the output is
+        self.output.capture_time = self.capture_time
+        if self.capture_time is not None:
+            self.output.age = time.time() - self.capture_time
+
+        with self.profiler.section("send"):
+            self.child_conn.send(self.output)
 
     def wait_for_parent(self, timeout):
         if self.child_conn.poll(timeout):
@@ -159,14 +310,22 @@ class VisionEntity(object):
 
     def close(self):
         self.child_conn.send(vision.process_manager.KillSignal())
+        if self.grabber is not None:
+            self.grabber.stop()
         self.capture = None
+        self.debug_output.close()
+        if not self.shared_tiles:
+            self.tiles.close()
+        if self.profiler.stats_path and self.profiler.frame_count:
+            self.profiler.publish()
 
     def send_message(self, data):
         self.child_conn.send(data)
 
     def debug_stream(self, name, frame):
-        cv2.imshow(name, frame)
-        cv2.waitKey(1)
+        """ publishes a debug frame.  It is sent at the end of the frame, if
+            the rate limit allows. """
+        self.debug_output.publish(name, frame)
 
     def process_frame(self, frame, debug=True):
         """ process this frame, then place output in self.output """
@@ -191,6 +350,7 @@ class VisionEntity(object):
 class MultiCameraVisionEntity(VisionEntity):
     """ spawns and communicates with subprocess, each of which controls a camera """
     subprocess = None
+    uses_frame_bus = False
 
     def __init__(self, child_conn, *cameras_to_use, **kwargs):
 
@@ -201,8 +361,9 @@ class MultiCameraVisionEntity(VisionEntity):
         #Communication to the process manager
         self.child_conn = child_conn
 
-        #start a process manager to handle sub-processes
-        self.process_manager = vision.process_manager.ProcessManager()
+        #start a process manager to handle sub-processes.  Sensor data is
+        #frozen by mission control, not here.
+        self.process_manager = vision.process_manager.ProcessManager(freeze_sensors=False)
 
         #store the cameras.  Order will determine camera positions First is left, second is right
         self.cameras_to_use = cameras_to_use
@@ -150,6 +150,24 @@ class BinsCornerEntity(VisionEntity):
 
         self.area_thresh = 3000  # 4000
 
+        # A bin is a candidate until it has been seen more than
+        # min_seencount times, then it is confirmed.  last_seen goes up when
+        # the bin is seen and down every frame, and the bin is lost once it
+        # drops below last_seen_thresh.  Bins found in the same spot are
+        # merged.
+        self.tracker = libvision.MultiTracker(
+            gate=self.MaxTrans,
+            confirm_hits=self.min_seencount + 1,
+            hit_score=6,
+            max_score=self.last_seen_max,
+            initial_score=2,
+            min_score=self.last_seen_thresh,
+            merge_distance=1,
+            position_attrs=("midx", "midy"),
+            score_attr="last_seen",
+            hits_attr="seencount",
+        )
+
         self.corners = []
         self.candidates = []
         self.confirmed = []
@@ -239,12 +257,12 @@ class BinsCornerEntity(VisionEntity):
                 confirmed.corner3 = confirmed.corner3_repl
                 confirmed.corner4 = confirmed.corner4_repl
 
-                confirmed.midx = rect_midpointx(confirmed.corner1, confirmed.corner2, confirmed.corner3, confirmed.corner4)
-                confirmed.midy = rect_midpointy(confirmed.corner1, confirmed.corner2, confirmed.corner3, confirmed.corner4)
-
-                if confirmed.last_seen < self.last_seen_max:
-                    confirmed.last_seen += 5
+                self.tracker.set_position(confirmed,
+                    rect_midpointx(confirmed.corner1, confirmed.corner2, confirmed.corner3, confirmed.corner4),
+                    rect_midpointy(confirmed.corner1, confirmed.corner2, confirmed.corner3, confirmed.corner4))
+                self.tracker.add_score(confirmed, 5)
 
+        new_bins = []
         for corner1 in self.corners:
             for corner2 in self.corners:
                 for corner3 in self.corners:
@@ -266,7 +284,8 @@ class BinsCornerEntity(VisionEntity):
                                     angle_cnr_3 = math.fabs(angle_between_lines(line_slope(corner1, corner3), line_slope(corner3, corner4)))
                                     if self.angle_min2 < angle_cnr_3 < self.angle_max2:
                                         new_bin = Bin(corner1, corner2, corner3, corner4)
-                                        self.match_bins(new_bin)
+                                        new_bins.append(new_bin)
+        self.match_bins(new_bins)
         self.sort_bins()
 
         '''
@@ -364,75 +383,35 @@ class BinsCornerEntity(VisionEntity):
             self.output.orientation = None
         self.return_output()
 
-    def match_bins(self, target):
-        existing = 0
-        # update if candidate
-        for candidate in self.candidates:
-            if math.fabs(target.midx - candidate.midx) < self.MaxTrans and \
-               math.fabs(target.midy - candidate.midy) < self.MaxTrans and \
-               target.id != candidate.id:
-                candidate.midx = target.midx
-                candidate.midy = target.midy
-                candidate.corner1 = target.corner1
-                candidate.corner2 = target.corner2
-                candidate.corner3 = target.corner3
-                candidate.corner4 = target.corner4
-                candidate.angle = target.angle
-                candidate.corner1_locx = candidate.corner1[0] - candidate.corner2[0]
-                candidate.corner1_locy = candidate.corner1[1] - candidate.corner2[1]
-                candidate.corner2_locx = candidate.corner2[0] - candidate.corner1[0]
-                candidate.corner2_locy = candidate.corner2[1] - candidate.corner1[1]
-                candidate.corner3_locx = candidate.corner3[0] - candidate.corner1[0]
-                candidate.corner3_locy = candidate.corner3[1] - candidate.corner1[1]
-                candidate.corner4_locx = candidate.corner4[0] - candidate.corner1[0]
-                candidate.corner4_locy = candidate.corner4[1] - candidate.corner1[1]
-                if candidate.last_seen < self.last_seen_max:
-                    candidate.last_seen += 6
-                candidate.seencount += 1
-                existing = 1
-        # update if confirmed
-        for confirmed in self.confirmed:
-            for confirmed2 in self.confirmed:
-                if confirmed.midx == confirmed2.midx and confirmed.midy == confirmed2.midy and confirmed.id != confirmed2.id:
-                    if confirmed.id < confirmed2.id:
-                        self.confirmed.remove(confirmed2)
-
-            if math.fabs(target.midx - confirmed.midx) < self.MaxTrans and \
-               math.fabs(target.midy - confirmed.midy) < self.MaxTrans and \
-               target.id != confirmed.id:
-                confirmed.midx = target.midx
-                confirmed.midy = target.midy
-                confirmed.corner1 = target.corner1
-                confirmed.corner2 = target.corner2
-                confirmed.corner3 = target.corner3
-                confirmed.corner4 = target.corner4
-                confirmed.angle = target.angle
-                if confirmed.last_seen < self.last_seen_max:
-                    confirmed.last_seen += 6
-                confirmed.seencount += 1
-                existing = 1
-        if existing == 0:
-            print "found candidate"
-            target.id = Bin.bin_id
-            Bin.bin_id += 1
-            self.candidates.append(target)
+    def match_bins(self, bins):
+        for tracked, target in self.tracker.update(bins):
+            tracked.corner1 = target.corner1
+            tracked.corner2 = target.corner2
+            tracked.corner3 = target.corner3
+            tracked.corner4 = target.corner4
+            tracked.angle = target.angle
+            tracked.corner1_locx = target.corner1_locx
+            tracked.corner1_locy = target.corner1_locy
+            tracked.corner2_locx = target.corner2_locx
+            tracked.corner2_locy = target.corner2_locy
+            tracked.corner3_locx = target.corner3_locx
+            tracked.corner3_locy = target.corner3_locy
+            tracked.corner4_locx = target.corner4_locx
+            tracked.corner4_locy = target.corner4_locy
+
+        # new bins get an id in the order they were found
+        for bin in self.tracker.tracks():
+            if bin.id == 0:
+                Bin.bin_id += 1
+                bin.id = Bin.bin_id
 
     def sort_bins(self):
         perimeter_errors = []
         area_errors = []
-        # promote candidate to confirmed if seen enough times, if it hasn't been seen, delete the bin
-        for candidate in self.candidates:
-
-            candidate.last_seen -= 1
-            if candidate.last_seen < self.last_seen_thresh:
-                self.candidates.remove(candidate)
-                print "lost"
-                continue
-            if candidate.seencount > self.min_seencount:
-                self.confirmed.append(candidate)
-                self.candidates.remove(candidate)
-                print "confirmed"
-                continue
+        # candidates seen enough times were promoted to confirmed, and bins
+        # that haven't been seen in a while were dropped, by self.tracker
+        self.candidates = self.tracker.candidates()
+        self.confirmed = self.tracker.confirmed()
 
         self.min_perimeter = 500000
         self.angles = []
@@ -450,22 +429,18 @@ class BinsCornerEntity(VisionEntity):
                 print math.fabs(line_distance(confirmed.corner1, confirmed.corner3) * 2 + math.fabs(line_distance(confirmed.corner1, confirmed.corner2) * 2) - self.min_perimeter), "is greater than", self.min_perimeter * self.perimeter_threshold
                 print "yay?"
 
-                confirmed.last_seen -= 5
+                # Lose 5 this frame, instead of 1
+                self.tracker.add_score(confirmed, -4)
                 perimeter_errors.append(confirmed)
                 continue
 
             if line_distance(confirmed.corner1, confirmed.corner2) * line_distance(confirmed.corner1, confirmed.corner3) > self.area_thresh or \
                line_distance(confirmed.corner4, confirmed.corner2) * line_distance(confirmed.corner4, confirmed.corner3) > self.area_thresh:
                 print "area error"
-                confirmed.last_seen -= 5
+                self.tracker.add_score(confirmed, -4)
                 area_errors.append(confirmed)
                 continue
 
-            confirmed.last_seen -= 1
-            if confirmed.last_seen < self.last_seen_thresh:
-                self.confirmed.remove(confirmed)
-                print "lost confirmed"
-                continue
             # draw bins
             line_color = (confirmed.corner1[1] / 2, confirmed.corner2[1] / 2, confirmed.corner4[1] / 2)
             cv.Circle(self.debug_frame, (int(confirmed.midx), int(confirmed.midy)), 15, line_color, 2, 8, 0)
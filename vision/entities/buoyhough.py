@@ -5,8 +5,6 @@ import cv2.cv as cv
 import numpy as np
 import svr
 from base import VisionEntity, Container
-import itertools
-from sets import Set
 import libvision
 
 BUOY_COLOR_PRINTS = False
@@ -60,6 +58,7 @@ class BuoyHoughEntity(VisionEntity):
 
         # edge detection variables
         self.edge_threshold = 15    
+        self.max_edge_contours = 64 # only the largest blobs get edge detected
 
         # Hough buoy variables
         self.inv_res_ratio = 2
@@ -85,6 +84,24 @@ class BuoyHoughEntity(VisionEntity):
 
         self.next_id = 0
 
+        # A buoy is tracked as a candidate until it has been seen
+        # seencount_thresh times, then it is confirmed.  lastseen goes up
+        # when the buoy is seen and down every frame, and the buoy is
+        # forgotten once it drops below lastseen_thresh.
+        self.tracker = libvision.MultiTracker(
+            gate=self.trans_thresh,
+            confirmed_gate=self.conf_trans_thresh,
+            confirm_hits=self.seencount_thresh,
+            hit_score=10,
+            max_score=self.MAX_SEEN,
+            initial_score=2,
+            min_score=self.lastseen_thresh,
+            merge_distance=self.conf_trans_thresh,
+            position_attrs=("centerx", "centery"),
+            score_attr="lastseen",
+            hits_attr="seencount",
+        )
+
         # frames
         self.debug_frame = None
 
@@ -107,21 +124,10 @@ class BuoyHoughEntity(VisionEntity):
         return frame
 
     
-    def morphology(self, frame, sequence):
-
-        for val in sequence:
-            # perform transformation
-            if val > 0:
-                kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (val, val))
-                frame = cv2.dilate(frame, kernel)
-            elif val < 0:
-                val = -val
-                kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (val, val))
-                frame = cv2.erode(frame, kernel)
-            else:
-                pass #do nothing
-
-        return frame
+    def morphology(self, frame, sequence, dst=None):
+        # Positive values dilate and negative values erode, with elliptical
+        # kernels of that size.  See libvision/morphology.py.
+        return libvision.apply_sequence(frame, sequence, dst)
 
 
     
@@ -140,59 +146,50 @@ class BuoyHoughEntity(VisionEntity):
         BB_SIZE = 40
         drop = 5
 
+        # Only the outer contours matter, since the ROI of a hole is inside
+        # the ROI of the blob around it
         (buoy_contours,_) = cv2.findContours(threshold_img, 
-                                cv2.RETR_LIST, 
-                                cv2.CHAIN_APPROX_NONE)
-
-        # Get a bounding box for all blobs in the image
-        rect_list = []
-        for cnt in buoy_contours:
-            rect = cv2.boundingRect(cnt)
-            rect_list.append(rect)
-
-        # 
-        edge_frame = target_img[:,:]*0
-        blur_frame = cv2.medianBlur(target_img, 5)
-        #edge_frame = cv2.Canny(edge_frame, 5, 100, apertureSize=3)
-        #self.debug_stream("edgles", edge_frame)
-
-        # get width and height
+                                cv2.RETR_EXTERNAL, 
+                                cv2.CHAIN_APPROX_SIMPLE)
+        self.profiler.lap("contour")
+
+        # Get a bounding box for the largest blobs in the image.  A frame full
+        # of speckle can have thousands of tiny ones.
+        rects = np.array([cv2.boundingRect(cnt) for cnt in buoy_contours],
+                         np.int64).reshape(-1, 4)
+        if len(rects) > self.max_edge_contours:
+            largest = np.argsort(-(rects[:,2] * rects[:,3]), kind="mergesort")
+            rects = rects[largest[:self.max_edge_contours]]
+
+        # Grow each box into an ROI
         (total_height, total_width, _) = source_img.shape
-        for rect in rect_list:
-            # blank frame
-            drawing_frame = target_img[:,:]*0
-
-            # get ROI
-            (x,y,w,h) = rect
-            bloom = int(BB_SIZE/2)
-            x1 = in_range(x-bloom, 0, total_width)
-            y1 = in_range(y-bloom, 0, total_height)
-            x2 = in_range(x+w+bloom, 0, total_width)
-            y2 = in_range(y+h+bloom+drop, 0, total_height)
-            ROI = blur_frame[y1:y2,x1:x2]
-
-            # run canny edge detection on ROI
-            ROI = cv2.Canny(ROI, 0, edge_threshold)
-
-            # add resuls on to composit image
-            drawing_frame[y1:y2,x1:x2] = ROI
-
-            #import pdb; pdb.set_trace()
-            edge_frame = cv2.add(edge_frame,drawing_frame)
-
-
-            if debug_img:
-                (x,y,w,h) = rect
-                bloom = int(BB_SIZE/2)
-                pt1 = (x-bloom,y-bloom)
-                pt2 = (x+w+bloom,y+h+bloom+drop)
-                cv2.rectangle(source_img, pt1,pt2, (255,255,255))
-                
-        
-        
+        bloom = int(BB_SIZE/2)
+        x1 = np.clip(rects[:,0] - bloom, 0, total_width)
+        y1 = np.clip(rects[:,1] - bloom, 0, total_height)
+        x2 = np.clip(rects[:,0] + rects[:,2] + bloom, 0, total_width)
+        y2 = np.clip(rects[:,1] + rects[:,3] + bloom + drop, 0, total_height)
+
+        # Overlapping ROIs are merged, so every pixel goes through Canny at
+        # most once and the cost scales with the area covered
+        rois = libvision.merge_rectangles(
+            [(int(x), int(y), int(w), int(h))
+             for x, y, w, h in zip(x1, y1, x2 - x1, y2 - y1)])
+
+        if debug_img:
+            for (x,y,w,h) in rois:
+                cv2.rectangle(source_img, (x,y), (x+w,y+h), (255,255,255))
+
+        # run canny edge detection on every ROI, in parallel, and combine
+        # the results in one edge frame
+        blur_frame = self.tiles.map_tiles(lambda band: cv2.medianBlur(band, 5),
+                                          target_img, halo=2)
+        edge_frame = np.zeros(target_img.shape[:2], np.uint8)
+        self.tiles.map_rois(lambda roi: cv2.Canny(roi, 0, edge_threshold),
+                            blur_frame, rois, edge_frame, merge=np.maximum)
 
         # final processing of the edge frame
         #edge_frame = self.morphology(edge_frame, [1,-1])
+        self.profiler.lap("canny")
 
         if debug_img:
             #svr.debug("rects", source_img)
@@ -202,6 +199,129 @@ class BuoyHoughEntity(VisionEntity):
 
         return edge_frame
 
+    def threshold_frame(self):
+        # collect brightly colored areas from the blurred frame
+        frame1 = self.preprocess.adaptive_threshold(4,
+                                self.adaptive_thresh_blocksize,
+                                self.adaptive_thresh,
+                                blur=5)
+
+        # collect shadowes under colored areas
+        frame2 = self.preprocess.adaptive_threshold(1,
+                                self.shadow_thresh_blocksize,
+                                self.shadow_thresh,
+                                blur=5)
+        
+        # use composite as the adaptive threshold
+        adaptive_frame = cv2.add(frame1, frame2*0)
+        self.profiler.lap("threshold")
+        return adaptive_frame
+
+    def threshold_roi(self, rect):
+        # Same as the bright area threshold of threshold_frame(), but only
+        # blurs and converts the pixels of one region.  The shadow threshold
+        # is left out, since it doesn't contribute to the composite.
+        (x, y, w, h) = rect
+        roi = self.preprocess.source()[y:y+h, x:x+w]
+        saturation = cv2.cvtColor(cv2.medianBlur(roi, 5), cv2.COLOR_BGR2HSV)[:,:,1]
+        roi_threshold = cv2.adaptiveThreshold(saturation, 255,
+                                cv2.ADAPTIVE_THRESH_MEAN_C,
+                                cv2.THRESH_BINARY_INV,
+                                self.adaptive_thresh_blocksize,
+                                self.adaptive_thresh)
+        self.profiler.lap("threshold")
+        return roi_threshold
+
+    def find_circles(self, raw_frame, adaptive_frame, debug=False,
+                     policy=libvision.FULL_RESOLUTION, despeckled_frame=None):
+        # Pixel sizes are given at full resolution, and scaled down to the
+        # resolution of the frames by policy
+        # morphology
+        sequence = ([-self.erode_factor, self.erode_factor]*1 
+                   +[self.bloom_factor, -self.bloom_factor]*1)
+        sequence = [policy.scale_length(val) if val > 0 else -policy.scale_length(-val)
+                    for val in sequence if val]
+
+        despeckled_frame = self.morphology(adaptive_frame, sequence, despeckled_frame)
+        self.profiler.lap("morphology")
+
+        if debug:
+            self.debug_stream("despeckled", despeckled_frame)
+
+        # collect edges
+        # ROI_edge detection
+        edge_frame = self.ROI_edge_detection(raw_frame, despeckled_frame,
+                                             self.edge_threshold, 0, debug)
+        
+        # collect buoy candidates using hough circles
+        circles = cv2.HoughCircles(
+                                image   =edge_frame, 
+                                method  =cv2.cv.CV_HOUGH_GRADIENT,
+                                dp      =self.inv_res_ratio, 
+                                minDist =policy.scale_length(self.center_sep),
+                                param1  =self.upper_canny_thresh,
+                                param2  =self.acc_thresh,
+                                minRadius=policy.scale_length(self.min_radius),
+                                maxRadius=policy.scale_length(self.max_radius),
+                        )
+        if circles is not None:
+            circles = np.round(circles[:,0]).astype(int)
+        self.profiler.lap("hough")
+        return circles
+
+    def find_circles_in_rois(self, raw_frame, rois):
+        # Runs the whole pipeline on each ROI.  Returns the adaptive frame,
+        # blank outside of the ROIs, and the circles found.
+        adaptive_frame = np.zeros(raw_frame.shape[:2], np.uint8)
+        despeckled_frame = self.borrow_mask(raw_frame)
+        circles = []
+        for (x, y, w, h) in rois:
+            roi_threshold = self.threshold_roi((x, y, w, h))
+            adaptive_frame[y:y+h, x:x+w] = roi_threshold
+            roi_circles = self.find_circles(raw_frame[y:y+h, x:x+w],
+                                            roi_threshold,
+                                            despeckled_frame=despeckled_frame[y:y+h, x:x+w])
+            if roi_circles is not None:
+                circles.append(roi_circles + (x, y, 0))
+        if not circles:
+            return adaptive_frame, None
+        return adaptive_frame, np.vstack(circles)
+
+    def find_circles_coarse_to_fine(self, raw_frame):
+        # Finds circles on a downscaled frame, then finds them again at full
+        # resolution around each one, unless the scale policy says not to
+        policy = self.scale_policy
+        coarse = self.preprocess.level(policy.scale)
+        adaptive_frame = coarse.adaptive_threshold(4,
+                                policy.scale_odd(self.adaptive_thresh_blocksize),
+                                self.adaptive_thresh,
+                                blur=policy.scale_odd(5))
+        self.profiler.lap("threshold")
+        circles = self.find_circles(coarse.source(), adaptive_frame,
+                                    policy=policy,
+                                    despeckled_frame=self.borrow_mask(adaptive_frame))
+        if circles is None:
+            return adaptive_frame, None
+
+        if not policy.refine:
+            return adaptive_frame, np.round(policy.to_full(circles)).astype(int)
+
+        (frame_height, frame_width, _) = raw_frame.shape
+        rois = policy.refine_regions(circles, (frame_width, frame_height))
+        return self.find_circles_in_rois(raw_frame, rois)
+
+    def borrow_mask(self, frame):
+        # A single channel scratch frame the size of frame, valid until the
+        # end of process_frame()
+        (height, width) = frame.shape[:2]
+        return libvision.cv_to_cv2(self.buffers.borrow((width, height), 8, 1))
+
+    def predicted_buoys(self):
+        # (x, y, radius) of where each confirmed buoy should be this frame
+        positions = self.tracker.predicted_positions(confirmed_only=True)
+        return [(x, y, buoy.radius)
+                for (x, y), buoy in zip(positions, self.tracker.confirmed())]
+
     def detect_buoy(self,buoy,raw_frame,detection_frame):
         # generate some important variables
         buoy_centerx = int(buoy.centerx)
@@ -289,55 +409,23 @@ class BuoyHoughEntity(VisionEntity):
         raw_frame        = libvision.cv_to_cv2(frame)
         self.debug_frame = raw_frame
 
-        # CV2 blur
-        blur_frame = cv2.medianBlur(self.debug_frame, 5)
-
-        # collect brightly colored areas
-        frame1 = self.adaptive_threshold(blur_frame, 4,
-                                self.adaptive_thresh_blocksize,
-                                self.adaptive_thresh)
-
-        # collect shadowes under colored areas
-        frame2 = self.adaptive_threshold(blur_frame, 1,
-                                self.shadow_thresh_blocksize,
-                                self.shadow_thresh)
-        
-        # use composite as the adaptive threshold
-        adaptive_frame = cv2.add(frame1, frame2*0)
-        frame          = adaptive_frame
-        
-        # morphology
-        sequence = ([-self.erode_factor, self.erode_factor]*1 
-                   +[self.bloom_factor, -self.bloom_factor]*1)
-
-        despeckled_frame = self.morphology(frame, sequence)
-        frame            = despeckled_frame
-
-        self.debug_stream("despeckled", despeckled_frame)
-
-        # collect edges
-        # ROI_edge detection
-        edge_frame = self.ROI_edge_detection(raw_frame, frame, self.edge_threshold, 0, True)
-        
-        # collect buoy candidates using hough circles
-        self.raw_circles = []
-        self.raw_buoys = []
-        self.raw_circles = cv2.HoughCircles(
-                                image   =edge_frame, 
-                                method  =cv2.cv.CV_HOUGH_GRADIENT,
-                                dp      =self.inv_res_ratio, 
-                                minDist =self.center_sep,
-                                param1  =self.upper_canny_thresh,
-                                param2  =self.acc_thresh,
-                                minRadius=self.min_radius,
-                                maxRadius=self.max_radius,
-                        )
-        if self.raw_circles is not None:
-            self.raw_circles = np.round(self.raw_circles[:,0]).astype(int)
-
+        # In track mode, only the regions around confirmed buoys are
+        # searched for circles
+        (frame_height, frame_width, _) = raw_frame.shape
+        rois = self.search_track.regions((frame_width, frame_height),
+                                         self.predicted_buoys())
+        if rois is not None:
+            adaptive_frame, self.raw_circles = self.find_circles_in_rois(raw_frame, rois)
+        elif self.scale_policy.downscaled:
+            adaptive_frame, self.raw_circles = self.find_circles_coarse_to_fine(raw_frame)
+        else:
+            adaptive_frame = self.threshold_frame()
+            self.raw_circles = self.find_circles(raw_frame, adaptive_frame, debug=True,
+                                    despeckled_frame=self.borrow_mask(raw_frame))
 
         # create a new buoy object for every circle that is detected
         #print(self.raw_circles)
+        self.raw_buoys = []
         if self.raw_circles is not None:
             #print self.confirmed
             for circle in self.raw_circles:
@@ -345,13 +433,16 @@ class BuoyHoughEntity(VisionEntity):
                 new_buoy = Buoy(x, y, radius, "unknown", self.next_id)
                 self.next_id += 1
                 self.raw_buoys.append(new_buoy) 
-                self.match_buoys(new_buoy)
 
                 cv2.circle(self.debug_frame, (x, y),
                             int(radius), (0, 255, 0), 5)
 
         # sort buoys among confirmed/canditates
-        self.sort_buoys()
+        tracked = self.confirmed
+        matches = self.track_buoys()
+        matched = set(id(buoy) for buoy, _ in matches)
+        self.search_track.report(all(id(buoy) in matched for buoy in tracked))
+        self.profiler.lap("tracking")
         
         # self.debug_frame= cv2.add(<HUD_FRAME>,cv2.cvtColor(<annotated_frame>, cv2.COLOR_GRAY2BGR) )
         # perform color detection
@@ -408,6 +499,8 @@ class BuoyHoughEntity(VisionEntity):
             # ^^^ end color detection
                 """
 
+        self.profiler.lap("color")
+
         # debug frames
         self.debug_to_cv = libvision.cv2_to_cv(self.debug_frame)
         #self.numpy_to_cv = libvision.cv2_to_cv(self.numpy_frame)
@@ -415,12 +508,13 @@ class BuoyHoughEntity(VisionEntity):
         #svr.debug("processed", self.numpy_to_cv)
         svr.debug("adaptive", self.adaptive_to_cv)
         svr.debug("debug", self.debug_to_cv)
+        self.profiler.lap("debug")
 
         # generate vision output
         FOV_x = 71.0
         FOV_y = 40.0
-        x_resolution = frame.shape[1]
-        y_resolution = frame.shape[0]
+        x_resolution = frame_width
+        y_resolution = frame_height
 
 
         self.output.buoys = []
@@ -439,80 +533,10 @@ class BuoyHoughEntity(VisionEntity):
         return self.output
 
 
-    # TODO, CLEAN THIS UP SOME
-    def match_buoys(self, target):
-        found = 0
-        for buoy in self.candidates:
-            if math.fabs(buoy.centerx - target.centerx) < self.trans_thresh and \
-               math.fabs(buoy.centery - target.centery) < self.trans_thresh:
-                #print buoy.seencount
-                buoy.centerx = target.centerx
-                buoy.centery = target.centery
-                #print "still ", buoy.seencount
-                buoy.seencount += 1
-                #print "new seencount ", buoy.seencount
-                buoy.lastseen = in_range(buoy.lastseen+10, -1, self.MAX_SEEN)
-                found = 1
-                
-        for buoy in self.confirmed:
-            if math.fabs(buoy.centerx - target.centerx) < self.conf_trans_thresh and \
-               math.fabs(buoy.centery - target.centery) < self.conf_trans_thresh:
-                buoy.centerx = target.centerx
-                buoy.centery = target.centery
-                buoy.lastseen = in_range(buoy.lastseen+10, -1, self.MAX_SEEN) #+ self.conf_trans_thresh
-                found = 1
-                
-        if found == 0:
-            self.candidates.append(target)
-            target.lastseen + 3
-
-    # TODO, CLEAN THIS UP SOME
-    def sort_buoys(self):
-        # go through all candidate buoys. promote any that have been seen
-        # enough times. or remove any that have not been seen in a while.
-        for buoy in self.candidates[:]:
-            #print "last seen is ", buoy.lastseen
-            #print "seencount is ", buoy.seencount
-            buoy.lastseen -= 1
-            
-            if buoy.seencount >= self.seencount_thresh:
-                self.confirmed.append(buoy)
-                #print "confirmed appended"
-                
-            if buoy.lastseen < self.lastseen_thresh:
-                self.candidates.remove(buoy)
-                
-        # go through all confirmed buoys, and remove it if it hasn't been
-        # seen in a while.
-        for buoy in self.confirmed[:]:
-            buoy.lastseen -= 1
-            
-            if buoy.lastseen < (self.lastseen_thresh):
-                self.confirmed.remove(buoy)
-                #self.candidates.append(buoy)
-                #print "confirmed removed"
-                
- 
-        # remove easy to catch duplicates
-        self.confirmed = list(Set(self.confirmed))
-
-        for (buoy1,buoy2) in itertools.combinations(self.confirmed,2):
-        
-            # spatially check if any elements are the same
-            if math.fabs(buoy1.centerx - buoy2.centerx) < self.conf_trans_thresh and \
-                math.fabs(buoy1.centery - buoy2.centery) < self.conf_trans_thresh:
-                
-                # if buoy 1 was discoverd first, keep it.
-                if buoy1.id < buoy2.id:
-                    # check if element has already been removed
-                    if buoy2 in self.confirmed:
-                        self.confirmed.remove(buoy2)
-                        #print "removed buoy2"
-                        
-                # otherwise keep buoy 2.
-                else:
-                    # check if element has already been removed
-                    if buoy1 in self.confirmed:
-                        self.confirmed.remove(buoy1)
-                        #print "removed buoy1"
-        
+    def track_buoys(self):
+        # match the new buoys with those already seen, and sort them among
+        # confirmed/candidates
+        matches = self.tracker.update(self.raw_buoys)
+        self.candidates = self.tracker.candidates()
+        self.confirmed = self.tracker.confirmed()
+        return matches
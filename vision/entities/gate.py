@@ -9,7 +9,6 @@ import svr
 
 from base import VisionEntity
 import libvision
-from sw3.util import circular_average
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -22,26 +21,6 @@ HUE_SHIFT = {'red':-67,
              'red->orange':-78}
 
 
-def line_group_accept_test(line_group, line, max_range):
-    '''
-    Returns True if the line should be let into the line group.
-
-    First calculates what the range of rho values would be if the line were
-    added.  If the range is greater than max_range the line is rejected and
-    False is returned.
-    '''
-    min_rho = line[0]
-    max_rho = line[0]
-    for l in line_group:
-        if l[0] > max_rho:
-            max_rho = l[0]
-        if l[0] < min_rho:
-            min_rho = l[0]
-    return max_rho - min_rho < max_range
-
-
-
-
 class GateEntity(VisionEntity):
     name = "Gate"
 
@@ -54,6 +33,7 @@ class GateEntity(VisionEntity):
         self.adaptive_thresh_blocksize = 19
         self.adaptive_thresh = 4
         self.max_range = 300
+        self.line_grouper = libvision.LineGrouper(self.max_range)
 
         self.target_shift = HUE_SHIFT['red->orange'] #shift required to see gate
                                                      #color for thresholding
@@ -83,8 +63,8 @@ class GateEntity(VisionEntity):
 
 
         #create locations for the a pair of test frames
-        frametest = cv.CreateImage(cv.GetSize(frame), 8, 3)
-        binarytest = cv.CreateImage(cv.GetSize(frame), 8, 1)
+        frametest = self.buffers.borrow(cv.GetSize(frame), 8, 3)
+        binarytest = self.buffers.borrow(cv.GetSize(frame), 8, 1)
         
         #use the red channel for the binary frame (just for debugging purposes)
         cv.Copy(frame, frametest)
@@ -93,28 +73,21 @@ class GateEntity(VisionEntity):
         cv.SetImageCOI(frametest, 0)    #reset COI
         #svr.debug("R?",binarytest)
 
-        # Resize image to 320x240
-        #copy = cv.CreateImage(cv.GetSize(frame), 8, 3)
-        #cv.Copy(frame, copy)
-        #cv.SetImageROI(frame, (0, 0, 320, 240))
-        #cv.Resize(copy, frame, cv.CV_INTER_NN)
-
         found_gate = False
 
         #create a new frame just for comparison purposes
-        unchanged_frame = cv.CreateImage(cv.GetSize(frame), 8, 3)
+        unchanged_frame = self.buffers.borrow(cv.GetSize(frame), 8, 3)
         cv.Copy(frame,unchanged_frame)
 
-        #apply a course noise filter
-        cv.Smooth(frame, frame, cv.CV_MEDIAN, 7, 7)
+        # Lines are found on the frame downscaled by the scale policy, if any
+        policy = self.scale_policy
+        detection_frame = self.preprocess.level(policy.scale)
 
-        # Set binary image to have saturation channel
-        hsv = cv.CreateImage(cv.GetSize(frame), 8, 3)
-        binary = cv.CreateImage(cv.GetSize(frame), 8, 1)
-        cv.CvtColor(frame, hsv, cv.CV_BGR2HSV)
-        cv.SetImageCOI(hsv, 1)
-        cv.Copy(hsv, binary)
-        cv.SetImageCOI(hsv, 0)  #reset COI
+        # Set binary image to the hue channel of the frame, after a course
+        # noise filter
+        hue = detection_frame.channel(3, blur=policy.scale_odd(7))
+        binary = self.buffers.borrow((hue.shape[1], hue.shape[0]), 8, 1)
+        libvision.cv_to_cv2(binary)[:] = hue
         
         #shift hue of image such that orange->red are at top of spectrum
         '''
@@ -134,29 +107,38 @@ class GateEntity(VisionEntity):
             255,
             cv.CV_ADAPTIVE_THRESH_MEAN_C,
             cv.CV_THRESH_BINARY_INV,
-            self.adaptive_thresh_blocksize,
+            policy.scale_odd(self.adaptive_thresh_blocksize),
             self.adaptive_thresh,
         )
+        self.profiler.lap("threshold")
 
-        # Morphology
-        kernel = cv.CreateStructuringElementEx(5, 5, 3, 3, cv.CV_SHAPE_ELLIPSE)
-        cv.Erode(binary, binary, kernel, 1)
-        cv.Dilate(binary, binary, kernel, 1)
+        # Morphology: erode then dilate, in place
+        binary_array = libvision.cv_to_cv2(binary)
+        libvision.apply_sequence(binary_array, [-5, 5], dst=binary_array,
+                                 anchor=(3, 3))
         if self.debug:
-            color_filtered = cv.CloneImage(binary)
+            color_filtered = self.buffers.borrow_like(binary)
+            cv.Copy(binary, color_filtered)
+        self.profiler.lap("morphology")
 
         # Get Edges
         cv.Canny(binary, binary, 30, 40)
+        self.profiler.lap("canny")
 
         # Hough Transform
         line_storage = cv.CreateMemStorage()
         raw_lines = cv.HoughLines2(binary, line_storage, cv.CV_HOUGH_STANDARD,
                                    rho=1,
                                    theta=math.pi/180,
-                                   threshold=self.hough_threshold,
+                                   threshold=policy.scale_length(self.hough_threshold),
                                    param1=0,
                                    param2=0
                                    )
+        if policy.downscaled:
+            # Back to full resolution rho.  There is nothing to refine, the
+            # angles are as good as they get at full resolution.
+            raw_lines = [(rho / policy.scale, theta) for rho, theta in raw_lines]
+        self.profiler.lap("hough")
 
         # Get vertical lines
         vertical_lines = []
@@ -171,30 +153,12 @@ class GateEntity(VisionEntity):
         logging.debug("{} possibilities reduced to {} lines".format(
                         len(raw_lines), len(vertical_lines) ))
 
-        # Group vertical lines
-        vertical_line_groups = []  # A list of line groups which are each a line list
-        i = 0
-        for line in vertical_lines:
-            group_found = False
-            for line_group in vertical_line_groups:
-                i += 1
-                if line_group_accept_test(line_group, line, self.max_range):
-                    line_group.append(line)
-                    group_found = True
-
-            if not group_found:
-                vertical_line_groups.append([line])
+        # Group vertical lines and average each group into a line
+        vertical_lines = self.line_grouper.group(vertical_lines)
 
         #quick debugging statement
-        logging.debug("{} internal iterations for {} groups".format(i, len(vertical_line_groups)))
-
-        # Average line groups into lines
-        vertical_lines = []
-        for line_group in vertical_line_groups:
-            rhos = map(lambda line: line[0], line_group)
-            angles = map(lambda line: line[1], line_group)
-            line = (sum(rhos)/len(rhos), circular_average(angles, math.pi))
-            vertical_lines.append(line)
+        logging.debug("{} groups, {} lines dropped".format(
+                        len(vertical_lines), self.line_grouper.dropped))
 
         ####################################################
         #vvvv Horizontal line code isn't used for anything
@@ -209,31 +173,19 @@ class GateEntity(VisionEntity):
                 horizontal_lines.append( (abs(line[0]), line[1]) )
 
         # Group horizontal lines
-        horizontal_line_groups = []  # A list of line groups which are each a line list
-        for line in horizontal_lines:
-            group_found = False
-            for line_group in horizontal_line_groups:
-
-                if line_group_accept_test(line_group, line, self.max_range):
-                    line_group.append(line)
-                    group_found = True
-
-            if not group_found:
-                horizontal_line_groups.append([line])
+        horizontal_line_groups = self.line_grouper.group(horizontal_lines)
 
         if len(horizontal_line_groups) is 1:
             self.seen_crossbar = True
             if self.debug:
-                rhos = map(lambda line: line[0], horizontal_line_groups[0])
-                angles = map(lambda line: line[1], horizontal_line_groups[0])
-                line = (sum(rhos)/len(rhos), circular_average(angles, math.pi))
-                horizontal_lines = [line]
+                horizontal_lines = horizontal_line_groups
         else:
             self.seen_crossbar = False
             horizontal_lines = []
 
         #^^^ Horizontal line code isn't used for anything
         ###################################################
+        self.profiler.lap("grouping")
 
         self.left_pole = None
         self.right_pole = None
@@ -287,8 +239,13 @@ class GateEntity(VisionEntity):
             
 
         #TODO: If one pole is seen, is it left or right pole?
+        self.profiler.lap("tracking")
     
         if self.debug:
+            if policy.downscaled:
+                full_filtered = self.buffers.borrow(cv.GetSize(frame), 8, 1)
+                cv.Resize(color_filtered, full_filtered, cv.CV_INTER_NN)
+                color_filtered = full_filtered
             cv.CvtColor(color_filtered, frame, cv.CV_GRAY2RGB)
             libvision.misc.draw_lines(frame, vertical_lines)
             libvision.misc.draw_lines(frame, horizontal_lines)
@@ -303,6 +260,7 @@ class GateEntity(VisionEntity):
             #cv.ShowImage("Gate", cv.CloneImage(frame))
             svr.debug("Gate", cv.CloneImage(frame))
             svr.debug("Unchanged",cv.CloneImage(unchanged_frame))
+        self.profiler.lap("debug")
 
 
         #populate self.output with infos
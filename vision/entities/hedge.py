@@ -9,7 +9,6 @@ import svr
 
 from base import VisionEntity
 import libvision
-from sw3.util import circular_average
 
 GATE_BLACK = 0
 GATE_WHITE = 1
@@ -27,24 +26,6 @@ def line_distance(corner_a, corner_b):
     return distance
 
 
-def line_group_accept_test(line_group, line, max_range):
-    '''
-    Returns True if the line should be let into the line group.
-
-    First calculates what the range of rho values would be if the line were
-    added.  If the range is greater than max_range the line is rejected and
-    False is returned.
-    '''
-    min_rho = line[0]
-    max_rho = line[0]
-    for l in line_group:
-        if l[0] > max_rho:
-            max_rho = l[0]
-        if l[0] < min_rho:
-            min_rho = l[0]
-    return max_rho - min_rho < max_range
-
-
 class HedgeEntity(VisionEntity):
     name = "Hedge"
 
@@ -176,26 +157,8 @@ class HedgeEntity(VisionEntity):
 
                 vertical_lines.append( (abs(line[0]), line[1]) )
 
-        # Group vertical lines
-        vertical_line_groups = []  # A list of line groups which are each a line list
-        for line in vertical_lines:
-            group_found = False
-            for line_group in vertical_line_groups:
-
-                if line_group_accept_test(line_group, line, self.max_range):
-                    line_group.append(line)
-                    group_found = True
-
-            if not group_found:
-                vertical_line_groups.append([line])
-
-        # Average line groups into lines
-        vertical_lines = []
-        for line_group in vertical_line_groups:
-            rhos = map(lambda line: line[0], line_group)
-            angles = map(lambda line: line[1], line_group)
-            line = (sum(rhos)/len(rhos), circular_average(angles, math.pi))
-            vertical_lines.append(line)
+        # Group vertical lines and average each group into a line
+        vertical_lines = libvision.group_lines(vertical_lines, self.max_range)
 
         # Get horizontal lines
         horizontal_lines = []
@@ -207,24 +170,10 @@ class HedgeEntity(VisionEntity):
                 horizontal_lines.append( (abs(line[0]), line[1]) )
 
         # Group horizontal lines
-        horizontal_line_groups = []  # A list of line groups which are each a line list
-        for line in horizontal_lines:
-            group_found = False
-            for line_group in horizontal_line_groups:
-
-                if line_group_accept_test(line_group, line, self.max_range):
-                    line_group.append(line)
-                    group_found = True
-
-            if not group_found:
-                horizontal_line_groups.append([line])
+        horizontal_lines = libvision.group_lines(horizontal_lines, self.max_range)
 
-        if len(horizontal_line_groups) is 1:
+        if len(horizontal_lines) is 1:
             self.seen_crossbar = True
-            rhos = map(lambda line: line[0], horizontal_line_groups[0])
-            angles = map(lambda line: line[1], horizontal_line_groups[0])
-            line = (sum(rhos)/len(rhos), circular_average(angles, math.pi))
-            horizontal_lines = [line]
         else:
             self.seen_crossbar = False
             horizontal_lines = []
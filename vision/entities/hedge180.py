@@ -9,7 +9,6 @@ import svr
 
 from base import VisionEntity
 import libvision
-from sw3.util import circular_average
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -23,26 +22,6 @@ HUE_SHIFT = {'red':-67,
              'yellow':-74}
 
 
-def line_group_accept_test(line_group, line, max_range):
-    '''
-    Returns True if the line should be let into the line group.
-
-    First calculates what the range of rho values would be if the line were
-    added.  If the range is greater than max_range the line is rejected and
-    False is returned.
-    '''
-    min_rho = line[0]
-    max_rho = line[0]
-    for l in line_group:
-        if l[0] > max_rho:
-            max_rho = l[0]
-        if l[0] < min_rho:
-            min_rho = l[0]
-    return max_rho - min_rho < max_range
-
-
-
-
 class Hedge180Entity(VisionEntity):
     name = "Hedge180"
 
@@ -55,6 +34,7 @@ class Hedge180Entity(VisionEntity):
         self.adaptive_thresh_blocksize = 19
         self.adaptive_thresh = 4
         self.max_range = 300
+        self.line_grouper = libvision.LineGrouper(self.max_range)
 
         self.target_shift = HUE_SHIFT['yellow'] #shift required to see gate
                                                      #color for thresholding
@@ -84,8 +64,8 @@ class Hedge180Entity(VisionEntity):
 
 
         #create locations for the a pair of test frames
-        frametest = cv.CreateImage(cv.GetSize(frame), 8, 3)
-        binarytest = cv.CreateImage(cv.GetSize(frame), 8, 1)
+        frametest = self.buffers.borrow(cv.GetSize(frame), 8, 3)
+        binarytest = self.buffers.borrow(cv.GetSize(frame), 8, 1)
         
         #use the red channel for the binary frame (just for debugging purposes)
         cv.Copy(frame, frametest)
@@ -103,15 +83,15 @@ class Hedge180Entity(VisionEntity):
         found_gate = False
 
         #create a new frame just for comparison purposes
-        unchanged_frame = cv.CreateImage(cv.GetSize(frame), 8, 3)
+        unchanged_frame = self.buffers.borrow(cv.GetSize(frame), 8, 3)
         cv.Copy(frame,unchanged_frame)
 
         #apply a course noise filter
         cv.Smooth(frame, frame, cv.CV_MEDIAN, 7, 7)
 
         # Set binary image to have saturation channel
-        hsv = cv.CreateImage(cv.GetSize(frame), 8, 3)
-        binary = cv.CreateImage(cv.GetSize(frame), 8, 1)
+        hsv = self.buffers.borrow(cv.GetSize(frame), 8, 3)
+        binary = self.buffers.borrow(cv.GetSize(frame), 8, 1)
         cv.CvtColor(frame, hsv, cv.CV_BGR2HSV)
         cv.SetImageCOI(hsv, 1)
         cv.Copy(hsv, binary)
@@ -142,7 +122,8 @@ class Hedge180Entity(VisionEntity):
         cv.Erode(binary, binary, kernel, 1)
         cv.Dilate(binary, binary, kernel, 1)
         if self.debug:
-            color_filtered = cv.CloneImage(binary)
+            color_filtered = self.buffers.borrow_like(binary)
+            cv.Copy(binary, color_filtered)
 
         # Get Edges
         cv.Canny(binary, binary, 30, 40)
@@ -170,30 +151,12 @@ class Hedge180Entity(VisionEntity):
         logging.debug("{} possibilities reduced to {} lines".format(
                         len(raw_lines), len(vertical_lines) ))
 
-        # Group vertical lines
-        vertical_line_groups = []  # A list of line groups which are each a line list
-        i = 0
-        for line in vertical_lines:
-            group_found = False
-            for line_group in vertical_line_groups:
-                i += 1
-                if line_group_accept_test(line_group, line, self.max_range):
-                    line_group.append(line)
-                    group_found = True
-
-            if not group_found:
-                vertical_line_groups.append([line])
+        # Group vertical lines and average each group into a line
+        vertical_lines = self.line_grouper.group(vertical_lines)
 
         #quick debugging statement
-        logging.debug("{} internal iterations for {} groups".format(i, len(vertical_line_groups)))
-
-        # Average line groups into lines
-        vertical_lines = []
-        for line_group in vertical_line_groups:
-            rhos = map(lambda line: line[0], line_group)
-            angles = map(lambda line: line[1], line_group)
-            line = (sum(rhos)/len(rhos), circular_average(angles, math.pi))
-            vertical_lines.append(line)
+        logging.debug("{} groups, {} lines dropped".format(
+                        len(vertical_lines), self.line_grouper.dropped))
 
         ####################################################
         #vvvv Horizontal line code isn't used for anything
@@ -208,25 +171,12 @@ class Hedge180Entity(VisionEntity):
                 horizontal_lines.append( (abs(line[0]), line[1]) )
 
         # Group horizontal lines
-        horizontal_line_groups = []  # A list of line groups which are each a line list
-        for line in horizontal_lines:
-            group_found = False
-            for line_group in horizontal_line_groups:
-
-                if line_group_accept_test(line_group, line, self.max_range):
-                    line_group.append(line)
-                    group_found = True
-
-            if not group_found:
-                horizontal_line_groups.append([line])
+        horizontal_line_groups = self.line_grouper.group(horizontal_lines)
 
         if len(horizontal_line_groups) is 1:
             self.seen_crossbar = True
             if self.debug:
-                rhos = map(lambda line: line[0], horizontal_line_groups[0])
-                angles = map(lambda line: line[1], horizontal_line_groups[0])
-                line = (sum(rhos)/len(rhos), circular_average(angles, math.pi))
-                horizontal_lines = [line]
+                horizontal_lines = horizontal_line_groups
         else:
             self.seen_crossbar = False
             horizontal_lines = []
@@ -65,7 +65,8 @@ class PathEntity(VisionEntity):
         cv.Smooth(frame, frame, cv.CV_MEDIAN, 7, 7)
 
         # use RGB color finder
-        binary = libvision.cmodules.target_color_rgb.find_target_color_rgb(frame, self.R, self.G, self.B, 
+        binary = self.buffers.borrow(cv.GetSize(frame), 8, 1)
+        libvision.cmodules.target_color_rgb.find_target_color_rgb_into(frame, binary, self.R, self.G, self.B, 
             self.min_blob_size, 
             self.dev_thresh, 
             self.precision/1000.0)
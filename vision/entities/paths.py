@@ -95,7 +95,7 @@ class PathsEntity(VisionEntity):
         return final_threshold
         # kono ko~do wa totemo utsukushii naa
 
-    def preprocess(self, frame):
+    def threshold_frame(self, frame):
         '''Preprocess an image by threasholding it to desired ranges and then
         converting it to 1-channel binary format.  The image is also converted
         to cv2 compatible format.
@@ -261,7 +261,7 @@ class PathsEntity(VisionEntity):
         Keyword Arguments:
         frame -- image in cv format to process
         '''
-        binary_img = self.preprocess(frame)
+        binary_img = self.threshold_frame(frame)
 
         grad = self.get_gradient(binary_img)
         hough_p = self.hough_p(grad)
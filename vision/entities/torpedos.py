@@ -102,73 +102,6 @@ class Line(object):
         return "{}, {}".format(self.rho, self.theta)
     """
 
-def line_group_accept_test(line_group, line, max_range_r, max_range_t):
-    '''
-    Returns True if the line should be let into the line group.
-
-    First calculates what the range of rho values would be if the line were
-    added.  If the range is greater than max_range the line is rejected and
-    False is returned.
-
-    ARGS:
-      line_group--a list of lines
-      line--line to be tested
-      ...
-    '''
-    #print "linegrp"
-    #print line_group
-    # unwrap rho, theta stuff
-    rho, theta = get_unwrapped_line(line)
-    max_rho = rho
-    min_rho = rho
-
-    for l in line_group:
-        l = get_unwrapped_line(l)
-        if l[0] > max_rho:
-            max_rho = l[0]
-        if l[0] < min_rho:
-            min_rho = l[0]
-
-    max_theta = theta
-    min_theta = theta
-
-    for l in line_group:
-        l = get_unwrapped_line(l)
-        if l[1] > max_theta:
-            max_theta = l[1]
-        if l[1] < min_theta:
-            min_theta = l[1]
-    
-    in_range_rho = (max_rho - min_rho < max_range_r)
-    in_range_theta = (max_theta - min_theta < max_range_t)
-    if in_range_rho and in_range_theta:
-        return True
-    else:
-        #print "fail logic: rho={}, theta={}".format(in_range_rho, in_range_theta)
-        if not in_range_rho:
-            #print "line_group rho={}".format(line_group[0])
-            #print "min_rho={}".format(min_rho)
-            #print "max_rho={}".format(max_rho)
-            pass
-
-def get_unwrapped_line(line):
-    # if input is a Line object
-    if isinstance(line, Line):
-        flipped = line.rho < 0
-        if flipped:
-            return Line( (-line.rho, line.theta-np.pi) )
-        else:
-            return line
-
-    # if input is just a line tuple
-    else:
-        flipped = line[0] < 0
-        if flipped:
-            return (-line[0], line[1]-np.pi)
-        else:
-            return line
-
-
 def clamp(n, minn, maxn):
     return max(min(maxn, n), minn)
 
@@ -211,8 +144,31 @@ class TorpedosEntity(VisionEntity):
         self.trans_thresh = 10
         self.lastseen_max = 100
 
-        # line grouping parameters
-        self.line_group = []
+        # A bin is a candidate until it has been seen enough to reach
+        # seencount_thresh, then it is confirmed.  lastseen goes up when the
+        # bin is seen and down every frame, and the bin is forgotten once it
+        # drops below lastseen_thresh.
+        self.tracker = libvision.MultiTracker(
+            gate=self.trans_thresh,
+            confirm_hits=self.seencount_thresh,
+            hit_increment=3,
+            hit_score=6,
+            max_score=self.lastseen_max,
+            initial_score=5,
+            min_score=self.lastseen_thresh,
+            candidate_decay=2,
+            confirmed_decay=1,
+            position_attrs=("midx", "midy"),
+            score_attr="lastseen",
+            hits_attr="seencount",
+        )
+
+        # line grouping parameters.  Lines are grouped unwrapped, with
+        # positive rho and theta in [-pi, pi), so that lines on both sides of
+        # theta=0 and theta=pi group together.
+        self.line_grouper = libvision.LineGrouper(20, np.pi/10.0,
+                                                  period=2*np.pi,
+                                                  first_match=True)
         self.avg_line_group = []
 
         # create test parameters
@@ -351,34 +307,22 @@ class TorpedosEntity(VisionEntity):
         # part 3: eliminate duplicates
         # ######
 
-        # convert lines to objects
-        lines = self.objectify_cv_lines(lines)
-
-        self.clear_line_groups()
-        for n,line in enumerate(lines):
+        self.line_grouper.reset()
+        for n,line in enumerate(libvision.line_grouping.unwrap_lines(lines)):
+            groups = self.line_grouper.add(line[0], line[1])
             if DEBUG_LINE_GROUPS:
-                print "analyzing line{}: {}".format(n,line)
-            self.match_line_group(line)
+                print "line{}: {} accepted into group{}".format(n, line, groups)
 
         # print debug messages
         if DEBUG_LINE_GROUPS:
             print "---"
-            print "printing line groups:"
-            for i,group in enumerate(self.line_group):
-                print "group{}".format(i)
-                for line in group:
-                    print line
+            print "line group sizes: {}".format(self.line_grouper.counts())
 
-
-        # convert groups to averages
+        # convert groups to averages, as line objects
+        avg_lines = libvision.line_grouping.wrap_lines(self.line_grouper.lines())
+        self.avg_line_group = self.objectify_cv_lines(avg_lines)
         if DEBUG_LINE_GROUPS:
-            print "---"
-        self.avg_line_group = []
-        for group in self.line_group:
-            line = self.avg_group(group)
-            self.avg_line_group.append(line)
-
-            if DEBUG_LINE_GROUPS:
+            for line in self.avg_line_group:
                 print line
 
         lines = self.avg_line_group
@@ -405,34 +349,6 @@ class TorpedosEntity(VisionEntity):
         self.print_frame("points", debug_frame)
 
 
-    def avg_group(self, lines):
-        rho_sum = 0
-        theta_sum = 0
-
-
-        # accumulate rho and theta values
-        for line in lines:
-            # check if line if flipped around
-            flipped = (line.rho < 0)
-
-            if not flipped:
-                rho_sum += line.rho
-                theta_sum += line.theta
-            else:
-                rho_sum += -line.rho
-                theta_sum += line.theta - np.pi
-
-        # average the values
-        avg_rho = rho_sum / float(len(lines))
-        avg_theta = theta_sum / float(len(lines))
-
-        # if line is in the nether region theta-wise, flip it.
-        if avg_theta < 0:
-            avg_rho = -avg_rho
-            avg_theta += np.pi
-
-        return Line( (avg_rho, avg_theta) )
-        
     def objectify_cv_lines(self, lines):
         line_list = []
         for line in lines:
@@ -440,37 +356,6 @@ class TorpedosEntity(VisionEntity):
 
         return line_list
     
-    def clear_line_groups(self):
-        self.line_group = []
-
-    def match_line_group(self, line):
-        if len(self.line_group) == 0:
-            self.line_group.append([line])
-            return
-        
-        match_found = False
-        for i,group in enumerate(self.line_group):
-            # check each line_group to see if there's a match
-            if line_group_accept_test(group, line, 20, np.pi/10.0):
-                self.line_group[i].append(line)
-                match_found = True
-
-                if DEBUG_LINE_GROUPS:
-                    print "line{} accepted into group{}".format(line,i)
-                
-                break
-        
-        # if no match was found, create a new line group
-        if not match_found:
-            self.line_group.append( [line] )
-
-            if DEBUG_LINE_GROUPS:
-                print "line{} is a new line. creating group{}.".format(line,i+1)
-            
-            pass
-
-        
-
     def get_channel(self, in_frame, channel, debug=False):
         if channel >= 3:
             out_frame = cv2.cvtColor(in_frame, cv2.COLOR_BGR2HSV) 
@@ -489,22 +374,39 @@ class TorpedosEntity(VisionEntity):
     def bin_algorithm1(self, frame, debug=False):
         debug_frame = frame
 
-        # thresholding
-        adaptive_frame = self.adaptive_threshold(frame, channel=1, 
-                                                 blk_size=13, 
-                                                 thresh=18)
+        min_area = 1000
+        max_area = 8000
 
-        self.print_frame("adaptive", adaptive_frame)
+        if self.scale_policy.downscaled:
+            contours = self.find_contours_coarse_to_fine(min_area, max_area)
+            self.raw_bins = self.bins_from_contours(contours,
+                                                    min_area=min_area,
+                                                    max_area=max_area,
+                                                    debug_frame=debug_frame)
+            self.profiler.lap("contour")
+        else:
+            # thresholding
+            self.print_frame('channel_frame', self.preprocess.channel(1))
+            adaptive_frame = self.preprocess.adaptive_threshold(channel=1,
+                                                                blk_size=13,
+                                                                thresh=18)
+
+            self.print_frame("adaptive", adaptive_frame)
+            self.profiler.lap("threshold")
 
-        despeckled_frame = self.morphology(adaptive_frame, [-3,3])
+            despeckled_frame = libvision.cv_to_cv2(self.buffers.borrow(
+                (self.frame_width, self.frame_height), 8, 1))
+            self.morphology(adaptive_frame, [-3,3], despeckled_frame)
+            self.profiler.lap("morphology")
 
-        #print contours
-        self.raw_bins = []
+            #print contours
+            self.raw_bins = []
 
-        self.raw_bins = self.find_bins(despeckled_frame,
-                                       min_area=1000,
-                                       max_area=8000,
-                                       debug_frame=debug_frame)
+            self.raw_bins = self.find_bins(despeckled_frame,
+                                           min_area=min_area,
+                                           max_area=max_area,
+                                           debug_frame=debug_frame)
+            self.profiler.lap("contour")
 
 
         self.print_frame("debug",debug_frame)
@@ -512,16 +414,16 @@ class TorpedosEntity(VisionEntity):
             print "candidates={}, confirmed={}".format(len(self.candidates), len(self.confirmed))
         
         # match, sort, and draw
-        for bin in self.raw_bins:
-            self.match_bins(bin)
+        self.match_bins(self.raw_bins)
 
         if DEBUG_BIN_IDENTIFICATION:
             print "candidates={}, confirmed={}".format(len(self.candidates), len(self.confirmed))
         
-        self.sort_bins()
+        self.profiler.lap("tracking")
         self.draw_bins(debug_frame)
 
         self.print_frame("debug", debug_frame)
+        self.profiler.lap("debug")
 
 
         
@@ -544,30 +446,68 @@ class TorpedosEntity(VisionEntity):
         # return
         return frame
 
-    def morphology(self, frame, sequence):
+    def morphology(self, frame, sequence, dst=None):
+        # Positive values dilate and negative values erode, with elliptical
+        # kernels of that size.  See libvision/morphology.py.
+        return libvision.apply_sequence(frame, sequence, dst)
+
+    def find_contours_coarse_to_fine(self, min_area, max_area):
+        # Thresholds the frame downscaled by the scale policy and finds the
+        # contours of bin sized shapes.  Unless the policy says not to, the
+        # contours are then found again at full resolution around each one.
+        policy = self.scale_policy
+        coarse = self.preprocess.level(policy.scale)
+        adaptive_frame = coarse.adaptive_threshold(channel=1,
+                                                   blk_size=policy.scale_odd(13),
+                                                   thresh=18)
+        self.print_frame("adaptive", adaptive_frame)
+        self.profiler.lap("threshold")
 
-        for val in sequence:
-            # perform transformation
-            if val > 0:
-                kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (val, val))
-                frame = cv2.dilate(frame, kernel)
-            elif val < 0:
-                val = -val
-                kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (val, val))
-                frame = cv2.erode(frame, kernel)
-            else:
-                pass #do nothing
+        kernel_size = policy.scale_length(3)
+        despeckled_frame = self.morphology(adaptive_frame, [-kernel_size, kernel_size])
+        self.profiler.lap("morphology")
 
-        return frame
+        contours, hierarchy = cv2.findContours(despeckled_frame,
+                                               cv2.RETR_EXTERNAL,
+                                               cv2.CHAIN_APPROX_SIMPLE)
+        if not policy.refine:
+            return [np.round(policy.to_full(cnt)).astype(np.int32) for cnt in contours]
+
+        # Bin sized shapes, with some slack for the lost precision.  The real
+        # tests are done at full resolution.
+        candidates = []
+        for cnt in contours:
+            (x, y), (w, h), theta = cv2.minAreaRect(cnt)
+            area = w * h / policy.scale ** 2
+            if min_area / 2 < area < max_area * 2:
+                candidates.append((x, y, max(w, h) / 2))
+
+        rois = policy.refine_regions(candidates, (self.frame_width, self.frame_height))
+        channel_frame = self.preprocess.channel(1)
+        contours = []
+        for (x, y, w, h) in rois:
+            roi_threshold = cv2.adaptiveThreshold(channel_frame[y:y+h, x:x+w], 255,
+                                                  cv2.ADAPTIVE_THRESH_MEAN_C,
+                                                  cv2.THRESH_BINARY_INV,
+                                                  13, 18)
+            roi_threshold = self.morphology(roi_threshold, [-3,3])
+            roi_contours, hierarchy = cv2.findContours(roi_threshold,
+                                                       cv2.RETR_EXTERNAL,
+                                                       cv2.CHAIN_APPROX_SIMPLE,
+                                                       offset=(x, y))
+            contours.extend(roi_contours)
+        return contours
 
     def find_bins(self, frame, min_area, max_area, debug_frame):
-        # empty variables
-        discovered_bins = []
-
         # Find contours of every shape present after threshold
         contours, hierarchy = cv2.findContours(frame,
                                                cv2.RETR_EXTERNAL,
                                                cv2.CHAIN_APPROX_SIMPLE)
+        return self.bins_from_contours(contours, min_area, max_area, debug_frame)
+
+    def bins_from_contours(self, contours, min_area, max_area, debug_frame):
+        # empty variables
+        discovered_bins = []
 
         # if there are enough contours for at least one bin
         if len(contours) > 1:
@@ -619,94 +559,18 @@ class TorpedosEntity(VisionEntity):
         print "found {} contours. {} are bins.".format(len(contours), len(discovered_bins))
         return discovered_bins
     
-    def match_bins(self, target):
-        found = 0
-
-
-        for confirmed_bin in self.confirmed:
-
-            if math.fabs(confirmed_bin.midx - target.midx) < self.trans_thresh and \
-               math.fabs(confirmed_bin.midy - target.midy) < self.trans_thresh:
-
-                # raise the found flag
-                found = 1
-
-                # update the confirmed bin to match the target bin
-                confirmed_bin.midx = target.midx
-                confirmed_bin.midy = target.midy
-                confirmed_bin.corner1 = target.corner1
-                confirmed_bin.corner2 = target.corner2
-                confirmed_bin.corner3 = target.corner3
-                confirmed_bin.corner4 = target.corner4
-                confirmed_bin.theta = target.theta
-                confirmed_bin.seencount += 3
-
-                # increment last seen counter until it reaches the cap
-                if confirmed_bin.lastseen < self.lastseen_max:
-                    confirmed_bin.lastseen += 6
-
-        for candidate_bin in self.candidates:
-
-            if math.fabs(candidate_bin.midx - target.midx) < self.trans_thresh and \
-               math.fabs(candidate_bin.midy - target.midy) < self.trans_thresh:
-                
-                # raise the found flag
-                found = 1
-
-                # update the candidate bin to match the target bin
-                candidate_bin.midx = target.midx
-                candidate_bin.midy = target.midy
-                candidate_bin.corner1 = target.corner1
-                candidate_bin.corner2 = target.corner2
-                candidate_bin.corner3 = target.corner3
-                candidate_bin.corner4 = target.corner4
-                candidate_bin.theta = target.theta
-                candidate_bin.seencount += 3
-
-                # increment last seen counter until it reaches the cap
-                if candidate_bin.lastseen < self.lastseen_max:
-                    candidate_bin.lastseen += 6
-
-        # if target bin didn't match anything, make it a candidate
-        if found == 0:
-            self.add_candidate(target)
-            target.lastseen += 3
-
-
-    def add_candidate(self, bin):
-        self.candidates.append(bin)
-        #print "candidate appended"
-
-    def remove_candidate(self, bin):
-        self.candidates.remove(bin)
-        #print "candidate removed"
-    
-    def sort_bins(self):
-
-        for candidate_bin in self.candidates[:]:
-            # auto decrement
-            candidate_bin.lastseen -= 2
-
-            # if candidate bin has been seen enough times...
-            if candidate_bin.seencount >= self.seencount_thresh:
-
-                self.confirmed.append(candidate_bin)
-                self.candidates.remove(candidate_bin)
-                print "confirmed appended"
-
-            # else, check if candidate bin has disappeared
-            elif candidate_bin.lastseen < self.lastseen_thresh:
-                self.remove_candidate(candidate_bin)
-
-        for confirmed_bin in self.confirmed[:]:
-            # auto decrement
-            confirmed_bin.lastseen -= 1
-
-            # if confirmed bin has disappeared
-            if confirmed_bin.lastseen < self.lastseen_thresh:
-
-                self.confirmed.remove(confirmed_bin)
-                print "confirmed removed"
+    def match_bins(self, bins):
+        for tracked_bin, target in self.tracker.update(bins):
+            # update the tracked bin to match the target bin
+            tracked_bin.corner1 = target.corner1
+            tracked_bin.corner2 = target.corner2
+            tracked_bin.corner3 = target.corner3
+            tracked_bin.corner4 = target.corner4
+            tracked_bin.theta = target.theta
+
+        # sort bins among confirmed/candidates
+        self.candidates = self.tracker.candidates()
+        self.confirmed = self.tracker.confirmed()
 
     def draw_bins(self, test_frame):
         self.ind_bins = []
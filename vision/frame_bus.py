@@ -0,0 +1,270 @@
+'''
+Shared memory frame buses.
+
+A FrameBus owns a single camera or SVR stream.  It captures frames in its own
+process and publishes them into a ring of shared memory slots, so a frame is
+captured and decoded once per camera no matter how many entities consume it.
+Entities read from the bus through a FrameBusReader, which can hand out
+zero-copy NumPy views of the shared slots.
+
+The shared memory is allocated with multiprocessing.RawArray before any
+entity process is forked, so every process sees the same buffers.
+
+Only live sources belong on a bus (see is_live_source()).  The capture
+process publishes frames as fast as its source gives them, which for a
+camera or SVR stream is the frame rate.  A video or image file would be read
+as fast as it can be decoded, so those are captured by each entity in
+lockstep instead.
+'''
+
+import ctypes
+import time
+import traceback
+from multiprocessing import Process, Condition, Event, RawArray, RawValue
+
+import numpy as np
+
+import svr
+
+import libvision
+
+# Default capacity of a single ring slot, in bytes.  Large enough for a
+# 1280x1024 BGR frame.
+DEFAULT_MAX_FRAME_BYTES = 1280 * 1024 * 3
+DEFAULT_SLOTS = 4
+
+# Layout of the per-slot header.  SEQ is -1 while the slot is being written.
+SEQ = 0
+HEIGHT = 1
+WIDTH = 2
+CHANNELS = 3
+HEADER_FIELDS = 4
+
+
+class FrameBusClosed(Exception):
+
+    '''Raised by a reader when the bus's capture has stopped.'''
+    pass
+
+
+class FrameBus(object):
+
+    '''A ring buffer of raw frames in shared memory, fed by one capture process.
+
+    Arguments:
+
+        camera_name - Name of the camera or SVR stream to capture from.  If
+            the name is a key of cameras, the camera is opened directly with
+            libvision.Camera, otherwise an svr.Stream is used, exactly as
+            VisionEntity does.
+
+        cameras - Dict of {<camera_name>: <path/index>}.  See VisionEntity.
+
+        display - Passed to libvision.Camera, as VisionEntity does with its
+            debug flag.
+
+        slots - Number of frames held in the ring.  A zero-copy view handed
+            out by FrameBusReader.get_frame_view() stays valid until slots-1
+            newer frames have been captured.
+
+        max_frame_bytes - Capacity of each slot.  Frames larger than this
+            cannot be published.
+
+    '''
+
+    def __init__(self, camera_name, cameras={}, slots=DEFAULT_SLOTS,
+                 max_frame_bytes=DEFAULT_MAX_FRAME_BYTES, display=False):
+        if slots < 2:
+            raise ValueError("A frame bus needs at least two slots.")
+
+        self.camera_name = camera_name
+        self.cameras = cameras
+        self.display = display
+        self.slots = slots
+        self.max_frame_bytes = max_frame_bytes
+
+        self._data = RawArray(ctypes.c_ubyte, slots * max_frame_bytes)
+        self._headers = RawArray(ctypes.c_long, slots * HEADER_FIELDS)
+        self._timestamps = RawArray(ctypes.c_double, slots)
+        self._latest = RawValue(ctypes.c_long, 0)
+        self._new_frame = Condition()
+        self._stop = Event()
+        self._closed = Event()
+        self.process = None
+
+    def start(self):
+        '''Starts the capture process.'''
+        self.process = Process(target=run_frame_bus, args=(self,))
+        self.process.daemon = True
+        self.process.start()
+
+    def stop(self):
+        '''Stops the capture process.  Readers will raise FrameBusClosed.'''
+        self._stop.set()
+        if self.process is not None:
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        self._close()
+
+    def is_running(self):
+        return self.process is not None and not self._closed.is_set()
+
+    def reader(self):
+        '''Returns a new FrameBusReader for this bus.'''
+        return FrameBusReader(self)
+
+    def publish(self, frame, timestamp=None):
+        '''Copies a NumPy frame into the next ring slot.
+
+        Called from the capture process.  The slot's sequence number is set
+        to -1 while it is written, so readers can detect a torn read.
+        '''
+        if frame.nbytes > self.max_frame_bytes:
+            raise ValueError("Frame of %d bytes does not fit in a %d byte slot."
+                             % (frame.nbytes, self.max_frame_bytes))
+        if timestamp is None:
+            timestamp = time.time()
+
+        seq = self._latest.value + 1
+        slot = seq % self.slots
+        header = slot * HEADER_FIELDS
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+
+        self._headers[header + SEQ] = -1
+        self._slot_array(slot, frame.nbytes)[:] = frame.reshape(-1)
+        self._headers[header + HEIGHT] = height
+        self._headers[header + WIDTH] = width
+        self._headers[header + CHANNELS] = channels
+        self._timestamps[slot] = timestamp
+        self._headers[header + SEQ] = seq
+
+        with self._new_frame:
+            self._latest.value = seq
+            self._new_frame.notify_all()
+
+    def _slot_array(self, slot, nbytes):
+        '''A flat uint8 view of the first nbytes of a slot.'''
+        return np.frombuffer(self._data, dtype=np.uint8, count=nbytes,
+                             offset=slot * self.max_frame_bytes)
+
+    def _close(self):
+        with self._new_frame:
+            self._closed.set()
+            self._new_frame.notify_all()
+
+    def __repr__(self):
+        return "<FrameBus camera=%s slots=%d>" % (self.camera_name, self.slots)
+
+
+class FrameBusReader(object):
+
+    '''Reads the newest frames from a FrameBus.
+
+    Has the same get_frame() interface as svr.Stream and libvision.Camera, so
+    it can be used as an entity's capture.  Each call blocks until a frame
+    newer than the last one returned is available.
+    '''
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.last_seq = 0
+        self.last_timestamp = None
+
+    def get_frame_view(self, timeout=None):
+        '''Returns the newest frame as a read-only NumPy view of shared memory.
+
+        No data is copied.  The view is only valid until the ring wraps around
+        to its slot again, so it must not be held onto across frames.  Returns
+        None if timeout (in seconds) passes without a new frame.
+        '''
+        bus = self.bus
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with bus._new_frame:
+                while bus._latest.value <= self.last_seq:
+                    if bus._closed.is_set():
+                        raise FrameBusClosed("Frame bus for '%s' has closed."
+                                             % bus.camera_name)
+                    if deadline is None:
+                        wait = 0.5
+                    else:
+                        wait = deadline - time.time()
+                        if wait <= 0:
+                            return None
+                    bus._new_frame.wait(wait)
+                seq = bus._latest.value
+
+            slot = seq % bus.slots
+            header = slot * HEADER_FIELDS
+            shape = (bus._headers[header + HEIGHT],
+                     bus._headers[header + WIDTH],
+                     bus._headers[header + CHANNELS])
+            timestamp = bus._timestamps[slot]
+            if bus._headers[header + SEQ] != seq:
+                # The writer lapped us while we were looking; try again
+                continue
+
+            view = bus._slot_array(slot, shape[0] * shape[1] * shape[2])
+            if shape[2] == 1:
+                view = view.reshape(shape[:2])
+            else:
+                view = view.reshape(shape)
+            view.flags.writeable = False
+
+            self.last_seq = seq
+            self.last_timestamp = timestamp
+            return view
+
+    def get_frame(self):
+        '''Returns the newest frame as a cv image that the caller may modify.
+
+        The frame is copied out of shared memory once, which also protects
+        the shared slot from entities that process frames in place.
+        '''
+        while True:
+            view = self.get_frame_view()
+            frame = view.copy()
+            seq = self.last_seq
+            if self.bus._headers[(seq % self.bus.slots) * HEADER_FIELDS + SEQ] == seq:
+                return libvision.cv2_to_cv(frame)
+
+    def __repr__(self):
+        return "<FrameBusReader camera=%s>" % self.bus.camera_name
+
+
+def is_live_source(camera_name, cameras={}):
+    '''
+    Returns True if camera_name is an SVR stream or a camera index, which
+    produce frames at their own rate.  Video and image files return False.
+    '''
+    if camera_name not in cameras:
+        return True
+    identifier = cameras[camera_name]
+    try:
+        int(identifier)
+    except ValueError:
+        return False
+    return True
+
+
+def run_frame_bus(bus):
+    '''Captures frames for a FrameBus until it is stopped.'''
+    try:
+        svr.connect()
+        if bus.camera_name in bus.cameras:
+            capture = libvision.Camera(bus.cameras[bus.camera_name], display=bus.display)
+        else:
+            capture = svr.Stream(bus.camera_name)
+            capture.unpause()
+
+        while not bus._stop.is_set():
+            frame = capture.get_frame()
+            bus.publish(libvision.cv_to_cv2(frame))
+
+    except Exception:
+        traceback.print_exc()
+    finally:
+        bus._close()
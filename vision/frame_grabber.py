@@ -0,0 +1,135 @@
+'''
+Latest-frame-wins capture.
+
+Normally an entity processes every frame its capture returns, in lockstep.  If
+process_frame() is slower than the camera, the frames queued up in the camera
+or stream make results lag further and further behind the robot.  A
+LatestFrameCapture grabs frames in a background thread and keeps only the
+newest one, so the entity always processes a recent frame.  Which of the
+captured frames get processed is decided by a drop policy:
+
+    newest - The newest frame, whenever the entity is ready for one.
+
+    every_nth - Only every nth captured frame.  The frames between are
+        dropped even when the entity could keep up.
+
+    deadline - The newest frame, as long as it was captured less than
+        deadline seconds ago.  Older frames are dropped, and the entity waits
+        for a fresh one.
+
+'''
+
+import threading
+import time
+
+import cv
+
+DROP_POLICIES = ("newest", "every_nth", "deadline")
+DEFAULT_EVERY_NTH = 2
+DEFAULT_DEADLINE = 0.1
+
+
+class LatestFrameCapture(object):
+
+    '''Wraps a capture so that get_frame() returns the newest frame.
+
+    Arguments:
+
+        capture - Anything with a get_frame() method, such as an svr.Stream,
+            a libvision.Camera or a FrameBusReader.
+
+        policy - One of DROP_POLICIES.
+
+        every_nth - Used by the every_nth policy.
+
+        deadline - Maximum frame age, in seconds, used by the deadline policy.
+
+        copy - If True, each frame is copied as it is captured.  Needed for
+            captures that reuse their frame buffer, like libvision.Camera.
+
+    '''
+
+    def __init__(self, capture, policy="newest", every_nth=DEFAULT_EVERY_NTH,
+                 deadline=DEFAULT_DEADLINE, copy=True):
+        if policy not in DROP_POLICIES:
+            raise ValueError("Unknown drop policy '%s'.  Must be one of %s."
+                             % (policy, ", ".join(DROP_POLICIES)))
+        self.capture = capture
+        self.policy = policy
+        self.every_nth = every_nth
+        self.deadline = deadline
+        self.copy = copy
+
+        # Written by the grabbing thread, guarded by self._new_frame
+        self._new_frame = threading.Condition()
+        self._frame = None
+        self._timestamp = None
+        self._seq = 0
+        self._error = None
+        self._running = True
+
+        # Describes the frame last returned by get_frame()
+        self.last_seq = 0
+        self.last_timestamp = None
+        self.dropped = 0
+
+        self._thread = threading.Thread(target=self._grab)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _grab(self):
+        while self._running:
+            try:
+                frame = self.capture.get_frame()
+                # Captures that know when a frame was taken expose it as
+                # last_timestamp, like FrameBusReader
+                timestamp = getattr(self.capture, "last_timestamp", None) or time.time()
+                if self.copy:
+                    frame = cv.CloneImage(frame)
+            except Exception as e:
+                with self._new_frame:
+                    self._error = e
+                    self._new_frame.notify_all()
+                return
+
+            with self._new_frame:
+                self._frame = frame
+                self._timestamp = timestamp
+                self._seq += 1
+                self._new_frame.notify_all()
+
+    def _acceptable(self):
+        '''Returns True if the held frame may be returned under the policy.'''
+        if self._seq <= self.last_seq:
+            return False
+        if self.policy == "every_nth":
+            return self._seq % self.every_nth == 0
+        if self.policy == "deadline":
+            return time.time() - self._timestamp <= self.deadline
+        return True
+
+    def get_frame(self):
+        '''Blocks until a frame acceptable under the drop policy is available.
+
+        Raises whatever exception the underlying capture raised, if it
+        failed.
+        '''
+        with self._new_frame:
+            while not self._acceptable():
+                if self._error is not None:
+                    raise self._error
+                # A timeout keeps the wait interruptible
+                self._new_frame.wait(0.5)
+
+            self.dropped += self._seq - self.last_seq - 1
+            self.last_seq = self._seq
+            self.last_timestamp = self._timestamp
+            return self._frame
+
+    def stop(self):
+        '''Stops grabbing frames.  The underlying capture is not closed.'''
+        self._running = False
+
+    def __repr__(self):
+        return "<LatestFrameCapture policy=%s dropped=%d capture=%s>" % (
+            self.policy, self.dropped, self.capture)
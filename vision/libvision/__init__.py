@@ -9,6 +9,13 @@ import hist
 import misc
 import greymap
 import error
-from tracking import Tracker
+from tracking import Tracker, MultiTracker
+from buffer_pool import BufferPool
+from preprocess import FrameCache
 from buoy_analyzer import buoy_analyzer
 from line_reducer import hough_line_reduce
+from line_grouping import LineGrouper, group_lines
+from roi import pad_rectangle, merge_rectangles
+from pyramid import ScalePolicy, FULL_RESOLUTION
+from morphology import get_kernel, MorphologySequence, apply_sequence
+from parallel import TilePool
@@ -0,0 +1,99 @@
+'''
+Reusable image buffers.
+
+Allocating a fresh cv image for every intermediate result of every frame
+churns the allocator and page faults on the embedded board.  A BufferPool
+hands out images keyed by (size, depth, channels) and takes them back when
+the caller is done, so once an entity has processed a frame or two it stops
+allocating altogether:
+
+    hsv = self.buffers.borrow(cv.GetSize(frame), 8, 3)
+    cv.CvtColor(frame, hsv, cv.CV_BGR2HSV)
+    ...
+    self.buffers.release(hsv)  # Or release_all() at the end of the frame
+
+Borrowed images have undefined contents.  Callers must overwrite them fully.
+
+Free images are kept per (size, depth, channels) for the life of the pool, so
+borrow a few fixed sizes, like the frame size, rather than sizes that change
+every frame.  Call clear() to let the free images go.
+'''
+
+import cv
+
+
+class BufferPool(object):
+
+    '''A pool of cv images that can be borrowed and returned.
+
+    Not thread safe.  Each entity owns its own pool.
+    '''
+
+    def __init__(self):
+        self._free = {}  # Maps (size, depth, channels) -> list of free images
+        self._borrowed = {}  # Maps id(image) -> (key, image)
+
+    def borrow(self, size, depth, channels):
+        '''Returns an image of the given size, depth and channels.
+
+        The image is reused from an earlier release() if one is available,
+        otherwise a new one is created.
+        '''
+        key = (tuple(size), depth, channels)
+        free = self._free.get(key)
+        if free:
+            image = free.pop()
+        else:
+            image = cv.CreateImage(key[0], depth, channels)
+        self._borrowed[id(image)] = (key, image)
+        return image
+
+    def borrow_like(self, image, depth=None, channels=None):
+        '''
+        Borrows an image the same size as the given image.  depth and channels
+        default to those of the given image.
+        '''
+        if depth is None:
+            depth = image.depth
+        if channels is None:
+            channels = image.channels
+        return self.borrow(cv.GetSize(image), depth, channels)
+
+    def release(self, image):
+        '''Returns a borrowed image to the pool.
+
+        The image must not be used by the caller afterwards.
+        '''
+        try:
+            key, image = self._borrowed.pop(id(image))
+        except KeyError:
+            raise ValueError("Image was not borrowed from this pool.")
+        cv.ResetImageROI(image)
+        cv.SetImageCOI(image, 0)
+        self._free.setdefault(key, []).append(image)
+
+    def release_all(self):
+        '''Returns every borrowed image to the pool.'''
+        for key, image in self._borrowed.values():
+            cv.ResetImageROI(image)
+            cv.SetImageCOI(image, 0)
+            self._free.setdefault(key, []).append(image)
+        self._borrowed.clear()
+
+    def clear(self):
+        '''Forgets every free image, letting them be deallocated.'''
+        self._free.clear()
+
+    def borrowed_count(self):
+        return len(self._borrowed)
+
+    def free_count(self):
+        return sum(len(free) for free in self._free.itervalues())
+
+    def __getstate__(self):
+        # cv images can't be pickled.  A pickled pool starts out empty.
+        return {"_free": {}, "_borrowed": {}}
+
+    def __repr__(self):
+        return "<BufferPool borrowed=%d free=%d>" % (self.borrowed_count(),
+                                                     self.free_count())
@@ -15,7 +15,8 @@ def buoy_analyzer(src, buoys):
         buoy_struct = cmodules.BuoyROIStruct(buoy.x, buoy.y, buoy.width, buoy.width)
         rois[i] = ctypes.pointer(buoy_struct)
 
-    color_sequence = cmodules.buoy_analyzer.buoy_color(src, rois, len(buoys))
+    color_sequence = (ctypes.c_int * len(buoys))()
+    cmodules.buoy_analyzer.buoy_color_into(src, rois, len(buoys), color_sequence)
 
     for i, buoy in enumerate(buoys):
         buoy.color = color_sequence[i]
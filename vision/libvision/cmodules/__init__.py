@@ -53,30 +53,59 @@ module.  At least read the section below about limitations before writing your o
 module.
 
 
+Output Images
+-------------
+Returning an IplImage_p means the C function allocates a new image every call,
+and its pixels are copied once more into the Python image.  Functions on the
+per-frame path should instead take an OutputIplImage_p argument and write into
+it.  The caller passes an image it already has, for example one borrowed from
+a libvision.BufferPool, and it is handed to C without any copying:
+
+>>> binary = buffers.borrow(cv.GetSize(frame), 8, 1)
+>>> cmodules.target_color_rgb.find_target_color_rgb_into(frame, binary, ...)
+
+NumPy arrays may be passed wherever a cv image is expected.
+
+Functions that return structures work the same way.  find_bins_into() and
+buoy_color_into() fill a ctypes array the caller allocates once, instead of
+returning memory that has to be freed after every call:
+
+>>> rects = (cmodules.cRect * cmodules.MAX_BINS)()
+>>> count = cmodules.shape_detect.find_bins_into(frame, rects, len(rects))
+
+
 Limitations
 -----------
-TODO
+IplImage_p arguments are passed without copying as well, unless the image's
+rows are padded (widthStep is larger than width * nChannels).  Padded images
+are packed into a temporary copy first, because most C functions here assume
+there is no padding.  Changes the C function makes to an IplImage_p argument
+may therefore be lost.  Use OutputIplImage_p for images that are written to.
+C functions taking an OutputIplImage_p must honour widthStep.
+
+ROI and COI are ignored.  The whole image is always passed.
 
 '''
-# TODO: Write Limitations section
 # TODO: Where does documentation for modules go?
 
 import ctypes
 
 from cmodule import CModule, CFunction
-from cvtypes import IplImage, IplImage_p, CvPoint
+from cvtypes import IplImage, IplImage_p, OutputIplImage_p, CvPoint
 
 
 # Target Color Module
 
 target_color_rgb = CModule("target_color_rgb.so", [
-    CFunction("find_target_color_rgb", IplImage_p, [IplImage_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_double])
+    CFunction("find_target_color_rgb", IplImage_p, [IplImage_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_double]),
+    CFunction("find_target_color_rgb_into", None, [IplImage_p, OutputIplImage_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_double]),
 ])
 
 # Target Color HSV Module
 
 target_color_hsv = CModule("target_color_hsv.so", [
-    CFunction("find_target_color_hsv", IplImage_p, [IplImage_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_double])
+    CFunction("find_target_color_hsv", IplImage_p, [IplImage_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_double]),
+    CFunction("find_target_color_hsv_into", None, [IplImage_p, OutputIplImage_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_double]),
 ])
 
 # Shape Detect Module
@@ -93,9 +122,13 @@ class cRect(ctypes.Structure):
 cRect_p = ctypes.POINTER(cRect)
 cRect_p_p = ctypes.POINTER(cRect_p)
 
+# find_bins() never finds more bins than this (CORNER_COUNT in shape_detect.c)
+MAX_BINS = 15
+
 shape_detect = CModule("shape_detect.so", [
     CFunction("match_letters", ctypes.c_int, [IplImage_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]),
     CFunction("find_bins", cRect_p_p, [IplImage_p, ctypes.POINTER(ctypes.c_int)]),
+    CFunction("find_bins_into", ctypes.c_int, [IplImage_p, cRect_p, ctypes.c_int]),
     CFunction("free_bins", None, [cRect_p_p, ctypes.c_int])
 ])
 
@@ -112,7 +145,8 @@ class BuoyROIStruct(ctypes.Structure):
 BuoyROIStruct_p = ctypes.POINTER(BuoyROIStruct)
 BuoyROIStruct_p_p = ctypes.POINTER(BuoyROIStruct_p)
 buoy_analyzer = CModule("buoy_analyzer.so", [
-    CFunction("buoy_color", ctypes.POINTER(ctypes.c_int), [IplImage_p, BuoyROIStruct_p_p, ctypes.c_int])
+    CFunction("buoy_color", ctypes.POINTER(ctypes.c_int), [IplImage_p, BuoyROIStruct_p_p, ctypes.c_int]),
+    CFunction("buoy_color_into", None, [IplImage_p, BuoyROIStruct_p_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]),
 ])
 
 # Instantiate CModule objects below:
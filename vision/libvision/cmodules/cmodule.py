@@ -9,8 +9,9 @@ from os import path
 import ctypes
 
 import cv
+import numpy as np
 
-from cvtypes import IplImage, IplImage_p
+from cvtypes import IplImage, IplImage_p, OutputIplImage, OutputIplImage_p, c_char_p
 
 SOURCE_DIRECTORY = path.realpath(
     path.join(path.abspath(__file__), "../src/")
@@ -20,6 +21,17 @@ CFunction = namedtuple("CFunction",
                        ['name', 'return_type', 'argument_types']
                        )
 
+# IPL depths of the NumPy dtypes that can be passed as images
+NUMPY_DEPTHS = {
+    np.uint8: cv.IPL_DEPTH_8U,
+    np.int8: cv.IPL_DEPTH_8S,
+    np.uint16: cv.IPL_DEPTH_16U,
+    np.int16: cv.IPL_DEPTH_16S,
+    np.int32: cv.IPL_DEPTH_32S,
+    np.float32: cv.IPL_DEPTH_32F,
+    np.float64: cv.IPL_DEPTH_64F,
+}
+
 
 def iplimage_errcheck(iplimage_pointer, func, arguments):
     '''Convert an IplImage struct into an OpenCV Python object.
@@ -27,48 +39,95 @@ def iplimage_errcheck(iplimage_pointer, func, arguments):
     This function should be used only for IplImages that were created in C code
     and returned as a return value from a C function.
     '''
-    # TODO: It seems that widthStep doesn't get set correctly here.  The
-    #      structure has the correct widthStep, but I don't know how to set
-    #      widthStep on the Python IplImage type.
-
     iplimage = iplimage_pointer.contents
     converted_image = cv.CreateImageHeader((iplimage.width, iplimage.height),
                                            iplimage.depth, iplimage.nChannels)
-    cv.SetData(converted_image,
-               iplimage.imageData[:iplimage.width * iplimage.height * iplimage.nChannels])
+    # Copy the whole buffer, row padding included, so widthStep carries over
+    data = ctypes.string_at(iplimage.imageData,
+                            iplimage.widthStep * iplimage.height)
+    cv.SetData(converted_image, data, iplimage.widthStep)
     _internal_c.releaseImage(iplimage_pointer)
     return converted_image
 
 
-def to_iplimage_p(image):
-    '''Turns an OpenCV Python IplImage type into a ctypes struct.'''
-    image_data = ctypes.create_string_buffer(image.tostring())
+def image_array(image):
+    '''
+    Returns a NumPy array sharing memory with the given cv image.  NumPy
+    arrays are returned unchanged.
+    '''
+    if isinstance(image, np.ndarray):
+        return image
+    return np.asarray(image[:, :])
+
+
+def to_iplimage_p(image, output=False):
+    '''Turns an OpenCV Python IplImage type into a ctypes struct.
+
+    The struct points at the image's own pixels instead of a copy of them.
+    image may also be a NumPy array.
+
+    Arguments:
+
+        image - A cv image or a NumPy array.
+
+        output - If False, an image with padded rows is packed into a copy
+            first, since most C functions assume widthStep is the row width.
+            If True, the C function is expected to write into the image, so
+            it is never copied, and an OutputIplImage is returned.
+
+    '''
+    array = image_array(image)
+    if array.ndim not in (2, 3):
+        raise ValueError("Images must have 2 or 3 dimensions, not %d." % array.ndim)
+    channels = array.shape[2] if array.ndim == 3 else 1
+    pixel_size = array.itemsize * channels
+    packed_pixels = array.strides[1] == pixel_size and \
+        (array.ndim == 2 or array.strides[2] == array.itemsize)
+    packed_rows = array.strides[0] == array.shape[1] * pixel_size
+    if output:
+        if not packed_pixels:
+            raise ValueError("Output images must have contiguous pixels in each row.")
+    elif not (packed_pixels and packed_rows):
+        array = np.ascontiguousarray(array)
+
+    if isinstance(image, np.ndarray):
+        try:
+            depth = NUMPY_DEPTHS[array.dtype.type]
+        except KeyError:
+            raise ValueError("Unsupported image dtype %s." % array.dtype)
+    else:
+        depth = image.depth
+
+    image_data = ctypes.cast(array.ctypes.data, c_char_p)
     Four_C_Int = ctypes.c_int * 4
-    Four_C_Char = ctypes.c_char * 4
-    iplimage_struct = IplImage(
+    struct_type = OutputIplImage if output else IplImage
+    iplimage_struct = struct_type(
         nSize=ctypes.sizeof(IplImage),
         ID=0,  # Ignored by OpenCV
-        nChannels=image.nChannels,
+        nChannels=channels,
         alphaChannel=0,  # Ignored by OpenCV
-        depth=image.depth,
+        depth=depth,
         colorModel="0000",  # Ignored by OpenCV
         channelSeq="0000",  # Ignored by OpenCV
         dataOrder=0,  # Interleaved color channels
         origin=0,  # Top left
         align=4,  # Ignored by OpenCV
-        width=image.width,
-        height=image.height,
+        width=array.shape[1],
+        height=array.shape[0],
         roi=ctypes.c_void_p(),  # No ROI
         maskROI=ctypes.c_void_p(),  # Ignored by OpenCV
         imageId=ctypes.c_void_p(),  # Ignored by OpenCV
         tileInfo=ctypes.c_void_p(),  # Ignored by OpenCV
-        imageSize=image.width * image.height * image.nChannels,
+        imageSize=array.strides[0] * array.shape[0],
         imageData=image_data,
-        widthStep=image.width * image.nChannels,
+        widthStep=array.strides[0],
         BorderMode=Four_C_Int(0, 0, 0, 0),  # Ignored by OpenCV
         BorderConst=Four_C_Int(0, 0, 0, 0),  # Ignored by OpenCV
         imageDataOrigin=image_data,
     )
+    # The struct only holds a raw pointer.  Keep the pixels alive as long as
+    # the struct is.
+    iplimage_struct._array = array
     return ctypes.pointer(iplimage_struct)
 
 
@@ -161,7 +220,8 @@ class CModule(object):
 
         # If the function has no IplImage_p types, it doesn't need to be
         # wrapped.
-        if IplImage_p not in argument_types:
+        if IplImage_p not in argument_types and \
+                OutputIplImage_p not in argument_types:
             return func
 
         def func_wrapper(*args):
@@ -173,6 +233,8 @@ class CModule(object):
             for i, arg_type in enumerate(argument_types):
                 if arg_type is IplImage_p:
                     arguments.append(to_iplimage_p(args[i]))
+                elif arg_type is OutputIplImage_p:
+                    arguments.append(to_iplimage_p(args[i], output=True))
                 else:
                     arguments.append(args[i])
             return func(*tuple(arguments))
@@ -41,6 +41,18 @@ class IplImage(ctypes.Structure):
 IplImage_p = ctypes.POINTER(IplImage)
 
 
+class OutputIplImage(IplImage):
+
+    '''An IplImage that the C function writes its result into.
+
+    Arguments of this type are passed to C pointing straight at the pixels of
+    the given image, without copying them, so whatever the C function writes
+    shows up in the caller's image.  The image may have row padding, but C
+    functions taking one must honour widthStep.
+    '''
+OutputIplImage_p = ctypes.POINTER(OutputIplImage)
+
+
 class CvPoint(ctypes.Structure):
     _fields_ = [
         ("x", ctypes.c_int),
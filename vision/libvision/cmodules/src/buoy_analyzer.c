@@ -32,6 +32,7 @@ typedef struct RGBPixel_s RGBPixel;
 
 //color identification
 int* buoy_color(IplImage* src, BuoyROI** rois, int num_rois);
+void buoy_color_into(IplImage* src, BuoyROI** rois, int num_rois, int* color_sequence);
 RGBPixel* average_region(IplImage* src, BuoyROI* roi); 
 double Pixel_dist_rgb(RGBPixel* px_1, RGBPixel* px_2);
 void analyze_region(IplImage* src, BuoyROI* roi, double* distances, RGBPixel* avg_color);
@@ -137,8 +138,20 @@ void analyze_region(IplImage* src, BuoyROI* roi, double* distances, RGBPixel* av
 }
 
 /* FUNCTION: buoy_color() */
+/*                          */
+/*  returns a new array of num_rois colors, which the caller frees */
 
 int* buoy_color(IplImage* src, BuoyROI** rois, int num_rois){
+    int* color_sequence = (int*)calloc(num_rois, sizeof(int));
+    buoy_color_into(src, rois, num_rois, color_sequence);
+    return color_sequence;
+}
+
+/* FUNCTION: buoy_color_into() */
+/*                          */
+/*  writes the color of each roi into color_sequence, which holds num_rois ints */
+
+void buoy_color_into(IplImage* src, BuoyROI** rois, int num_rois, int* color_sequence){
 
     /* looping indicies */
     int color_idx, rank;
@@ -283,12 +296,9 @@ int* buoy_color(IplImage* src, BuoyROI** rois, int num_rois){
     printf ("------------------------------\n");
 #endif
 
-    /* initialize the array that will hold final color data for each buoy */
-    int* color_sequence;
-    color_sequence = (int*)calloc(num_rois, sizeof(int));
-
     /* populate color_sequence */
     for ( roi = 0; roi < num_rois; roi++){
+        color_sequence[roi] = 0;
         for (color_idx = 0; color_idx < 3; color_idx++ ){
             if ( roi == *best_roi[color_idx] ){
                 color_sequence[roi] = color_idx+1;
@@ -361,6 +371,4 @@ int* buoy_color(IplImage* src, BuoyROI** rois, int num_rois){
     for( color_idx = 0; color_idx < 3; color_idx++)
         free(best_roi[color_idx]);
     free(best_roi);
-
-    return color_sequence;
 }
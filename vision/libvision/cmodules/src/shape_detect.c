@@ -59,10 +59,11 @@ int match_O(IplImage* binary, CvPoint* points, int pixel_count, CvPoint* r_point
 
 //bin detection
 Rect** find_bins(IplImage* frame, int* bin_count);
+int find_bins_into(IplImage* frame, Rect* rects, int max_rects);
 int pair_corners(CvPoint2D32f* pt1, CvPoint2D32f* pt2, IplImage* edges, IplImage* debug);
 int mod(int x, int a);
 int test_connect(int c1, int c2, int** pairs, int* pair_counts);
-Rect* create_rect(CvPoint* ctr_pt, CvPoint* cls_pt, CvPoint* far_pt);
+void fill_rect(Rect* rect, CvPoint* ctr_pt, CvPoint* cls_pt, CvPoint* far_pt);
 
 //misc 
 int arctan(int x, int y);
@@ -78,6 +79,24 @@ void free_bins(Rect** rects, int num_rects){
 }
 
 Rect** find_bins(IplImage* frame, int* bin_count){
+    Rect found[CORNER_COUNT];
+    int i;
+
+    (*bin_count) = find_bins_into(frame, found, CORNER_COUNT);
+
+    Rect** rects = calloc(CORNER_COUNT,sizeof(Rect*));
+    for(i = 0; i < *bin_count; i++){
+        rects[i] = (Rect*)malloc(sizeof(Rect));
+        *rects[i] = found[i];
+    }
+    return rects;
+}
+
+/* FUNCTION: find_bins_into() */
+/*                            */
+/* writes up to max_rects bins into rects, and returns how many were found */
+
+int find_bins_into(IplImage* frame, Rect* rects, int max_rects){
 
     //Edge Detection
     IplImage* grayscale = cvCreateImage(cvGetSize(frame),IPL_DEPTH_8U,1);
@@ -129,8 +148,7 @@ Rect** find_bins(IplImage* frame, int* bin_count){
     int* pair_counts; //records number of pairs per corner
     //int group_count = 0; //track number of groups
 
-    //create list of rectangles
-    Rect** rects = calloc(corner_count,sizeof(Rect*));
+    //count the rectangles written to rects
     int rect_count = 0;
 
     group_sizes = (int*)calloc(corner_count,sizeof(int));
@@ -270,7 +288,8 @@ Rect** find_bins(IplImage* frame, int* bin_count){
 
                         //we are now sure that these three points are part of a rectangle
                         //record this rectangle
-                        rects[rect_count++] = create_rect(&pt[j],&pt[cls_pt],&pt[far_pt]);
+                        if(rect_count < max_rects)
+                            fill_rect(&rects[rect_count++],&pt[j],&pt[cls_pt],&pt[far_pt]);
                         group_finished = 1;
                         #ifdef VISUAL_DEBUG_BINS
                             int k;
@@ -316,12 +335,11 @@ Rect** find_bins(IplImage* frame, int* bin_count){
     #endif
    
     //return data
-    (*bin_count) = rect_count;
-    return rects;
+    return rect_count;
 }
 
-//create a new rectangle structure
-Rect* create_rect(CvPoint* ctr_pt, CvPoint* cls_pt, CvPoint* far_pt){
+//fill in a rectangle structure
+void fill_rect(Rect* rect, CvPoint* ctr_pt, CvPoint* cls_pt, CvPoint* far_pt){
     //compute center
     int32_t cnt_x = (cls_pt->x + far_pt->x )/2;
     int32_t cnt_y = (cls_pt->y + far_pt->y )/2;
@@ -338,14 +356,11 @@ Rect* create_rect(CvPoint* ctr_pt, CvPoint* cls_pt, CvPoint* far_pt){
     refy -= cnt_y;
     int32_t theta = arctan(refx,refy);
 
-    //create rectangle
-    Rect* rect = (Rect*)calloc(1,sizeof(Rect));
+    //fill rectangle
     rect->area = area;
     rect->c_x = cnt_x;
     rect->c_y = cnt_y;
     rect->theta = theta;
-
-    return rect;
 }
 
 int test_connect(int c1, int c2, int** pairs, int* pair_counts){
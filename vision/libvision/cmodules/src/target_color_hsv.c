@@ -69,8 +69,18 @@ float Pixel_dist_hsv(HSVPixel* px_1, HSVPixel* px_2);
 
 int min(int a, int b);
  
-IplImage* find_target_color_hsv(IplImage* frame, int hue, int saturation, int value, int min_blobsize, int dev_threshold, double precision_threshold){ //should find the set of colors closest to the target color
+/**
+ * \brief Like find_target_color_hsv(), but writes the result into out.
+ *
+ * out must be an 8 bit, single channel image the same size as frame.  Row
+ * padding (widthStep) of both images is honoured, so they may point straight
+ * into NumPy arrays.
+ */
+void find_target_color_hsv_into(IplImage* frame, IplImage* out, int hue, int saturation, int value, int min_blobsize, int dev_threshold, double precision_threshold){ //should find the set of colors closest to the target color
     int i,j,s;
+    int x,y;
+    uchar* row;
+    uchar* px;
     int* radii; //holds the accumulation for all possible distances from target pixel
     int blobsize = 0; //current number of pixels found in color "blob" (not necceserily a single blob)
     int rlimit=0; // stddev; //the computed maximum allowable stddev
@@ -83,12 +93,9 @@ IplImage* find_target_color_hsv(IplImage* frame, int hue, int saturation, int va
     HSVPixel tempPixel;
    
     //Initialize Images  
-    IplImage* out = cvCreateImage(cvGetSize(frame),8,1);
     IplImage* in = cvCreateImage(cvGetSize(frame),8,3);
     cvCvtColor(frame, in, CV_BGR2HSV);
 
-    uchar* ptrIn = (uchar*) in->imageData;
-    uchar* ptrOut = (uchar*) out->imageData;
    
     //Compile target color 
     HSVPixel color; 
@@ -113,19 +120,24 @@ IplImage* find_target_color_hsv(IplImage* frame, int hue, int saturation, int va
     //Fill the accumulator table / histogram
     smallestr = maxr;
     int peakr = 0;
-    for(i=in->width*in->height; i>=0;i--){  
-        tempPixel.v = ptrIn[3*i+2];
-        tempPixel.h = ptrIn[3*i+0];
-        tempPixel.s = ptrIn[3*i+1];
-        s = (int)Pixel_dist_hsv(&color, &tempPixel); 
-        radii[s]++;
-        if(radii[s] > peakr) peakr = radii[s]; 
-        if(s < smallestr) smallestr = s;
-
-        // Update the average color
-        imgAverage_h = (imgAverage_h*(i)+tempPixel.h)/(i+1);
-        imgAverage_s = (imgAverage_s*(i)+tempPixel.s)/(i+1);
-        imgAverage_v = (imgAverage_v*(i)+tempPixel.v)/(i+1); 
+    for(y=in->height-1; y>=0; y--){
+        row = (uchar*) (in->imageData + y*in->widthStep);
+        for(x=in->width-1; x>=0; x--){
+            i = y*in->width + x;
+            px = row + 3*x;
+            tempPixel.v = px[2];
+            tempPixel.h = px[0];
+            tempPixel.s = px[1];
+            s = (int)Pixel_dist_hsv(&color, &tempPixel); 
+            radii[s]++;
+            if(radii[s] > peakr) peakr = radii[s]; 
+            if(s < smallestr) smallestr = s;
+
+            // Update the average color
+            imgAverage_h = (imgAverage_h*(i)+tempPixel.h)/(i+1);
+            imgAverage_s = (imgAverage_s*(i)+tempPixel.s)/(i+1);
+            imgAverage_v = (imgAverage_v*(i)+tempPixel.v)/(i+1); 
+        }
     }
 
     #ifdef VISUAL_DEBUG
@@ -177,17 +189,22 @@ IplImage* find_target_color_hsv(IplImage* frame, int hue, int saturation, int va
         cvShowImage("Rgram", rgram);
     #endif
 
-    for(i=in->width*in->height-1;i>=0;i--){ //Update the Output Image
-        tempPixel.v = ptrIn[3*i+2];
-        tempPixel.h = ptrIn[3*i+0];
-        tempPixel.s = ptrIn[3*i+1];
-        if((int)Pixel_dist_hsv(&color,&tempPixel) < rlimit){
-            // This pixel is "close" to the target color, mark it white
-            ptrOut[i] = 0xff;
-        } else {
-            // This pixel is not "close" to the target color: mark it black
-            ptrOut[i] = 0x00;
-        } 
+    for(y=in->height-1; y>=0; y--){ //Update the Output Image
+        row = (uchar*) (in->imageData + y*in->widthStep);
+        uchar* ptrOut = (uchar*) (out->imageData + y*out->widthStep);
+        for(x=in->width-1; x>=0; x--){
+            px = row + 3*x;
+            tempPixel.v = px[2];
+            tempPixel.h = px[0];
+            tempPixel.s = px[1];
+            if((int)Pixel_dist_hsv(&color,&tempPixel) < rlimit){
+                // This pixel is "close" to the target color, mark it white
+                ptrOut[x] = 0xff;
+            } else {
+                // This pixel is not "close" to the target color: mark it black
+                ptrOut[x] = 0x00;
+            } 
+        }
     }
 
     free(radii);
@@ -195,7 +212,11 @@ IplImage* find_target_color_hsv(IplImage* frame, int hue, int saturation, int va
     #ifdef VISUAL_DEBUG
         cvReleaseImage(&rgram);
     #endif
+}
 
+IplImage* find_target_color_hsv(IplImage* frame, int hue, int saturation, int value, int min_blobsize, int dev_threshold, double precision_threshold){
+    IplImage* out = cvCreateImage(cvGetSize(frame),8,1);
+    find_target_color_hsv_into(frame, out, hue, saturation, value, min_blobsize, dev_threshold, precision_threshold);
     return out;
 }
 
@@ -72,8 +72,18 @@ float Pixel_dist_rgb(RGBPixel* px_1, RGBPixel* px_2);
 
 int min(int a, int b);
  
-IplImage* find_target_color_rgb(IplImage* frame, int red, int green, int blue, int min_blobsize, int dev_threshold, double precision_threshold){ //should find the set of colors closest to the target color
+/**
+ * \brief Like find_target_color_rgb(), but writes the result into out.
+ *
+ * out must be an 8 bit, single channel image the same size as frame.  Row
+ * padding (widthStep) of both images is honoured, so they may point straight
+ * into NumPy arrays.
+ */
+void find_target_color_rgb_into(IplImage* frame, IplImage* out, int red, int green, int blue, int min_blobsize, int dev_threshold, double precision_threshold){ //should find the set of colors closest to the target color
     int i,j,s;
+    int x,y;
+    uchar* row;
+    uchar* px;
     int* radii; //holds the accumulation for all possible distances from target pixel
     int blobsize = 0; //current number of pixels found in color "blob" (not necceserily a single blob)
     int rlimit=0; // stddev; //the computed maximum allowable stddev
@@ -88,11 +98,8 @@ IplImage* find_target_color_rgb(IplImage* frame, int red, int green, int blue, i
     RGBPixel tempPixel;
    
     //Initialize Images
-    IplImage* out = cvCreateImage(cvGetSize(frame),8,1);
-    IplImage* in = cvCloneImage(frame);
+    IplImage* in = frame;
 
-    uchar* ptrIn = (uchar*) in->imageData;
-    uchar* ptrOut = (uchar*) out->imageData;
    
     //Compile target color
     RGBPixel color;
@@ -116,19 +123,24 @@ IplImage* find_target_color_rgb(IplImage* frame, int red, int green, int blue, i
     //Fill the accumulator table / histogram
     smallestr = maxr;
     int peakr = 0;
-    for(i=in->width*in->height; i>=0;i--){  
-        tempPixel.r = ptrIn[3*i+2];
-        tempPixel.g = ptrIn[3*i+1];
-        tempPixel.b = ptrIn[3*i+0];
-        s = (int)Pixel_dist_rgb(&color, &tempPixel); 
-        radii[s]++;
-        if(radii[s] > peakr) peakr = radii[s]; 
-        if(s < smallestr) smallestr = s;
-
-        // Update the average color
-        imgAverage_r = (imgAverage_r*(i)+tempPixel.r)/(i+1);
-        imgAverage_g = (imgAverage_g*(i)+tempPixel.g)/(i+1);
-        imgAverage_b = (imgAverage_b*(i)+tempPixel.b)/(i+1); 
+    for(y=in->height-1; y>=0; y--){
+        row = (uchar*) (in->imageData + y*in->widthStep);
+        for(x=in->width-1; x>=0; x--){
+            i = y*in->width + x;
+            px = row + 3*x;
+            tempPixel.r = px[2];
+            tempPixel.g = px[1];
+            tempPixel.b = px[0];
+            s = (int)Pixel_dist_rgb(&color, &tempPixel); 
+            radii[s]++;
+            if(radii[s] > peakr) peakr = radii[s]; 
+            if(s < smallestr) smallestr = s;
+
+            // Update the average color
+            imgAverage_r = (imgAverage_r*(i)+tempPixel.r)/(i+1);
+            imgAverage_g = (imgAverage_g*(i)+tempPixel.g)/(i+1);
+            imgAverage_b = (imgAverage_b*(i)+tempPixel.b)/(i+1); 
+        }
     }
 
     #ifdef VISUAL_DEBUG
@@ -246,25 +258,33 @@ IplImage* find_target_color_rgb(IplImage* frame, int red, int green, int blue, i
         cvShowImage("Rgram", rgram);
     #endif
 
-    for(i=in->width*in->height-1;i>=0;i--){ //Update the Output Image
-        tempPixel.r = ptrIn[3*i+2];
-        tempPixel.g = ptrIn[3*i+1];
-        tempPixel.b = ptrIn[3*i+0];
-        if((int)Pixel_dist_rgb(&color,&tempPixel) < rlimit){
-            // This pixel is "close" to the target color, mark it white
-            ptrOut[i] = 0xff;
-        } else {
-            // This pixel is not "close" to the target color: mark it black
-            ptrOut[i] = 0x00;
-        } 
+    for(y=in->height-1; y>=0; y--){ //Update the Output Image
+        row = (uchar*) (in->imageData + y*in->widthStep);
+        uchar* ptrOut = (uchar*) (out->imageData + y*out->widthStep);
+        for(x=in->width-1; x>=0; x--){
+            px = row + 3*x;
+            tempPixel.r = px[2];
+            tempPixel.g = px[1];
+            tempPixel.b = px[0];
+            if((int)Pixel_dist_rgb(&color,&tempPixel) < rlimit){
+                // This pixel is "close" to the target color, mark it white
+                ptrOut[x] = 0xff;
+            } else {
+                // This pixel is not "close" to the target color: mark it black
+                ptrOut[x] = 0x00;
+            } 
+        }
     }
 
     free(radii);
-    cvReleaseImage(&in);
     #ifdef VISUAL_DEBUG
         cvReleaseImage(&rgram);
     #endif
+}
 
+IplImage* find_target_color_rgb(IplImage* frame, int red, int green, int blue, int min_blobsize, int dev_threshold, double precision_threshold){
+    IplImage* out = cvCreateImage(cvGetSize(frame),8,1);
+    find_target_color_rgb_into(frame, out, red, green, blue, min_blobsize, dev_threshold, precision_threshold);
     return out;
 }
 
@@ -1,4 +1,11 @@
+import math
+
 import cv
+import cv2
+import numpy as np
+
+from convert import cv_to_cv2, cv2_to_cv
+import hist
 
 
 def hsv_filter(src, low_h, high_h, min_s, max_s, min_v, max_v,
@@ -21,39 +28,77 @@ def hsv_filter(src, low_h, high_h, min_s, max_s, min_v, max_v,
     high_h /= 2
     low_h /= 2
 
-    hsv = cv.CreateImage(cv.GetSize(src), 8, 3)
-    binary = cv.CreateImage(cv.GetSize(src), 8, 1)
-    cv.SetZero(binary)
-    cv.CvtColor(src, hsv, cv.CV_BGR2HSV)
+    hsv = cv2.cvtColor(cv_to_cv2(src), cv2.COLOR_BGR2HSV)
+    binary = _hsv_mask(hsv, low_h, high_h, min_s, max_s, min_v, max_v,
+                       hue_bandstop)
+
+    return cv2_to_cv(binary)
+
 
-    data = hsv.tostring()
-    for y in xrange(0, hsv.height):
-        for x in xrange(0, hsv.width):
-            index = y * hsv.width * 3 + x * 3
-            h = ord(data[0 + index])
-            s = ord(data[1 + index])
-            v = ord(data[2 + index])
+def hsv_filter_batch(frames, ranges):
+    '''Thresholds a stack of 8-bit bgr frames against several hsv ranges.
 
-            if hue_bandstop:
-                if (h <= low_h or h >= high_h) and \
-                   s >= min_s and \
-                   s <= max_s and \
-                   v >= min_v and \
-                   v <= max_v:
+    frames is a sequence of equally sized cv2 (numpy) bgr frames, or an array
+    of shape (frames, height, width, 3).  ranges is a list of tuples
+    (low_h, high_h, min_s, max_s, min_v, max_v) or
+    (low_h, high_h, min_s, max_s, min_v, max_v, hue_bandstop), with the same
+    meaning and ranges as the arguments of hsv_filter().
+
+    All frames are converted to HSV once.  Returns a uint8 array of shape
+    (len(ranges), frames, height, width) holding one binary mask per range
+    and frame.
+
+    '''
+    frames = np.ascontiguousarray(frames, dtype=np.uint8)
+    num_frames, height, width = frames.shape[:3]
 
-                    cv.Set2D(binary, y, x, (255,))
+    # Stacking the frames vertically lets cvtColor convert them in one call
+    hsv = cv2.cvtColor(frames.reshape(num_frames * height, width, 3),
+                       cv2.COLOR_BGR2HSV)
 
-            else:
-                if h >= low_h and \
-                   h <= high_h and \
-                   s >= min_s and \
-                   s <= max_s and \
-                   v >= min_v and \
-                   v <= max_v:
+    masks = np.empty((len(ranges), num_frames, height, width), np.uint8)
+    for i, hsv_range in enumerate(ranges):
+        low_h, high_h, min_s, max_s, min_v, max_v = hsv_range[:6]
+        hue_bandstop = hsv_range[6] if len(hsv_range) > 6 else False
+        _hsv_mask(hsv, low_h / 2, high_h / 2, min_s, max_s, min_v, max_v,
+                  hue_bandstop,
+                  dst=masks[i].reshape(num_frames * height, width))
 
-                    cv.Set2D(binary, y, x, (255,))
+    return masks
 
-    return binary
+
+def _hsv_mask(hsv, low_h, high_h, min_s, max_s, min_v, max_v, hue_bandstop,
+              dst=None):
+    '''
+    Returns a binary mask of the pixels of a cv2 hsv image within the given
+    ranges.  Hue is given in OpenCV's 0-180 range.
+
+    The bounds may be floats.  Since the image is 8-bit, they are rounded
+    inwards to the integers that give the same comparisons.
+
+    '''
+    lower = (0, _ceil_bound(min_s), _ceil_bound(min_v))
+    upper = (255, _floor_bound(max_s), _floor_bound(max_v))
+    if not hue_bandstop:
+        lower = (_ceil_bound(low_h),) + lower[1:]
+        upper = (_floor_bound(high_h),) + upper[1:]
+    dst = cv2.inRange(hsv, lower, upper, dst)
+
+    if hue_bandstop:
+        # Remove hues strictly between low_h and high_h
+        inner = cv2.inRange(hsv[:, :, 0], _floor_bound(low_h) + 1,
+                            _ceil_bound(high_h) - 1)
+        cv2.bitwise_and(dst, cv2.bitwise_not(inner), dst)
+
+    return dst
+
+
+def _ceil_bound(value):
+    return int(min(max(math.ceil(value), -1), 256))
+
+
+def _floor_bound(value):
+    return int(min(max(math.floor(value), -1), 256))
 
 
 def otsu_get_threshold(src):
@@ -69,49 +114,53 @@ def otsu_get_threshold(src):
     if src.nChannels != 1:
         raise ValueError("Image must have one channel.")
 
-    # Compute Histogram
-    hist = cv.CreateHist([256], cv.CV_HIST_ARRAY, [[0, 255]], 1)
-    cv.CalcHist([src], hist)
-
-    # Convert to Probability Histogram
-    cv.NormalizeHist(hist, 1)
+    return int(otsu_thresholds(hist.calc_histogram(src))[0])
 
-    overall_moment = 0
-    for t in xrange(256):
-        overall_moment += t * cv.QueryHistValue_1D(hist, t)
 
-    # Find the threshold t that gives the highest variance
-    # Suffixes _b and _f mean background and foreground
-    num_pixels = src.width * src.height
-    weight_b = 0
-    moment_b = 0
-    highest_variance = 0
-    best_threshold = 0
-    for t in xrange(256):
-
-        hist_value = cv.QueryHistValue_1D(hist, t)
+def otsu_get_thresholds(src, rects):
+    '''
+    Finds the Otsu threshold of each (x, y, width, height) rectangle in a grey
+    level image.  Returns an array of thresholds, one per rectangle.
+    '''
+    return otsu_thresholds(hist.calc_histograms(src, rects))
 
-        weight_b += hist_value
-        weight_f = 1 - weight_b
-        if weight_b == 0:
-            continue
-        if weight_f == 0:
-            break
 
-        moment_b += t * hist_value
-        moment_f = overall_moment - moment_b
+def otsu_thresholds(hists):
+    '''Finds the Otsu threshold of each row of a 2D array of histograms.
 
+    Returns an integer array with one threshold per histogram.  Histograms
+    with no pixels get a threshold of 0.
+    '''
+    hists = np.atleast_2d(np.asarray(hists, dtype=np.float64))
+    num_bins = hists.shape[1]
+    bins = np.arange(num_bins)
+
+    # Convert to Probability Histograms
+    totals = hists.sum(axis=1)[:, np.newaxis]
+    probabilities = hists / np.where(totals > 0, totals, 1)
+
+    # Suffixes _b and _f mean background and foreground, for a threshold at
+    # each bin
+    weight_b = np.cumsum(probabilities, axis=1)
+    weight_f = 1 - weight_b
+    moment_b = np.cumsum(probabilities * bins, axis=1)
+    moment_f = moment_b[:, -1:] - moment_b
+
+    # A threshold splits the pixels only if it has pixels at or below it and
+    # pixels above it
+    last_nonzero = num_bins - 1 - np.argmax(hists[:, ::-1] > 0, axis=1)
+    valid = (weight_b > 0) & (bins[np.newaxis, :] < last_nonzero[:, np.newaxis])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
         mean_b = moment_b / weight_b
         mean_f = moment_f / weight_f
+        variance_between = weight_b * weight_f * (mean_b - mean_f) ** 2
+    variance_between[~valid] = -1
 
-        variance_between = weight_b * weight_f * \
-            (mean_b - mean_f) ** 2
-
-        if variance_between >= highest_variance:
-            highest_variance = variance_between
-            best_threshold = t
-
-    return best_threshold
+    # Ties go to the highest threshold
+    thresholds = num_bins - 1 - np.argmax(variance_between[:, ::-1], axis=1)
+    thresholds[~valid.any(axis=1)] = 0
+    return thresholds
 
 
 def otsu_threshold(src, max_value=255, threshold_type=cv.CV_THRESH_BINARY):
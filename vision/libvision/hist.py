@@ -1,58 +1,123 @@
 # pylint: disable=E1101
+'''
+Histogram statistics.
+
+Histograms may be given either as cv histograms (from cv.CreateHist) or as
+NumPy arrays of bin values.  The batch functions take a 2D array with one
+histogram per row and compute the statistic of every row at once:
+
+    hists = calc_histograms(image, rects)
+    z_scores = num_stddevs_from_mean(hists, 255)
+
+'''
 from __future__ import division
 from math import sqrt
 
 import cv
+import cv2
+import numpy as np
+
+from convert import cv_to_cv2
+
+
+def as_array(hist, num_bins=256):
+    '''Returns the bins of a cv histogram as a float NumPy array.
+
+    NumPy arrays are returned as float arrays, without copying them if they
+    already are.
+    '''
+    if isinstance(hist, np.ndarray):
+        return np.asarray(hist, dtype=np.float64)
+    return np.asarray(hist.bins, dtype=np.float64).reshape(-1)[:num_bins]
+
+
+def calc_histogram(image, num_bins=256, value_range=(0, 255)):
+    '''
+    Returns the histogram of a single channel image as a float NumPy array.
+    Bins are the same as those of a cv.CV_HIST_ARRAY histogram of the same
+    range.
+    '''
+    if not isinstance(image, np.ndarray):
+        image = cv_to_cv2(image)
+    hist = cv2.calcHist([image], [0], None, [num_bins], list(value_range))
+    return hist.reshape(-1).astype(np.float64)
+
+
+def calc_histograms(image, rects, num_bins=256, value_range=(0, 255)):
+    '''Returns the histograms of several regions of a single channel image.
+
+    rects is a list of (x, y, width, height) rectangles.  The result is an
+    array of shape (len(rects), num_bins).
+    '''
+    if not isinstance(image, np.ndarray):
+        image = cv_to_cv2(image)
+    hists = np.empty((len(rects), num_bins), np.float64)
+    for i, (x, y, width, height) in enumerate(rects):
+        roi = image[y:y + height, x:x + width]
+        hists[i] = calc_histogram(roi, num_bins, value_range)
+    return hists
 
 
 def histogram_image(hist, color=(255, 255, 255), background_color=(0, 0, 0), num_bins=256):
     '''Returns an image displaying the the given histogram.'''
 
-    max_value = int(cv.GetMinMaxHistValue(hist)[1])
+    values = as_array(hist, num_bins)
+    max_value = values.max()
 
     img = cv.CreateImage((num_bins, num_bins), 8, 3)
     cv.Set(img, background_color)
 
     for i in xrange(num_bins):
-        height = int(cv.QueryHistValue_1D(hist, i) / max_value * num_bins)
+        height = int(values[i] / max_value * num_bins)
         cv.Line(img, (i, num_bins), (i, num_bins - height), color)
 
     return img
 
 
-def calc_expected_value(hist, num_bins=256):
-    sum = 0
-    num_datapoints = 0
-    for i in xrange(num_bins):
-        value = cv.QueryHistValue_1D(hist, i)
-        num_datapoints += value
-        sum += value * i
-    return sum / num_datapoints
+def expected_values(hists):
+    '''Returns the expected bin of each row of hists.'''
+    hists = np.atleast_2d(as_array(hists))
+    bins = np.arange(hists.shape[1])
+    return hists.dot(bins) / hists.sum(axis=1)
 
 
-def calc_variance(hist, expected_value=None, num_bins=256):
+def variances(hists, expected=None):
+    '''Returns the variance of each row of hists.'''
+    hists = np.atleast_2d(as_array(hists))
+    if expected is None:
+        expected = expected_values(hists)
+    bins = np.arange(hists.shape[1])
+    deviations = (bins[np.newaxis, :] - np.asarray(expected)[:, np.newaxis]) ** 2
+    return (hists * deviations).sum(axis=1) / hists.sum(axis=1)
 
-    if expected_value is None:
-        expected_value = calc_expected_value(hist, num_bins)
 
-    variance = 0
-    sum = 0
-    for i in xrange(num_bins):
-        value = cv.QueryHistValue_1D(hist, i)
-        variance += value * (i - expected_value) ** 2
-        sum += value
-    return variance / sum
+def num_stddevs_from_mean(hists, x):
+    '''
+    Returns how many standard deviations x is away from the mean of each row
+    of hists.  x is either a single value or one value per row.
+    '''
+    hists = np.atleast_2d(as_array(hists))
+    expected = expected_values(hists)
+    return (np.asarray(x) - expected) / np.sqrt(variances(hists, expected))
+
+
+def calc_expected_value(hist, num_bins=256):
+    return float(expected_values(as_array(hist, num_bins)[:num_bins])[0])
+
+
+def calc_variance(hist, expected_value=None, num_bins=256):
+    hist = as_array(hist, num_bins)[:num_bins]
+    if expected_value is not None:
+        expected_value = [expected_value]
+    return float(variances(hist, expected_value)[0])
 
 
 def calc_stddev(hist, expected_value=None, num_bins=256):
     return sqrt(
-        calc_variance(hist, expected_value, num_bins=256)
+        calc_variance(hist, expected_value, num_bins)
     )
 
 
 def num_stddev_from_mean(hist, x, num_bins=256):
     '''Calculates how many standard deviations x is away from the mean.'''
-
-    expected_value = calc_expected_value(hist, num_bins)
-    stddev = calc_stddev(hist, expected_value, num_bins)
-    return (x - expected_value) / stddev
+    return float(num_stddevs_from_mean(as_array(hist, num_bins)[:num_bins], x)[0])
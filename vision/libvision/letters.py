@@ -18,10 +18,7 @@ class Rect(object):
 
 def find_bins(img_in):
     """"find 2x1 size rectangles in image"""
-    num_rects = ctypes.c_int()
-    crects = cmodules.shape_detect.find_bins(img_in, ctypes.pointer(num_rects))
+    crects = (cmodules.cRect * cmodules.MAX_BINS)()
+    num_rects = cmodules.shape_detect.find_bins_into(img_in, crects, len(crects))
 
-    rects = [Rect(crects[i]) for i in range(0, num_rects.value)]
-    cmodules.shape_detect.free_bins(crects, num_rects)
-
-    return rects
+    return [Rect(ctypes.pointer(crects[i])) for i in range(0, num_rects)]
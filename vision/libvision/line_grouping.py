@@ -0,0 +1,202 @@
+'''
+Grouping of Hough lines.
+
+Entities that look for poles and edges get many (rho, theta) lines from
+cv.HoughLines2 for every real edge.  A LineGrouper clusters lines whose rho
+(and optionally theta) values are close and averages each cluster into a
+single line:
+
+    grouper = LineGrouper(max_rho_range=10)
+    lines = grouper.group(raw_lines)
+
+Angles are compared and averaged in a circular fashion, so lines on both
+sides of the wraparound point (theta near 0 and near pi) end up in the same
+group.
+
+A group only needs a handful of running totals, which are kept in
+preallocated NumPy arrays, and there are at most max_groups groups.  So no
+matter how many lines a low Hough threshold lets through, each line costs
+the same small, fixed amount of work and memory.
+'''
+
+from __future__ import division
+import math
+
+import numpy as np
+
+DEFAULT_MAX_GROUPS = 64
+
+
+class LineGrouper(object):
+
+    '''Clusters (rho, theta) lines in rho/theta space.
+
+    Lines are considered in order.  A line is added to a group if, with the
+    line added, the range of the group's rho values would be less than
+    max_rho_range and, if max_theta_range is given, the circular range of its
+    theta values would be less than max_theta_range.  A line that fits no
+    group starts a new one.
+
+    Arguments:
+
+        max_rho_range - Maximum range of rho within a group.
+
+        max_theta_range - Maximum range of theta within a group, or None to
+            group on rho alone.
+
+        period - Where theta wraps around.  pi for lines from
+            cv.HoughLines2, 2*pi for lines from unwrap_lines().
+
+        first_match - If True, a line is added only to the first group it
+            fits.  Otherwise it is added to every group it fits.
+
+        max_groups - Lines that fit no group once there are this many groups
+            are counted in self.dropped and otherwise ignored.
+
+    '''
+
+    def __init__(self, max_rho_range, max_theta_range=None, period=math.pi,
+                 first_match=False, max_groups=DEFAULT_MAX_GROUPS):
+        self.max_rho_range = max_rho_range
+        self.max_theta_range = max_theta_range
+        self.period = period
+        self.first_match = first_match
+        self.max_groups = max_groups
+
+        self._min_rho = np.empty(max_groups)
+        self._max_rho = np.empty(max_groups)
+        # Theta is tracked as an offset from the first theta of the group,
+        # within half a period either way
+        self._reference_theta = np.empty(max_groups)
+        self._min_offset = np.empty(max_groups)
+        self._max_offset = np.empty(max_groups)
+        self._count = np.empty(max_groups, np.int64)
+        self._rho_sum = np.empty(max_groups)
+        self._sin_sum = np.empty(max_groups)
+        self._cos_sum = np.empty(max_groups)
+        self.reset()
+
+    def reset(self):
+        '''Forgets every group.'''
+        self.num_groups = 0
+        self.dropped = 0
+
+    def add(self, rho, theta):
+        '''Adds one line.  Returns the indexes of the groups it was added to.'''
+        n = self.num_groups
+        offset = (theta - self._reference_theta[:n] + self.period / 2) % self.period \
+            - self.period / 2
+
+        min_rho = np.minimum(self._min_rho[:n], rho)
+        max_rho = np.maximum(self._max_rho[:n], rho)
+        accept = max_rho - min_rho < self.max_rho_range
+        if self.max_theta_range is not None:
+            min_offset = np.minimum(self._min_offset[:n], offset)
+            max_offset = np.maximum(self._max_offset[:n], offset)
+            accept &= max_offset - min_offset < self.max_theta_range
+
+        groups = np.flatnonzero(accept)
+        if self.first_match:
+            groups = groups[:1]
+
+        if not len(groups):
+            if n >= self.max_groups:
+                self.dropped += 1
+                return groups
+            self._reference_theta[n] = theta
+            self._min_rho[n] = self._max_rho[n] = rho
+            self._min_offset[n] = self._max_offset[n] = 0
+            self._count[n] = self._rho_sum[n] = self._sin_sum[n] = self._cos_sum[n] = 0
+            self.num_groups += 1
+            groups = np.array([n])
+        else:
+            self._min_rho[groups] = min_rho[groups]
+            self._max_rho[groups] = max_rho[groups]
+            if self.max_theta_range is not None:
+                self._min_offset[groups] = min_offset[groups]
+                self._max_offset[groups] = max_offset[groups]
+
+        angle = theta * 2 * math.pi / self.period
+        self._count[groups] += 1
+        self._rho_sum[groups] += rho
+        self._sin_sum[groups] += math.sin(angle)
+        self._cos_sum[groups] += math.cos(angle)
+        return groups
+
+    def add_lines(self, lines):
+        '''Adds each (rho, theta) line of lines, in order.'''
+        for rho, theta in lines:
+            self.add(rho, theta)
+
+    def counts(self):
+        '''Returns the number of lines in each group.'''
+        return self._count[:self.num_groups].copy()
+
+    def lines(self):
+        '''Returns each group averaged into a (rho, theta) line.
+
+        rho is the mean rho of the group and theta the circular mean theta,
+        in the range [0, period).
+        '''
+        n = self.num_groups
+        rhos = self._rho_sum[:n] / self._count[:n]
+        thetas = circular_mean_from_sums(self._sin_sum[:n], self._cos_sum[:n],
+                                         self.period)
+        return [(float(rho), float(theta)) for rho, theta in zip(rhos, thetas)]
+
+    def group(self, lines):
+        '''Forgets old groups, groups lines and returns the averaged lines.'''
+        self.reset()
+        self.add_lines(lines)
+        return self.lines()
+
+
+def group_lines(lines, max_rho_range, max_theta_range=None, period=math.pi,
+                first_match=False, max_groups=DEFAULT_MAX_GROUPS):
+    '''Groups lines with a new LineGrouper and returns the averaged lines.'''
+    grouper = LineGrouper(max_rho_range, max_theta_range, period, first_match,
+                          max_groups)
+    return grouper.group(lines)
+
+
+def circular_mean_from_sums(sin_sum, cos_sum, period=2 * math.pi):
+    '''
+    Returns circular means, in the range [0, period), given the sums of the
+    sines and cosines of the values scaled to 2*pi.
+    '''
+    angle = np.arctan2(sin_sum, cos_sum)
+    angle = np.where(angle < 0, angle + 2 * math.pi, angle)
+    return angle * period / (2 * math.pi)
+
+
+def circular_mean(values, period=2 * math.pi):
+    '''Returns the circular mean of values, in the range [0, period).'''
+    angles = np.asarray(values, dtype=np.float64) * 2 * math.pi / period
+    return float(circular_mean_from_sums(np.sin(angles).sum(),
+                                         np.cos(angles).sum(), period))
+
+
+def unwrap_lines(lines):
+    '''
+    Returns lines with negative rho flipped around: (-rho, theta - pi).
+    Every line then has a positive rho and theta in [-pi, pi), so the lines
+    should be grouped with a period of 2*pi.
+    '''
+    lines = np.array(lines, dtype=np.float64).reshape(-1, 2)
+    flipped = lines[:, 0] < 0
+    lines[flipped, 0] *= -1
+    lines[flipped, 1] -= math.pi
+    return lines
+
+
+def wrap_lines(lines):
+    '''
+    The opposite of unwrap_lines().  Returns lines with theta in [0, pi),
+    flipping rho where needed.
+    '''
+    lines = np.array(lines, dtype=np.float64).reshape(-1, 2)
+    lines[:, 1] %= 2 * math.pi
+    flipped = lines[:, 1] >= math.pi
+    lines[flipped, 0] *= -1
+    lines[flipped, 1] -= math.pi
+    return lines
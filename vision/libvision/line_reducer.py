@@ -52,40 +52,32 @@ class LineReducer(object):
         self._groups = []
         self._final_lines = []
 
-    def _line_length(self, line):
-        '''Find the length of a line only given the tuple representing the
-        endpoints of the line.
-
-        Keyword Arguments:
-        line -- tuple representing a line.
+    def _measure_lines(self):
+        '''Sorts the lines from longest to shortest and computes, for every
+        pair of lines, whether the second is close enough to the first to be
+        tested as part of the same line.
         '''
-        square = (line[2] - line[0]) ** 2 + (line[3] - line[1]) ** 2
-        return square ** (1 / 2)
-
-    def _sort_list_lines(self, line_list):
-        '''Sort all of the lines in line_list in order of longest to shortest.'''
-        local_list = []
-        for l in line_list:
-            local_list.append([l, self._line_length(l)])
+        lines = np.asarray(self._list_lines, dtype=np.float64).reshape(-1, 4)
+        lengths = _lengths(lines)
 
-        sorted_list = sorted(local_list, key=lambda p: p[1], reverse=True)
+        # A stable sort keeps lines of equal length in their original order
+        order = np.argsort(-lengths, kind="mergesort")
+        self._list_lines = [self._list_lines[i] for i in order]
+        lines = lines[order]
+        lengths = lengths[order]
+        self._points = lines.astype(np.int32)
 
-        final_list = []
-        for l in sorted_list:
-            final_list.append(l[0])
-
-        return final_list
+        self._close = self._min_dist_rejection(lines, lengths) & \
+            self._min_dist_concentric(lines, lengths)
 
     def _index_longest_available(self):
         '''Determine the index of the longest line segment that is not grouped.
         Returns -1 if no candidates are found.
         '''
-        if self._list_lines_count == 0:
+        available = np.flatnonzero(~self._list_grouped)
+        if not len(available):
             return -1
-        for x in xrange(self._list_lines_count):
-            if not self._list_grouped[x]:
-                return x
-        return -1
+        return available[0]
 
     def _fit_rectangle(self, lines):
         '''Take a list of lines and find a rectangle that best matches them,
@@ -100,22 +92,18 @@ class LineReducer(object):
         e -- angle in degrees, zero when width is completely horizontal.
 
         Keyword Arguments:
-        lines -- list of tuples representing lines.
+        lines -- list of line indexes.
         '''
-        cloud = []
-        #print (lines[0])
-        for line in lines:
-            cloud.append((line[0], line[1]))  # TODO MIGHT need Y before X, rather than X before Y
-            cloud.append((line[2], line[3]))
-        array = np.array([cloud], dtype=np.int32)
-        return cv2.minAreaRect(array)
+        # TODO MIGHT need Y before X, rather than X before Y
+        cloud = self._points[lines].reshape(1, -1, 2)
+        return cv2.minAreaRect(cloud)
 
     def _test_fit(self, lines):
         '''Take a group of line segments and determine if they violate the
         error ratio.
 
         Keyword Arguments;
-        lines -- list of tuples representing line segments.
+        lines -- list of line indexes.
         Returns True if the segments are acceptable.
         '''
         rectangle = self._fit_rectangle(lines)
@@ -131,95 +119,51 @@ class LineReducer(object):
             return False
         return True
 
-    def _dist_points(self, point_a, point_b):
-        '''Determine the distance between two points that are represented as
-        tuples.
-        '''
-        square = (point_b[0] - point_a[0]) ** 2 + (point_b[1] - point_a[1]) ** 2
-        return square ** (1 / 2)
-
-    def _dot_prod(self, line_a, line_b):
-        '''Find the dot product of two lines.
-
-        Keyword Arguments:
-        line_a -- numpy line segment representing a vector.
-        line_b -- numpy line segment representing a vector.
-        Returns number representing the dot product of the two vectors.
-        '''
-
-        a_delta_x = line_a[2] - line_a[0]
-        b_delta_x = line_b[2] - line_b[0]
-        a_delta_y = line_a[3] - line_a[1]
-        b_delta_y = line_b[3] - line_b[1]
-        return (a_delta_x * b_delta_x) + (a_delta_y * b_delta_y)
-
-    def _rejection_line(self, point, line):
-        '''Find the rejection vector of two lines and return the resulting line.
-        The math used here is well explained at:
+    def _min_dist_rejection(self, lines, lengths):
+        '''Determine, for every pair of lines a and b, if the minimum distance
+        between the lines is less than or equal to a specified ratio of the
+        length of line a, measured using rejection lines.  The math used here
+        is well explained at:
         http://en.wikipedia.org/wiki/Vector_projection#Vector_rejection
 
         Keyword Arguments:
-        point -- tuple representing point
-        line -- numpy array representing line
+        lines -- array of lines, one per row.
+        lengths -- array of line lengths.
+        Returns a boolean matrix, True where b is close enough to a.
         '''
-        a = [line[0], line[1], point[0], point[1]]
-        scalar = self._dot_prod(a, line) / (self._line_length(line) ** 2)
-        delta_x = line[2] - line[0]
-        delta_y = line[3] - line[1]
-
-        line_endpoint = np.array([line[0] + scalar * delta_x,
-                                  line[1] + scalar * delta_y, point[0], point[1]])
-        return line_endpoint
-
-    def _min_dist_rejection(self, line_a, line_b):
-        '''Determine if the minimum distance between two lines is less than or
-        equal to a specified ratio, measured using a rejection line.
+        start = lines[:, np.newaxis, 0:2]  # Start point of line a
+        delta = (lines[:, 2:4] - lines[:, 0:2])[:, np.newaxis, :]
+        squared_length = (lengths ** 2)[:, np.newaxis]
+
+        close = np.zeros((len(lines), len(lines)), bool)
+        for point in (lines[np.newaxis, :, 0:2], lines[np.newaxis, :, 2:4]):
+            to_point = point - start
+            scalar = (to_point[:, :, 0] * delta[:, :, 0] +
+                      to_point[:, :, 1] * delta[:, :, 1]) / squared_length
+            rejection_x = point[:, :, 0] - (start[:, :, 0] + scalar * delta[:, :, 0])
+            rejection_y = point[:, :, 1] - (start[:, :, 1] + scalar * delta[:, :, 1])
+            rejection_length = (rejection_x ** 2 + rejection_y ** 2) ** (1 / 2)
+            close |= rejection_length <= (lengths * self._reject_ratio)[:, np.newaxis]
+        return close
+
+    def _min_dist_concentric(self, lines, lengths):
+        '''Determine, for every pair of lines a and b, if at least one point on
+        line b is within 100(1 + tolerance)% of the length of a away from both
+        endpoints of line a.
 
         Keyword Arguments:
-        line_a -- index of first line, line that determines min acceptable dist.
-        line_b -- index of second line
-        Returns True if they are close enough
+        lines -- array of lines, one per row.
+        lengths -- array of line lengths.
+        Returns a boolean matrix, True where b is close enough to a.
         '''
-        l1 = self._list_lines[line_a]
-        l2 = self._list_lines[line_b]
-
-        rejection1 = self._rejection_line((l2[0], l2[1]), l1)
-        rejection2 = self._rejection_line((l2[2], l2[3]), l1)
-
-        length1 = self._line_length(rejection1)
-        length2 = self._line_length(rejection2)
+        allowable_dist = (lengths * (1 + self._tolerance))[:, np.newaxis]
 
-        comparison_length = self._line_length(self._list_lines[line_a])
-
-        if length1 <= (comparison_length * self._reject_ratio)\
-                or length2 <= (comparison_length * self._reject_ratio):
-            return True
-        return False
-
-    def _min_dist_concentric(self, line_a, line_b):
-        '''Determine if the minimum distance between two lines is less than or
-        equal to a specified ratio, measured by making sure at least one point
-        on the line is within 100(1 + tolerance)% away from both endpoints of
-        the main line.
-
-        Keyword Arguments:
-        line_a -- index of first line, line that determines min acceptable dist.
-        line_b -- index of second line
-        Returns True if they are close enough.
-        '''
-        l1 = self._list_lines[line_a]
-        l2 = self._list_lines[line_b]
-
-        allowable_dist = self._line_length(l1) * (1 + self._tolerance)
-
-        if self._dist_points((l1[0], l1[1]), (l2[0], l2[1])) > allowable_dist\
-                and self._dist_points((l1[0], l1[1]), (l2[2], l2[3])) > allowable_dist:
-            return False
-
-        if self._dist_points((l1[2], l1[3]), (l2[0], l2[1])) > allowable_dist\
-                and self._dist_points((l1[2], l1[3]), (l2[2], l2[3])) > allowable_dist:
-            return False
-        return True
+        close = np.ones((len(lines), len(lines)), bool)
+        for end in (lines[:, np.newaxis, 0:2], lines[:, np.newaxis, 2:4]):
+            dist_b_start = _distances(end, lines[np.newaxis, :, 0:2])
+            dist_b_end = _distances(end, lines[np.newaxis, :, 2:4])
+            close &= (dist_b_start <= allowable_dist) | (dist_b_end <= allowable_dist)
+        return close
 
     def _form_group(self):
         '''Forms a group starting with the longest available line and then adds
@@ -242,22 +186,12 @@ class LineReducer(object):
         # 3. If it is more than half of the length of the first line away.
         # 4. If adding if makes the group of lines violate the error ratio.
 
-        index = start_line
-        while True:
-            index += 1
-            if index >= self._list_lines_count:
-                break
-            if self._list_grouped[index]\
-                    or not self._min_dist_rejection(start_line, index)\
-                    or not self._min_dist_concentric(start_line, index):
-                continue
-
-            test_group = []
-            for l in this_group:
-                test_group.append(self._list_lines[l])
-            test_group.append(self._list_lines[index])
-
-            if not self._test_fit(test_group):
+        # The first three reasons are checked for every candidate at once.
+        candidates = self._close[start_line].copy()
+        candidates[:start_line + 1] = False
+        candidates &= ~self._list_grouped
+        for index in np.flatnonzero(candidates):
+            if not self._test_fit(this_group + [index]):
                 continue
 
             this_group.append(index)
@@ -277,10 +211,7 @@ class LineReducer(object):
         '''
         # First we define the rectangle, then we use the angle to find the ends
         # of the line, we create the line, then we return.
-        lines = []
-        for l in self._groups[group_index]:
-            lines.append(self._list_lines[l])
-        rectangle = self._fit_rectangle(lines)
+        rectangle = self._fit_rectangle(self._groups[group_index])
         # Recall:
         # center_point = rectangle[0]
         # width = rectangle[1][0]
@@ -323,7 +254,20 @@ class LineReducer(object):
 
         The X and Y coordinates are FLOATS and may be POSITIVE or NEGATIVE.
         '''
-        self._list_grouped = [False for x in xrange(self._list_lines_count)]
-        self._list_lines = self._sort_list_lines(self._list_lines)
+        self._list_grouped = np.zeros(self._list_lines_count, bool)
+        self._measure_lines()
         self._line_reduce()
         return self._final_lines
+
+
+def _lengths(lines):
+    '''Returns the length of each line in an array of lines.'''
+    square = (lines[:, 2] - lines[:, 0]) ** 2 + (lines[:, 3] - lines[:, 1]) ** 2
+    return square ** (1 / 2)
+
+
+def _distances(points_a, points_b):
+    '''Returns the distances between two broadcastable arrays of points.'''
+    square = (points_b[..., 0] - points_a[..., 0]) ** 2 + \
+        (points_b[..., 1] - points_a[..., 1]) ** 2
+    return square ** (1 / 2)
@@ -0,0 +1,146 @@
+'''
+Morphology sequences.
+
+Entities describe morphology as a sequence of kernel sizes.  A positive value
+dilates with an elliptical kernel of that size, a negative value erodes, and
+0 does nothing:
+
+    despeckled = libvision.apply_sequence(binary, [-8, 8, 3, -3])
+
+A sequence is compiled into as few cv2.morphologyEx() calls as possible.
+Repeats of a step become iterations of one call.  An erode followed by a
+dilate of the same size becomes an opening, and a dilate followed by an erode
+becomes a closing.  Size 1 steps do nothing and are left out.  The sequence
+above runs as an opening of size 8 and a closing of size 3.
+
+Kernels and compiled sequences are cached, so nothing is rebuilt per frame.
+If dst is given, the result is written into it, and every call after the
+first runs in place:
+
+    dst = libvision.cv_to_cv2(self.buffers.borrow(cv.GetSize(frame), 8, 1))
+    libvision.apply_sequence(binary, [-3, 3], dst=dst)
+
+'''
+
+import cv2
+
+_kernels = {}  # Maps (shape, size) -> kernel
+_sequences = {}  # Maps (sequence, shape, anchor) -> MorphologySequence
+
+
+def get_kernel(size, shape=cv2.MORPH_ELLIPSE):
+    '''Returns the size x size structuring element of the given shape.
+
+    Kernels are cached, so they must not be modified.
+    '''
+    key = (shape, size)
+    kernel = _kernels.get(key)
+    if kernel is None:
+        kernel = cv2.getStructuringElement(shape, (size, size))
+        _kernels[key] = kernel
+    return kernel
+
+
+def compile_sequence(sequence):
+    '''
+    Returns the (operation, size, iterations) steps that do the same as a
+    sequence of kernel sizes.  operation is one of the cv2.MORPH_* operations
+    understood by cv2.morphologyEx().
+    '''
+    # Merge repeats into iterations
+    runs = []
+    for val in sequence:
+        size = abs(int(val))
+        if size <= 1:
+            continue
+        op = cv2.MORPH_DILATE if val > 0 else cv2.MORPH_ERODE
+        if runs and runs[-1][0] == op and runs[-1][1] == size:
+            runs[-1][2] += 1
+        else:
+            runs.append([op, size, 1])
+
+    # Pair erodes and dilates of the same size into openings and closings
+    steps = []
+    i = 0
+    while i < len(runs):
+        op, size, iterations = runs[i]
+        if i + 1 < len(runs) and runs[i + 1][1] == size:
+            next_op, _, next_iterations = runs[i + 1]
+            paired = min(iterations, next_iterations)
+            if iterations > paired:
+                steps.append((op, size, iterations - paired))
+            if op == cv2.MORPH_ERODE:
+                steps.append((cv2.MORPH_OPEN, size, paired))
+            else:
+                steps.append((cv2.MORPH_CLOSE, size, paired))
+            if next_iterations > paired:
+                # The rest may still pair with the run after it
+                runs[i + 1] = [next_op, size, next_iterations - paired]
+                i += 1
+            else:
+                i += 2
+        else:
+            steps.append((op, size, iterations))
+            i += 1
+    return tuple(steps)
+
+
+class MorphologySequence(object):
+
+    '''A compiled morphology sequence.
+
+    Arguments:
+
+        sequence - Kernel sizes.  Positive values dilate, negative values
+            erode.
+
+        shape - Kernel shape, one of cv2.MORPH_ELLIPSE, cv2.MORPH_RECT and
+            cv2.MORPH_CROSS.
+
+        anchor - Kernel anchor.  Defaults to the center.
+
+    '''
+
+    def __init__(self, sequence, shape=cv2.MORPH_ELLIPSE, anchor=(-1, -1)):
+        self.sequence = tuple(sequence)
+        self.shape = shape
+        self.anchor = tuple(anchor)
+        self.steps = compile_sequence(self.sequence)
+        self._calls = [(op, get_kernel(size, shape), iterations)
+                       for op, size, iterations in self.steps]
+
+    def __len__(self):
+        '''Returns the number of cv2.morphologyEx() calls made.'''
+        return len(self.steps)
+
+    def apply(self, src, dst=None):
+        '''Runs the sequence on src and returns the result.
+
+        If dst is given the result is written into it.  It may be src.
+        Otherwise a new array is returned, unless the sequence does nothing,
+        in which case src itself is returned.
+        '''
+        if not self._calls:
+            if dst is None:
+                return src
+            dst[...] = src
+            return dst
+
+        for op, kernel, iterations in self._calls:
+            dst = cv2.morphologyEx(src, op, kernel, dst, self.anchor, iterations)
+            src = dst
+        return dst
+
+    def __repr__(self):
+        return "<MorphologySequence %s calls=%d>" % (list(self.sequence), len(self))
+
+
+def apply_sequence(src, sequence, dst=None, shape=cv2.MORPH_ELLIPSE,
+                   anchor=(-1, -1)):
+    '''Runs a morphology sequence on src.  See MorphologySequence.apply().'''
+    key = (tuple(sequence), shape, tuple(anchor))
+    compiled = _sequences.get(key)
+    if compiled is None:
+        compiled = MorphologySequence(sequence, shape, anchor)
+        _sequences[key] = compiled
+    return compiled.apply(src, dst)
@@ -0,0 +1,152 @@
+'''
+Parallel processing of frame tiles and ROIs.
+
+Most cv2 functions release the GIL while they run, so threads can work on
+different parts of the same frame at once.  A TilePool splits a frame into
+horizontal bands, or takes a list of ROIs, and processes them on a pool of
+worker threads:
+
+    tiles = libvision.TilePool(4)
+    blurred = tiles.map_tiles(lambda band: cv2.medianBlur(band, 5), frame,
+                              halo=2)
+    tiles.map_rois(lambda roi: cv2.Canny(roi, 0, 15), frame, rects, edges,
+                   merge=np.maximum)
+
+Each band is processed with halo extra rows of its neighbours above and below
+it, which are dropped from the result.  For a filter that only looks at
+pixels within halo rows, such as a median blur, a box filter or an adaptive
+threshold with a (2 * halo + 1) block, the result is exactly the same as
+processing the whole frame at once.  Canny also traces edges across any
+distance, so it can differ slightly near band edges.
+
+With one thread everything runs in the calling thread, with no overhead.
+'''
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+
+class TilePool(object):
+
+    '''A pool of threads for processing parts of frames.
+
+    Arguments:
+
+        threads - Number of worker threads.  1 runs everything in the calling
+            thread.  0 uses one thread per CPU.
+
+        min_rows - map_tiles() never makes bands shorter than this, since
+            small bands cost more in overhead than they gain.
+
+    '''
+
+    def __init__(self, threads=1, min_rows=64):
+        if threads == 0:
+            threads = multiprocessing.cpu_count()
+        self.threads = threads
+        self.min_rows = min_rows
+        self._pool = None
+
+    def map(self, func, items):
+        '''Returns [func(item) for item in items], computed in parallel.'''
+        items = list(items)
+        if self.threads <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        if self._pool is None:
+            self._pool = ThreadPool(self.threads)
+        return self._pool.map(func, items)
+
+    def bands(self, height, halo=0):
+        '''Returns the (y1, y2) row ranges map_tiles() splits a frame into.'''
+        count = max(min(self.threads, height // max(self.min_rows, 2 * halo, 1)), 1)
+        bounds = np.linspace(0, height, count + 1).astype(int)
+        return zip(bounds[:-1], bounds[1:])
+
+    def map_tiles(self, func, src, dst=None, halo=0):
+        '''Applies func to src one horizontal band at a time, in parallel.
+
+        Arguments:
+
+            func - Takes an image and returns an image of the same height and
+                width.
+
+            src - The frame, as a NumPy array.
+
+            dst - Where the results are written.  Defaults to a new array like
+                src.  Must be given if func changes the type or number of
+                channels.
+
+            halo - How many rows above and below each band func needs to see.
+
+        Returns dst.
+        '''
+        height = src.shape[0]
+        bands = self.bands(height, halo)
+        if len(bands) == 1:
+            result = func(src)
+            if dst is None:
+                return result
+            dst[...] = result
+            return dst
+
+        if dst is None:
+            dst = np.empty_like(src)
+
+        def run(band):
+            y1, y2 = band
+            top = max(y1 - halo, 0)
+            bottom = min(y2 + halo, height)
+            result = func(src[top:bottom])
+            # Bands don't overlap, so workers can write their rows directly
+            dst[y1:y2] = result[y1 - top:y2 - top]
+
+        self.map(run, bands)
+        return dst
+
+    def map_rois(self, func, src, rois, dst, merge=None):
+        '''Applies func to each ROI of src, in parallel, and writes the results
+        into the same ROIs of dst.
+
+        Arguments:
+
+            func - Takes an image and returns an image of the same height and
+                width.
+
+            rois - (x, y, width, height) rectangles inside src.
+
+            merge - How results are combined with what is already in dst, as
+                a NumPy ufunc like np.maximum.  By default results overwrite
+                dst.  Results are merged in the calling thread, one at a
+                time, so ROIs may overlap.
+
+        Returns dst.
+        '''
+        def run(rect):
+            (x, y, w, h) = rect
+            return func(src[y:y+h, x:x+w])
+
+        results = self.map(run, rois)
+        for (x, y, w, h), result in zip(rois, results):
+            region = dst[y:y+h, x:x+w]
+            if merge is None:
+                region[...] = result
+            else:
+                merge(region, result, out=region)
+        return dst
+
+    def close(self):
+        '''Stops the worker threads.  They are started again if needed.'''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def __getstate__(self):
+        # Threads can't be pickled.  A pickled pool starts its own.
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
+
+    def __repr__(self):
+        return "<TilePool threads=%d>" % self.threads
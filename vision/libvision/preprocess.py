@@ -0,0 +1,168 @@
+'''
+Per-frame memoized preprocessing.
+
+Most entities start the same way: median blur, convert to HSV, pick a channel,
+adaptive threshold.  A FrameCache computes each of these stages at most once
+per frame, no matter how many entities (or how many places in one entity) ask
+for it.  Every stage is identified by the chain of operations that produces
+it, so two requests share a result only if they would compute exactly the
+same thing:
+
+    blur_frame = self.preprocess.median_blur(5)
+    saturation = self.preprocess.channel(4, blur=5)
+    binary = self.preprocess.adaptive_threshold(4, 19, 4, blur=5)
+
+Channels are numbered the way entities already number them: 0-2 are the BGR
+channels and 3-5 are the HSV channels.
+
+Results are read-only NumPy arrays shared between consumers.  Copy them
+before modifying them in place.
+
+Given a TilePool with more than one thread, the blur, color conversion and
+threshold stages are computed in parallel bands.  The results are exactly
+the same.
+'''
+
+import cv2
+import numpy as np
+
+from convert import cv_to_cv2
+from pyramid import downscale
+from parallel import TilePool
+
+
+class FrameCache(object):
+
+    '''Memoizes preprocessing stages of the current frame.
+
+    Arguments:
+
+        tiles - A TilePool to compute stages with.  By default stages are
+            computed in the calling thread.
+
+    '''
+
+    def __init__(self, tiles=None):
+        if tiles is None:
+            tiles = TilePool(1)
+        self.tiles = tiles
+        self._source = None
+        self._results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def new_frame(self, frame, copy=True):
+        '''Sets the frame that stages are computed from and forgets old results.
+
+        Arguments:
+
+            frame - The new frame, as a cv image or a NumPy array.
+
+            copy - If False, the frame is used without copying it, so it must
+                not be modified until the next call to new_frame().
+
+        '''
+        if not isinstance(frame, np.ndarray):
+            frame = cv_to_cv2(frame)
+        if copy:
+            frame = frame.copy()
+        frame.flags.writeable = False
+        self._source = frame
+        self._results = {}
+
+    def get(self, key, compute):
+        '''
+        Returns the result of the stage identified by key, calling compute()
+        to produce it if this frame doesn't have it yet.
+        '''
+        try:
+            result = self._results[key]
+            self.hits += 1
+            return result
+        except KeyError:
+            pass
+
+        result = compute()
+        if isinstance(result, np.ndarray):
+            result.flags.writeable = False
+        self._results[key] = result
+        self.misses += 1
+        return result
+
+    def source(self):
+        '''Returns the unprocessed frame.'''
+        if self._source is None:
+            raise RuntimeError("FrameCache has no frame.  Call new_frame() first.")
+        return self._source
+
+    def median_blur(self, ksize=0):
+        '''Returns the frame median blurred with the given aperture.
+
+        A ksize of 0 returns the unprocessed frame.
+        '''
+        if not ksize:
+            return self.source()
+        return self.get(("median_blur", ksize),
+                        lambda: self.tiles.map_tiles(
+                            lambda band: cv2.medianBlur(band, ksize),
+                            self.source(), halo=ksize // 2))
+
+    def hsv(self, blur=0):
+        '''Returns the (optionally median blurred) frame converted to HSV.'''
+        return self.get(("hsv", blur),
+                        lambda: self.tiles.map_tiles(
+                            lambda band: cv2.cvtColor(band, cv2.COLOR_BGR2HSV),
+                            self.median_blur(blur)))
+
+    def channel(self, channel, blur=0):
+        '''Returns a contiguous copy of a single channel.
+
+        channel is 0-2 for BGR and 3-5 for HSV.
+        '''
+        if channel > 5:
+            raise ValueError("channel %d unavailable" % channel)
+
+        def compute():
+            if channel >= 3:
+                frame = self.hsv(blur)
+            else:
+                frame = self.median_blur(blur)
+            return np.ascontiguousarray(frame[:, :, channel % 3])
+
+        return self.get(("channel", channel, blur), compute)
+
+    def adaptive_threshold(self, channel, blk_size, thresh, blur=0,
+                           method=cv2.ADAPTIVE_THRESH_MEAN_C,
+                           threshold_type=cv2.THRESH_BINARY_INV):
+        '''Returns the adaptive threshold of a single channel.
+
+        The defaults match the mean, inverted binary threshold every entity
+        uses.
+        '''
+        return self.get(
+            ("adaptive_threshold", channel, blk_size, thresh, blur, method, threshold_type),
+            lambda: self.tiles.map_tiles(
+                lambda band: cv2.adaptiveThreshold(band, 255, method,
+                                                   threshold_type, blk_size, thresh),
+                self.channel(channel, blur), halo=blk_size // 2))
+
+    def level(self, scale):
+        '''Returns a FrameCache of the frame scaled down by scale.
+
+        Stages of the returned cache are memoized along with the stages of
+        this one, until the next new_frame().  A scale of 1 returns this
+        cache.  See pyramid.py.
+        '''
+        if scale >= 1:
+            return self
+
+        def compute():
+            level = FrameCache(self.tiles)
+            level.new_frame(downscale(self.source(), scale), copy=False)
+            return level
+
+        return self.get(("level", scale), compute)
+
+    def __repr__(self):
+        return "<FrameCache stages=%d hits=%d misses=%d>" % (
+            len(self._results), self.hits, self.misses)
@@ -0,0 +1,121 @@
+'''
+Coarse to fine detection on an image pyramid.
+
+Most detection work scales with the number of pixels.  Running detection on
+a frame scaled down by half costs about a quarter as much, at the price of
+missing small targets and losing precision.  Coarse to fine detection gets
+most of the precision back: candidates are found on the downscaled frame,
+then found again at full resolution, but only inside ROIs around each
+candidate.
+
+How far an entity downscales is its ScalePolicy:
+
+    class BuoyHoughEntity(VisionEntity):
+        scale_policy = libvision.ScalePolicy(0.5)
+
+Downscaled frames are best taken from the entity's FrameCache, so every stage
+after the downscale is memoized too:
+
+    coarse = self.preprocess.level(self.scale_policy.scale)
+    binary = coarse.adaptive_threshold(4, 19, 4, blur=5)
+
+'''
+
+from __future__ import division
+import math
+
+import cv2
+import numpy as np
+
+from roi import pad_rectangle, merge_rectangles
+
+
+class ScalePolicy(object):
+
+    '''Describes at which resolution an entity detects its targets.
+
+    Arguments:
+
+        scale - Detection runs on the frame scaled by this factor.  1.0 is full
+            resolution.  Powers of two (0.5, 0.25) are computed with
+            cv2.pyrDown, other scales with cv2.resize.
+
+        refine - If True, candidates found on the downscaled frame are
+            detected again at full resolution in ROIs around them.
+            Otherwise the downscaled candidates are used as they are.
+
+        padding - How far each refinement ROI extends past its candidate, in
+            full resolution pixels.
+
+    '''
+
+    def __init__(self, scale=1.0, refine=True, padding=20):
+        if not 0 < scale <= 1:
+            raise ValueError("Scale must be in (0, 1], not %s." % scale)
+        self.scale = scale
+        self.refine = refine
+        self.padding = padding
+
+    @property
+    def downscaled(self):
+        return self.scale < 1
+
+    def scale_length(self, length, minimum=1):
+        '''Scales a length in full resolution pixels down to the coarse level.'''
+        return max(int(round(length * self.scale)), minimum)
+
+    def scale_odd(self, length, minimum=3):
+        '''Like scale_length(), but always odd.  For kernel and block sizes.'''
+        length = self.scale_length(length, minimum)
+        return length if length % 2 else length + 1
+
+    def to_full(self, values):
+        '''Scales coarse level coordinates or lengths up to full resolution.'''
+        return np.asarray(values, dtype=np.float64) / self.scale
+
+    def refine_regions(self, candidates, frame_size):
+        '''Returns the full resolution ROIs in which to refine candidates.
+
+        Arguments:
+
+            candidates - (x, y, size) of each candidate on the coarse level.
+                size is its radius or half width.
+
+            frame_size - (width, height) of the full resolution frame.
+
+        The ROIs are merged so that they don't overlap.
+        '''
+        width, height = frame_size
+        rects = []
+        for x, y, size in self.to_full(candidates).reshape(-1, 3):
+            rect = pad_rectangle((x - size, y - size, 2 * size, 2 * size),
+                                 self.padding, width, height)
+            if rect is not None:
+                rects.append(rect)
+        return merge_rectangles(rects)
+
+    def __repr__(self):
+        return "<ScalePolicy scale=%s refine=%s padding=%s>" % (
+            self.scale, self.refine, self.padding)
+
+
+# Every entity uses this unless it declares otherwise
+FULL_RESOLUTION = ScalePolicy(1.0)
+
+
+def downscale(frame, scale):
+    '''Returns frame scaled down by scale, which is at most 1.
+
+    Powers of two are computed by repeated cv2.pyrDown, which blurs before
+    subsampling.
+    '''
+    if scale >= 1:
+        return frame
+    octaves = -math.log(scale, 2)
+    if abs(octaves - round(octaves)) < 1e-9:
+        for i in xrange(int(round(octaves))):
+            frame = cv2.pyrDown(frame)
+        return frame
+    height, width = frame.shape[:2]
+    size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
@@ -0,0 +1,57 @@
+'''
+Regions of interest.
+
+Rectangles are (x, y, width, height) tuples, like those of cv2.boundingRect
+and cv.SetImageROI.
+'''
+
+
+def pad_rectangle(rect, padding, width, height):
+    '''
+    Returns rect grown by padding pixels on every side, clipped to a width x
+    height image.  Returns None if nothing of it is left inside the image.
+    '''
+    x, y, w, h = rect
+    x1 = max(int(x - padding), 0)
+    y1 = max(int(y - padding), 0)
+    x2 = min(int(x + w + padding), width)
+    y2 = min(int(y + h + padding), height)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+def rectangles_overlap(a, b):
+    '''Returns True if rectangles a and b share any pixels.'''
+    return (a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and
+            a[1] < b[1] + b[3] and b[1] < a[1] + a[3])
+
+
+def bounding_rectangle(a, b):
+    '''Returns the smallest rectangle containing both a and b.'''
+    x1 = min(a[0], b[0])
+    y1 = min(a[1], b[1])
+    x2 = max(a[0] + a[2], b[0] + b[2])
+    y2 = max(a[1] + a[3], b[1] + b[3])
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+def merge_rectangles(rects):
+    '''
+    Returns a list of rectangles covering rects, in which overlapping
+    rectangles were replaced by their bounding rectangle.  No two rectangles
+    of the result overlap, so no pixel is processed twice.
+    '''
+    merged = []
+    for rect in rects:
+        rect = tuple(rect)
+        # A grown rectangle may now overlap ones that were merged before it
+        i = 0
+        while i < len(merged):
+            if rectangles_overlap(rect, merged[i]):
+                rect = bounding_rectangle(rect, merged.pop(i))
+                i = 0
+            else:
+                i += 1
+        merged.append(rect)
+    return merged
@@ -2,8 +2,16 @@ from __future__ import division
 from time import time
 
 import cv
+import cv2
+import numpy as np
 
 import libvision
+from buffer_pool import BufferPool
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
 
 DEFAULT_MATCH_METHOD = cv.CV_TM_CCORR
 MIN = 2  # Indexes into cv.minmaxloc outputs.
@@ -18,6 +26,8 @@ MATCH_METHOD_MIN_OR_MAX = {
     cv.CV_TM_CCOEFF: MAX,
     cv.CV_TM_CCOEFF_NORMED: MAX,
 }
+# Cost given to track/detection pairs outside of a MultiTracker gate
+_OUT_OF_GATE = 1e9
 
 
 class Tracker(object):
@@ -81,6 +91,9 @@ class Tracker(object):
         self.search_size = search_size
         self.debug = debug
 
+        # Per-call temporaries of locate_object()
+        self._buffers = BufferPool()
+
         template_rect = clip_rectangle((
             center[0] - size[0] / 2,
             center[1] - size[1] / 2,
@@ -95,7 +108,7 @@ class Tracker(object):
             cv.NamedWindow("search region")
             cv.NamedWindow("Histogram")
 
-    def _preprocess(self, frame):
+    def _preprocess(self, frame, pool=None):
         '''
         Formats a raw rgb image into a processed image which template matching
         is performed on.
@@ -105,9 +118,14 @@ class Tracker(object):
         this function should implement multiple preprocessing methods that can
         be selected between on init.
 
+        If pool is given, the result is borrowed from it.
+
         '''
 
-        dst = cv.CreateImage(cv.GetSize(frame), cv.IPL_DEPTH_32F, frame.channels)
+        if pool is None:
+            dst = cv.CreateImage(cv.GetSize(frame), cv.IPL_DEPTH_32F, frame.channels)
+        else:
+            dst = pool.borrow_like(frame, cv.IPL_DEPTH_32F)
         cv.Laplace(frame, dst, 19)
         return dst
 
@@ -150,14 +168,18 @@ class Tracker(object):
             raise RuntimeError("The Tracker class can not be used after it is "
                                "unpickled.")
 
-        search_rect = clip_rectangle((
+        # Shifted rather than clipped at the frame border, so the search
+        # image and the match result stay the same size from frame to frame
+        # and their buffers are reused.
+        search_rect = shift_rectangle((
             self.object_center[0] - self.search_size[0] / 2,  # x
             self.object_center[1] - self.search_size[1] / 2,  # y
             self.search_size[0],  # width
             self.search_size[1],  # height
         ), frame.width, frame.height)
-        search_image = self._preprocess(crop(frame, search_rect))
-        result = cv.CreateImage(
+        buffers = self._buffers
+        search_image = self._preprocess(crop(frame, search_rect, buffers), buffers)
+        result = buffers.borrow(
             (
                 search_image.width - self._template.width + 1,
                 search_image.height - self._template.height + 1
@@ -167,6 +189,7 @@ class Tracker(object):
         min_or_max = MATCH_METHOD_MIN_OR_MAX[self.match_method]
         minmaxloc = cv.MinMaxLoc(result)
         if abs(minmaxloc[1] - minmaxloc[0]) < 0.001:
+            buffers.release_all()
             return False
         match_in_result = minmaxloc[min_or_max]
 
@@ -186,8 +209,7 @@ class Tracker(object):
         )
 
         # Determine if the max/min is significant.
-        hist = cv.CreateHist([256], cv.CV_HIST_ARRAY, [[0, 255]], 1)
-        cv.CalcHist([scale_32f_image(result)], hist)
+        hist = libvision.hist.calc_histogram(scale_32f_image(result, buffers))
         # XXX stddevs from mean should be calculated from either 0 or 255
         #    depending on min or max
         distance = abs(libvision.hist.num_stddev_from_mean(hist, 255))
@@ -200,17 +222,19 @@ class Tracker(object):
 
         if self.debug:
 
-            result_8bit = scale_32f_image(result)
+            result_8bit = scale_32f_image(result, buffers)
             if object_found:
                 cv.Circle(result_8bit, match_in_result, 5, (0, 255, 0))
                 cv.Circle(search_image, match_in_search_region, 5, (0, 255, 0))
             hist_image = libvision.hist.histogram_image(hist)
 
             cv.ShowImage("match", result_8bit)
-            cv.ShowImage("template", scale_32f_image(self._template))
-            cv.ShowImage("search region", scale_32f_image(search_image))
+            cv.ShowImage("template", scale_32f_image(self._template, buffers))
+            cv.ShowImage("search region", scale_32f_image(search_image, buffers))
             cv.ShowImage("Histogram", hist_image)
 
+        buffers.release_all()
+
         # Update Template
         if object_found:
             return self.object_center
@@ -222,18 +246,23 @@ class Tracker(object):
 
         OpenCV object cannot be pickled.  Something very weird happens if you
         try.  This function is called while pickling.  The dictionary returned
-        by this function is what is actually pickled, which excludes the
-        IplImage which won't pickle correctly.
-
-        Note that for this reason, this class does not work correctly after pickled.
+        by this function is what is actually pickled, in which the template
+        IplImage is replaced by a NumPy copy of it.
 
         '''
         pickleable_copy = self.__dict__.copy()
-        pickleable_copy['_template'] = None
+        if self._template:
+            pickleable_copy['_template'] = libvision.cv_to_cv2(self._template).copy()
+        pickleable_copy['_buffers'] = BufferPool()
         return pickleable_copy
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self._template, np.ndarray):
+            self._template = libvision.cv2_to_cv(self._template)
+
 
-def scale_32f_image(image):
+def scale_32f_image(image, pool=None):
     '''
     Scales the given cv.IPL_DEPTH_32F type image to an 8 bit image so that the
     smallest value maps to 0 and the largest maps to 255.  Used for displaying
@@ -242,12 +271,17 @@ def scale_32f_image(image):
     Processes each channel separately, which can produce some useful, but
     esoteric results.
 
+    If pool is given, the result is borrowed from it and the temporaries used
+    are borrowed from and returned to it.
+
     '''
     if image.depth != cv.IPL_DEPTH_32F:
         return image
-    result = cv.CreateImage(cv.GetSize(image), 8, image.channels)
-    channel_image = cv.CreateImage(cv.GetSize(image), cv.IPL_DEPTH_32F, 1)
-    channel_scaled = cv.CreateImage(cv.GetSize(image), 8, 1)
+    if pool is None:
+        pool = BufferPool()
+    result = pool.borrow_like(image, 8)
+    channel_image = pool.borrow_like(image, cv.IPL_DEPTH_32F, 1)
+    channel_scaled = pool.borrow_like(image, 8, 1)
     for channel_num in xrange(1, image.channels + 1):
 
         cv.SetImageCOI(image, channel_num)
@@ -265,18 +299,24 @@ def scale_32f_image(image):
 
     cv.SetImageCOI(image, 0)
     cv.SetImageCOI(result, 0)
+    pool.release(channel_image)
+    pool.release(channel_scaled)
     return result
 
 
-def crop(frame, rect):
+def crop(frame, rect, pool=None):
     '''Crops the image to a given CvRect.
 
     Rect must be within the image.  Rectangles can be clipped with
-    clip_rectangle().
+    clip_rectangle().  If pool is given, the cropped image is borrowed from
+    it.
 
     '''
     cv.SetImageROI(frame, rect)
-    cropped = cv.CreateImage(cv.GetSize(frame), frame.depth, frame.channels)
+    if pool is None:
+        cropped = cv.CreateImage(cv.GetSize(frame), frame.depth, frame.channels)
+    else:
+        cropped = pool.borrow_like(frame)
     cv.Copy(frame, cropped)
     cv.ResetImageROI(frame)
     return cropped
@@ -297,6 +337,22 @@ def clip_rectangle(rect, width, height):
     )
 
 
+def shift_rectangle(rect, width, height):
+    '''
+    Returns the CvRect moved, rather than clipped, to fit inside a width x
+    height image.  It keeps its size unless it is bigger than the image.
+
+    '''
+    w = min(int(rect[2]), width)
+    h = min(int(rect[3]), height)
+    return (
+        int(in_range(0, rect[0], width - w)),
+        int(in_range(0, rect[1], height - h)),
+        w,
+        h,
+    )
+
+
 def in_range(min, x, max):
     '''Returns x clipped to the range of min and max.'''
     if x > max:
@@ -305,3 +361,425 @@ def in_range(min, x, max):
         return min
     else:
         return x
+
+
+class MultiTracker(object):
+
+    '''Tracks any number of objects between frames.
+
+    Each frame, the detections found by an entity are given to update().
+    Detections are associated with the existing tracks, either optimally
+    (Hungarian algorithm, if SciPy is installed) or by gated nearest
+    neighbour.  A detection only matches a track if it is within the track's
+    gate: less than gate pixels away in both x and y of where the track is
+    predicted to be.  The position of every track is filtered with a constant
+    velocity Kalman filter.
+
+    Tracks start out as candidates and become confirmed after confirm_hits
+    matches.  Every track has a score, which is raised by hit_score each time
+    it is matched and lowered by candidate_decay or confirmed_decay each
+    frame.  Tracks whose score falls below min_score are dropped.
+
+    The detections are arbitrary objects, called payloads.  Their position is
+    read from the attributes named by position_attrs.  A detection that
+    starts a new track becomes that track's payload, and the filtered
+    position is written back to the payload after every update.  The state of
+    all tracks is kept in NumPy arrays, so the tracker can be pickled along
+    with its entity.
+
+    Arguments:
+
+        gate - Gate size of candidate tracks, in pixels.
+
+        confirmed_gate - Gate size of confirmed tracks.  Defaults to gate.
+
+        confirm_hits - Number of hits needed to confirm a track.  A new track
+            has one hit.
+
+        hit_increment - How many hits a match counts for.
+
+        hit_score - How much a match raises the score.
+
+        max_score - The score is never raised above this.
+
+        initial_score - The score of a new track.
+
+        min_score - Tracks with a score below this are dropped.
+
+        candidate_decay, confirmed_decay - How much the score of candidate
+            and confirmed tracks is lowered each frame.
+
+        merge_distance - If given, confirmed tracks closer than this in both
+            x and y are merged, keeping the oldest one.
+
+        position_attrs - Names of the payload attributes holding x and y.
+
+        score_attr, hits_attr - If given, the score and number of matches of
+            each track are written to these payload attributes too, for
+            display.
+
+        process_noise - Variance of the acceleration of objects, in pixels per
+            frame squared.  Larger values follow the detections more closely.
+
+        measurement_noise - Variance of detected positions, in pixels squared.
+
+        assignment - "hungarian" or "nearest".  Defaults to "hungarian" if
+            SciPy is installed.
+
+    '''
+
+    def __init__(self, gate, confirmed_gate=None, confirm_hits=3,
+                 hit_increment=1, hit_score=1, max_score=None,
+                 initial_score=1, min_score=0,
+                 candidate_decay=1, confirmed_decay=1, merge_distance=None,
+                 position_attrs=("x", "y"), score_attr=None, hits_attr=None,
+                 process_noise=4.0, measurement_noise=1.0, assignment=None):
+
+        if assignment is None:
+            assignment = "hungarian" if linear_sum_assignment else "nearest"
+        if assignment not in ("hungarian", "nearest"):
+            raise ValueError("Unknown assignment '%s'." % assignment)
+        if assignment == "hungarian" and linear_sum_assignment is None:
+            raise ValueError("Hungarian assignment needs SciPy.")
+
+        self.gate = gate
+        self.confirmed_gate = gate if confirmed_gate is None else confirmed_gate
+        self.confirm_hits = confirm_hits
+        self.hit_increment = hit_increment
+        self.hit_score = hit_score
+        self.max_score = max_score
+        self.initial_score = initial_score
+        self.min_score = min_score
+        self.candidate_decay = candidate_decay
+        self.confirmed_decay = confirmed_decay
+        self.merge_distance = merge_distance
+        self.position_attrs = position_attrs
+        self.score_attr = score_attr
+        self.hits_attr = hits_attr
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.assignment = assignment
+
+        # One row per track
+        self._ids = np.zeros(0, np.int64)
+        self._state = np.zeros((0, 4))  # x, y, x velocity, y velocity
+        self._covariance = np.zeros((0, 4, 4))
+        self._hits = np.zeros(0, np.int64)
+        self._score = np.zeros(0)
+        self._confirmed = np.zeros(0, bool)
+        self._payloads = []
+        self._templates = []
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def tracks(self):
+        '''Returns the payloads of every track, oldest first.'''
+        return list(self._payloads)
+
+    def confirmed(self):
+        '''Returns the payloads of confirmed tracks, oldest first.'''
+        return [p for p, c in zip(self._payloads, self._confirmed) if c]
+
+    def candidates(self):
+        '''Returns the payloads of unconfirmed tracks, oldest first.'''
+        return [p for p, c in zip(self._payloads, self._confirmed) if not c]
+
+    def is_confirmed(self, payload):
+        return bool(self._confirmed[self._row(payload)])
+
+    def positions(self):
+        '''Returns an array of the filtered (x, y) of every track.'''
+        return self._state[:, :2].copy()
+
+    def predicted_positions(self, dt=1.0, confirmed_only=False):
+        '''
+        Returns an array of where every track (or every confirmed track) is
+        expected to be dt frames from now, without moving the tracks.
+        '''
+        state = self._state
+        if confirmed_only:
+            state = state[self._confirmed]
+        return state[:, :2] + state[:, 2:] * dt
+
+    def velocity(self, payload):
+        '''Returns the filtered velocity of a track, in pixels per frame.'''
+        return tuple(float(v) for v in self._state[self._row(payload), 2:])
+
+    def score(self, payload):
+        return float(self._score[self._row(payload)])
+
+    def add_score(self, payload, amount):
+        '''Raises (or lowers, if amount is negative) the score of a track.'''
+        row = self._row(payload)
+        self._score[row] = self._clip_score(self._score[row] + amount)
+        self._write_back([row])
+
+    def set_position(self, payload, x, y):
+        '''Moves a track to a position measured some other way.'''
+        row = self._row(payload)
+        self._state[row, :2] = (x, y)
+        self._write_back([row])
+
+    def remove(self, payload):
+        '''Drops a track.'''
+        keep = np.ones(len(self), bool)
+        keep[self._row(payload)] = False
+        self._keep(keep)
+
+    def predict(self, dt=1.0):
+        '''Moves every track forward dt frames.'''
+        if not len(self):
+            return
+        transition = np.eye(4)
+        transition[0, 2] = transition[1, 3] = dt
+        q = self.process_noise
+        noise = np.zeros((4, 4))
+        noise[0, 0] = noise[1, 1] = q * dt ** 3 / 3
+        noise[0, 2] = noise[2, 0] = noise[1, 3] = noise[3, 1] = q * dt ** 2 / 2
+        noise[2, 2] = noise[3, 3] = q * dt
+
+        self._state = self._state.dot(transition.T)
+        self._covariance = np.einsum("ij,njk,lk->nil", transition,
+                                     self._covariance, transition) + noise
+
+    def update(self, detections, dt=1.0):
+        '''Updates the tracks with the detections of a new frame.
+
+        Returns a list of (track payload, detection) pairs, one for every
+        detection that matched an existing track.  Only the position of the
+        track payload is updated, so the caller may want to copy other
+        attributes from the detection.  Detections that didn't match any
+        track start new tracks, unless they are within the gate of a track
+        that matched a closer detection.
+        '''
+        self.predict(dt)
+
+        detections = list(detections)
+        measurements = np.array([[getattr(d, a) for a in self.position_attrs]
+                                 for d in detections], float).reshape(-1, 2)
+        rows, columns, in_gate = self._associate(measurements)
+
+        self._correct(rows, measurements[columns])
+        self._hits[rows] += self.hit_increment
+        self._score[rows] = self._clip_score(self._score[rows] + self.hit_score)
+        matches = [(self._payloads[r], detections[c]) for r, c in zip(rows, columns)]
+
+        # Start tracks for detections that aren't near any track
+        new = [i for i in xrange(len(detections)) if not in_gate[:, i].any()]
+        for i in new:
+            self._add(detections[i], measurements[i])
+
+        # Decay, confirm and drop
+        self._score -= np.where(self._confirmed, self.confirmed_decay,
+                                self.candidate_decay)
+        self._confirmed |= self._hits >= self.confirm_hits
+        self._keep(self._score >= self.min_score)
+        if self.merge_distance is not None:
+            self._merge_confirmed()
+
+        self._write_back(xrange(len(self)))
+        return matches
+
+    def _associate(self, measurements):
+        '''
+        Returns the rows of matched tracks, the columns of the detections they
+        matched, and an array telling which detections are within the gate of
+        which tracks.
+        '''
+        num_tracks, num_detections = len(self), len(measurements)
+        if not num_tracks or not num_detections:
+            empty = np.zeros(0, np.int64)
+            return empty, empty, np.zeros((num_tracks, num_detections), bool)
+
+        difference = measurements[np.newaxis, :, :] - self._state[:, np.newaxis, :2]
+        gates = np.where(self._confirmed, self.confirmed_gate, self.gate)
+        in_gate = np.abs(difference).max(axis=2) < gates[:, np.newaxis]
+        cost = np.where(in_gate, np.sqrt((difference ** 2).sum(axis=2)),
+                        _OUT_OF_GATE)
+
+        if self.assignment == "hungarian":
+            rows, columns = linear_sum_assignment(cost)
+            matched = in_gate[rows, columns]
+            return rows[matched], columns[matched], in_gate
+
+        # Gated nearest neighbour: take the closest remaining pair each time
+        rows, columns = [], []
+        track_used = np.zeros(num_tracks, bool)
+        detection_used = np.zeros(num_detections, bool)
+        for index in np.argsort(cost, axis=None):
+            row, column = divmod(index, num_detections)
+            if not in_gate[row, column]:
+                break
+            if track_used[row] or detection_used[column]:
+                continue
+            track_used[row] = detection_used[column] = True
+            rows.append(row)
+            columns.append(column)
+        return np.array(rows, np.int64), np.array(columns, np.int64), in_gate
+
+    def _correct(self, rows, measurements):
+        '''Kalman filter update of the given tracks.'''
+        if not len(rows):
+            return
+        covariance = self._covariance[rows]
+        innovation_covariance = covariance[:, :2, :2] + \
+            self.measurement_noise * np.eye(2)
+        gain = np.einsum("nij,njk->nik", covariance[:, :, :2],
+                         np.linalg.inv(innovation_covariance))
+        innovation = measurements - self._state[rows, :2]
+        self._state[rows] += np.einsum("nij,nj->ni", gain, innovation)
+        self._covariance[rows] = covariance - \
+            np.einsum("nij,njk->nik", gain, covariance[:, :2, :])
+
+    def _add(self, payload, position):
+        covariance = np.diag([self.measurement_noise, self.measurement_noise,
+                              100.0, 100.0])
+        self._ids = np.append(self._ids, self._next_id)
+        self._next_id += 1
+        self._state = np.vstack([self._state, [position[0], position[1], 0, 0]])
+        self._covariance = np.concatenate([self._covariance, covariance[np.newaxis]])
+        self._hits = np.append(self._hits, 1)
+        self._score = np.append(self._score, self.initial_score)
+        self._confirmed = np.append(self._confirmed, False)
+        self._payloads.append(payload)
+        self._templates.append(None)
+
+    def _keep(self, keep):
+        '''Drops every track whose entry in the boolean array keep is False.'''
+        self._ids = self._ids[keep]
+        self._state = self._state[keep]
+        self._covariance = self._covariance[keep]
+        self._hits = self._hits[keep]
+        self._score = self._score[keep]
+        self._confirmed = self._confirmed[keep]
+        self._payloads = [p for p, k in zip(self._payloads, keep) if k]
+        self._templates = [t for t, k in zip(self._templates, keep) if k]
+
+    def _merge_confirmed(self):
+        '''Drops confirmed tracks near an older confirmed track.'''
+        rows = np.flatnonzero(self._confirmed)
+        if len(rows) < 2:
+            return
+        positions = self._state[rows, :2]
+        close = np.abs(positions[:, np.newaxis] - positions[np.newaxis]).max(axis=2) \
+            < self.merge_distance
+        keep = np.ones(len(self), bool)
+        # Rows are in creation order, so earlier rows are older tracks
+        for i in xrange(len(rows)):
+            if keep[rows[i]]:
+                later = rows[i + 1:][close[i, i + 1:]]
+                keep[later] = False
+        self._keep(keep)
+
+    def _clip_score(self, score):
+        if self.max_score is None:
+            return score
+        return np.minimum(score, self.max_score)
+
+    def _row(self, payload):
+        for row, p in enumerate(self._payloads):
+            if p is payload:
+                return row
+        raise ValueError("Payload is not being tracked.")
+
+    def _write_back(self, rows):
+        x_attr, y_attr = self.position_attrs
+        for row in rows:
+            payload = self._payloads[row]
+            setattr(payload, x_attr, float(self._state[row, 0]))
+            setattr(payload, y_attr, float(self._state[row, 1]))
+            if self.score_attr:
+                setattr(payload, self.score_attr, float(self._score[row]))
+            if self.hits_attr:
+                setattr(payload, self.hits_attr, int(self._hits[row]))
+
+    def set_template(self, payload, frame, size):
+        '''
+        Makes track payload use template matching in match_templates().  The
+        template is taken from frame, a size (width, height) area around the
+        track's current position.
+        '''
+        row = self._row(payload)
+        frame = _as_array(frame)
+        x, y = self._state[row, :2]
+        rect = clip_rectangle((x - size[0] / 2, y - size[1] / 2, size[0], size[1]),
+                              frame.shape[1], frame.shape[0])
+        self._templates[row] = _laplacian(
+            frame[rect[1]:rect[1] + rect[3], rect[0]:rect[0] + rect[2]]).copy()
+
+    def match_templates(self, frame, search_size, alpha=0.2, min_z_score=5.0,
+                        match_method=cv2.TM_CCORR):
+        '''Finds every track that has a template in frame.
+
+        This is the multi-object version of Tracker.locate_object().  The
+        Laplacian of the frame is computed once for all tracks, and the
+        significance of all matches is tested in one batch.  Each match found
+        updates its track like a detection would, and mixes alpha of the match
+        into the track's template.  Tracks whose template didn't match are
+        left to be updated by update().
+
+        Returns a list of the payloads that were found.
+        '''
+        rows = [row for row, t in enumerate(self._templates) if t is not None]
+        if not rows:
+            return []
+
+        frame = _as_array(frame)
+        laplacian = _laplacian(frame)
+        height, width = frame.shape[:2]
+
+        matches = []  # (row, search rect, location in result)
+        scaled_results = []
+        for row in rows:
+            template = self._templates[row]
+            x, y = self._state[row, :2]
+            rx, ry, rw, rh = clip_rectangle(
+                (x - search_size[0] / 2, y - search_size[1] / 2,
+                 search_size[0], search_size[1]), width, height)
+            if rw < template.shape[1] or rh < template.shape[0]:
+                continue
+            result = cv2.matchTemplate(laplacian[ry:ry + rh, rx:rx + rw],
+                                       template, match_method)
+            low, high, low_loc, high_loc = cv2.minMaxLoc(result)
+            if abs(high - low) < 0.001:
+                continue
+            location = low_loc if MATCH_METHOD_MIN_OR_MAX[match_method] == MIN else high_loc
+            matches.append((row, (rx, ry), location))
+            scaled_results.append(cv2.normalize(result, None, 0, 255,
+                                                cv2.NORM_MINMAX, cv2.CV_8U))
+        if not matches:
+            return []
+
+        hists = np.array([libvision.hist.calc_histogram(r) for r in scaled_results])
+        z_scores = np.abs(libvision.hist.num_stddevs_from_mean(hists, 255))
+
+        found_rows = []
+        measurements = []
+        for (row, origin, location), z_score in zip(matches, z_scores):
+            if z_score < min_z_score:
+                continue
+            template = self._templates[row]
+            th, tw = template.shape[:2]
+            left, top = origin[0] + location[0], origin[1] + location[1]
+            match = laplacian[top:top + th, left:left + tw]
+            cv2.addWeighted(template, 1 - alpha, match, alpha, 0, template)
+            found_rows.append(row)
+            measurements.append((left + tw / 2, top + th / 2))
+
+        found_rows = np.array(found_rows, np.int64)
+        self._correct(found_rows, np.array(measurements, float).reshape(-1, 2))
+        self._write_back(found_rows)
+        return [self._payloads[row] for row in found_rows]
+
+
+def _as_array(frame):
+    if isinstance(frame, np.ndarray):
+        return frame
+    return libvision.cv_to_cv2(frame)
+
+
+def _laplacian(frame):
+    '''The preprocessing used for template matching, as in Tracker.'''
+    return cv2.Laplacian(frame, cv2.CV_32F, ksize=19)
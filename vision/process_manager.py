@@ -1,67 +1,214 @@
 
 import sys
 import time
+import select
 import traceback
+from collections import deque
 from multiprocessing import Process, Pipe
 
+import cv
+
 import svr
 
 import sw3
+import libvision
+from frame_bus import FrameBus, is_live_source
+from frame_grabber import LatestFrameCapture, DEFAULT_EVERY_NTH, DEFAULT_DEADLINE
+# Entities import vision.debug_output, which holds the process's svr.debug
+# state, so this must be the same module
+from vision.debug_output import install_svr_debug, default_sinks, DEFAULT_MAX_RATE
+
+# Keyword args that set up a fused process rather than one of its entities.
+# Entities joining a running fused process get the process's.
+FUSED_PROCESS_KWARGS = ("frame_bus", "drop_policy", "every_nth",
+                        "frame_deadline", "threads")
 
 
 class ProcessManager(object):
 
-    def __init__(self, extra_kwargs={}):
+    def __init__(self, extra_kwargs={}, shared_frames=True, freeze_sensors=True,
+                 fuse_cameras=False):
         '''
         :param extra_kwargs:
             Keyward args that are passed to each process started.
+        :param shared_frames:
+            If True, entities that support it read a live camera or stream
+            through a FrameBus shared by every entity on that camera, instead
+            of each opening its own.  Video and image files are always read
+            by each entity, one frame per processed frame.
+        :param freeze_sensors:
+            If True, sensor data is frozen at the pose the robot was in when
+            each output's frame was captured.  See sw3.data.freeze_at().
+        :param fuse_cameras:
+            If True, start_process() runs every entity on a camera in one
+            fused process (see start_fused()), so they share the capture and
+            preprocessing.  Entities started later join the camera's running
+            process.
         '''
         # holds the list currently running processes
         self.extra_kwargs = extra_kwargs
         self.process_list = {}
 
+        # maps camera name -> FrameBus
+        self.shared_frames = shared_frames
+        self.frame_buses = {}
+
+        self.freeze_sensors = freeze_sensors
+
+        # maps camera name -> FusedProcess
+        self.fuse_cameras = fuse_cameras
+        self.fused_processes = {}
+
     def start_process(self, proc_cls, name, *args, **kwargs):
         '''Initiates a process of the class proc_cls.'''
+        if self.fuse_cameras and len(args) == 1 and not kwargs.get("waitforsync"):
+            return self.start_fused(args[0], [(proc_cls, name)], **kwargs)
+
         vision_process = VisionProcess(self, proc_cls, name)
         self.process_list[name] = vision_process
         for key, value in self.extra_kwargs.iteritems():
             kwargs[key] = value
+        kwargs["process_name"] = name
+        if self.uses_frame_bus([proc_cls], args[0] if args else None):
+            kwargs["frame_bus"] = self.get_frame_bus(args[0], kwargs.get("debug", False))
         vision_process.run(*args, **kwargs)
         return vision_process
 
+    def start_fused(self, camera_name, entity_specs, **kwargs):
+        '''Runs several entities on one camera in a single process.
+
+        The process captures each frame once.  Preprocessing stages that the
+        entities share (see libvision.FrameCache) are computed once per
+        frame, and each entity gets its own copy of the frame to process.
+        Each entity's output is still available under its own name from
+        get_data().  If a fused process is already running on camera_name,
+        the entities join it.
+
+        The process's frames drive the entities, so waitforsync is not
+        supported.
+
+        :param camera_name:
+            The camera or stream every entity processes.
+        :param entity_specs:
+            A list of (proc_cls, name) pairs.  Entities are run in this order
+            on every frame.
+        :param kwargs:
+            Keyword args passed to every entity.
+        '''
+        if kwargs.get("waitforsync"):
+            raise ValueError("Fused entities cannot wait for sync signals.")
+        for key, value in self.extra_kwargs.iteritems():
+            kwargs[key] = value
+
+        fused_process = self.fused_processes.get(camera_name)
+        if fused_process is not None and not fused_process.killed:
+            for key in FUSED_PROCESS_KWARGS:
+                kwargs.pop(key, None)
+            for proc_cls, name in entity_specs:
+                fused_process.add_entity(proc_cls, name, kwargs)
+                self.process_list[name] = FusedEntityProcess(fused_process, name)
+            return fused_process
+
+        fused_process = FusedProcess(self, camera_name, entity_specs)
+        if self.uses_frame_bus([proc_cls for proc_cls, name in entity_specs], camera_name):
+            kwargs["frame_bus"] = self.get_frame_bus(camera_name, kwargs.get("debug", False))
+        for proc_cls, name in entity_specs:
+            self.process_list[name] = FusedEntityProcess(fused_process, name)
+        fused_process.run(**kwargs)
+        self.fused_processes[camera_name] = fused_process
+        return fused_process
+
+    def uses_frame_bus(self, proc_classes, camera_name):
+        '''Returns True if entities of proc_classes on camera_name should read
+        through a FrameBus.'''
+        if not self.shared_frames or camera_name is None:
+            return False
+        if not is_live_source(camera_name, self.extra_kwargs.get("cameras", {})):
+            return False
+        return all(getattr(proc_cls, "uses_frame_bus", False) for proc_cls in proc_classes)
+
+    def get_frame_bus(self, camera_name, display=False):
+        '''Returns the FrameBus for camera_name, starting it if needed.'''
+        frame_bus = self.frame_buses.get(camera_name)
+        if frame_bus is None or not frame_bus.is_running():
+            frame_bus = FrameBus(camera_name, self.extra_kwargs.get("cameras", {}),
+                                 display=display)
+            frame_bus.start()
+            self.frame_buses[camera_name] = frame_bus
+        return frame_bus
+
     def get_data(self, *process_names, **kwargs):
         '''get data from all running processes and
-           package the output into a dictionary blah blah'''
+           package the output into a dictionary
+
+           Waits on every process's pipe at once, for up to delay seconds,
+           until any of the named processes has output (with force=True,
+           until all of them have).  Every waiting message is read, and only
+           the newest output of each process is returned.  Outputs captured
+           more than max_age seconds ago are dropped.  Returns None if none
+           of the processes had output.'''
 
-        vision_data = {}
-        vision_data_empty = True
         force = kwargs.pop("force", False)
         delay = kwargs.pop("delay", 0)
-        if force:
-            delay = None
+        max_age = kwargs.pop("max_age", None)
 
         if not process_names:
             process_names = self.process_list.keys()
 
+        processes = []
         for process_name in process_names:
-            if process_name in self.process_list.keys():
-                process = self.process_list[process_name]
-
-                output = process.get_data(delay)
-
-                if output is not None:
-                    vision_data_empty = False
-
-                vision_data[process.name] = output
+            if process_name in self.process_list:
+                processes.append(self.process_list[process_name])
             else:
                 raise ValueError("Attempted to get data from a non-existant process")
 
+        # Fused entities share a pipe
+        channels = []
+        for process in processes:
+            if process.channel not in channels:
+                channels.append(process.channel)
+
+        vision_data = dict((process.name, None) for process in processes)
+        deadline = None if force else time.time() + delay
+        while True:
+            for channel in channels:
+                channel.drain()
+            for process in processes:
+                if vision_data[process.name] is None:
+                    vision_data[process.name] = process.channel.take(process.name, max_age)
+
+            found = [output is not None for output in vision_data.itervalues()]
+            if all(found) if force else any(found):
+                break
+
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+            if not wait_for_channels(channels, timeout):
+                break
+
         # if vision_data is empty, return None
-        if vision_data_empty:
+        if not any(found):
             return None
         else:
             return vision_data
 
+    def filenos(self):
+        '''
+        Returns the file descriptors of every process's pipe.
+
+        Lets get_data() be driven from an event loop (select, poll, or a
+        reactor's add_reader) instead of blocking: when any descriptor is
+        readable, get_data() with the default delay of 0 returns at once.
+        '''
+        filenos = set()
+        for process in self.process_list.itervalues():
+            filenos.add(process.channel.fileno())
+        return list(filenos)
+
     def send_data(self, message, *process_names):
         '''send data to the desired processes'''
 
@@ -84,6 +231,12 @@ class ProcessManager(object):
             process.kill()
 
         self.process_list = {}
+        self.fused_processes = {}
+
+        for frame_bus in self.frame_buses.values():
+            frame_bus.stop()
+
+        self.frame_buses = {}
 
 
 class VisionProcess(object):
@@ -94,10 +247,19 @@ class VisionProcess(object):
         self.entity_cls = entity_cls
         self.name = name
 
-    def get_data(self, delay=0):
-        '''check for incoming data from this process'''
-        # return any new data from the queue
-        if self.downstream_conn.poll(delay):
+        # Newest output not yet returned by get_data()
+        self.latest = None
+
+    @property
+    def channel(self):
+        return self
+
+    def fileno(self):
+        return self.downstream_conn.fileno()
+
+    def drain(self):
+        '''reads every message waiting in the pipe, keeping the newest output'''
+        while self.downstream_conn.poll():
             data = self.downstream_conn.recv()
             if isinstance(data, KillSignal):
                 self.process_manager.kill()
@@ -108,7 +270,20 @@ class VisionProcess(object):
             else:
                 # print "Data:", data
                 # print str(data.__class__), str(SensorCapture)
-                return data
+                self.latest = data
+
+    def take(self, name, max_age=None):
+        '''returns and forgets the newest output, unless it was captured more
+           than max_age seconds ago'''
+        data, self.latest = self.latest, None
+        return take_output(self.process_manager, self.name, data, max_age)
+
+    def get_data(self, delay=0, max_age=None):
+        '''check for incoming data from this process'''
+        if self.latest is None:
+            self.downstream_conn.poll(delay)
+        self.drain()
+        return self.take(self.name, max_age)
 
     def send_data(self, data):
         '''sends data down the conn'''
@@ -126,11 +301,174 @@ class VisionProcess(object):
         self.process.start()
 
 
+class FusedProcess(object):
+
+    '''A single process running several entities on one camera.
+
+    Outputs come up one pipe tagged with the entity name.  The newest output
+    of each entity is kept until asked for.
+    '''
+
+    def __init__(self, process_manager, camera_name, entity_specs):
+        self.process_manager = process_manager
+        self.camera_name = camera_name
+        self.entity_specs = list(entity_specs)
+        self.latest = dict((name, None) for proc_cls, name in entity_specs)
+        self.killed = False
+
+    def fileno(self):
+        return self.downstream_conn.fileno()
+
+    def drain(self):
+        '''reads every message waiting in the pipe, keeping the newest output
+           of each entity'''
+        while self.downstream_conn.poll():
+            message = self.downstream_conn.recv()
+            if isinstance(message, KillSignal):
+                name, data = None, message
+            else:
+                name, data = message
+
+            if isinstance(data, KillSignal):
+                self.process_manager.kill()
+                raise data
+            elif isinstance(data, SensorCapture):
+                sw3.data.freeze(name)
+            else:
+                self.latest[name] = data
+
+    def take(self, name, max_age=None):
+        '''returns and forgets the newest output of the entity called name,
+           unless it was captured more than max_age seconds ago'''
+        data, self.latest[name] = self.latest[name], None
+        return take_output(self.process_manager, name, data, max_age)
+
+    def send_data(self, name, data):
+        '''sends data to the entity called name'''
+        self.downstream_conn.send((name, data))
+
+    def add_entity(self, proc_cls, name, kwargs):
+        '''starts another entity in this process'''
+        self.entity_specs.append((proc_cls, name))
+        self.latest[name] = None
+        self.downstream_conn.send(AddEntity(proc_cls, name, kwargs))
+
+    def kill(self):
+        '''kills this process and every entity in it'''
+        if not self.killed:
+            self.killed = True
+            self.downstream_conn.send(KillSignal())
+
+    def run(self, **kwargs):
+        '''runs this process'''
+        parent_conn, child_conn = Pipe()
+        self.downstream_conn = parent_conn
+        self.process = Process(target=run_fused,
+                               args=(child_conn, self.camera_name, self.entity_specs),
+                               kwargs=kwargs)
+        self.process.start()
+
+
+class FusedEntityProcess(object):
+
+    '''Stands in for a VisionProcess for one entity of a FusedProcess.'''
+
+    def __init__(self, fused_process, name):
+        self.fused_process = fused_process
+        self.name = name
+
+    @property
+    def channel(self):
+        return self.fused_process
+
+    def get_data(self, delay=0, max_age=None):
+        '''check for incoming data from this entity'''
+        fused_process = self.fused_process
+        if fused_process.latest[self.name] is None:
+            fused_process.downstream_conn.poll(delay)
+        fused_process.drain()
+        return fused_process.take(self.name, max_age)
+
+    def send_data(self, data):
+        self.fused_process.send_data(self.name, data)
+
+    def kill(self):
+        self.fused_process.kill()
+
+
+class FusedInbox(object):
+
+    '''
+    Sorts the messages coming down a fused process's pipe into a queue for
+    each entity.  AddEntity messages are queued for run_fused().
+    '''
+
+    def __init__(self, upstream_conn):
+        self.upstream_conn = upstream_conn
+        self.queues = {}  # Maps entity name -> deque of messages
+        self.added = deque()
+
+    def receive(self, timeout=0):
+        '''
+        Sorts every waiting message, first waiting up to timeout seconds
+        (forever if None) for one to arrive.  Returns True if any message was
+        read.  Raises KillSignal when the process is killed.
+        '''
+        if not self.upstream_conn.poll(timeout):
+            return False
+        while True:
+            message = self.upstream_conn.recv()
+            if isinstance(message, KillSignal):
+                raise message
+            elif isinstance(message, AddEntity):
+                self.added.append(message)
+            else:
+                name, data = message
+                self.queues[name].append(data)
+            if not self.upstream_conn.poll():
+                return True
+
+
+class FusedConn(object):
+
+    '''
+    An entity's end of its connection to mission control, when the entity
+    shares a process with others.  Outgoing messages are tagged with the
+    entity's name.  Incoming messages are sorted by a FusedInbox.
+    '''
+
+    def __init__(self, inbox, name):
+        self.inbox = inbox
+        self.upstream_conn = inbox.upstream_conn
+        self.name = name
+        self.queue = inbox.queues[name] = deque()
+
+    def poll(self, timeout=0):
+        '''Waits up to timeout seconds, or forever if None, for a message.
+
+        Messages for the other entities of the process that arrive meanwhile
+        are kept for them.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.queue:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            if not self.inbox.receive(remaining):
+                return False
+        return True
+
+    def recv(self):
+        return self.queue.popleft()
+
+    def send(self, data):
+        self.upstream_conn.send((self.name, data))
+
+
 def run_entity(upstream_conn, entity_cls, *args, **kwargs):
     '''perpetually loops the vision class entity_cls, and outputs data
        through the upstream_conn pipe '''
     try:
         svr.connect()
+        install_process_debug(kwargs)
         entity = entity_cls(upstream_conn, *args, **kwargs)
         print "running", entity
         entity.run()
@@ -140,11 +478,149 @@ def run_entity(upstream_conn, entity_cls, *args, **kwargs):
         sys.exit()
 
 
+def run_fused(upstream_conn, camera_name, entity_specs, **kwargs):
+    '''perpetually runs every entity in entity_specs on each frame from
+       camera_name, and outputs their data through the upstream_conn pipe '''
+    try:
+        svr.connect()
+        install_process_debug(kwargs)
+
+        frame_bus = kwargs.pop("frame_bus", None)
+        cameras = kwargs.get("cameras", {})
+        if frame_bus is not None:
+            capture = frame_bus.reader()
+        elif camera_name in cameras:
+            capture = libvision.Camera(cameras[camera_name], display=kwargs.get("debug", False))
+        else:
+            capture = svr.Stream(camera_name)
+            capture.unpause()
+
+        drop_policy = kwargs.pop("drop_policy", None)
+        if drop_policy:
+            capture = LatestFrameCapture(capture, drop_policy,
+                                         kwargs.pop("every_nth", DEFAULT_EVERY_NTH),
+                                         kwargs.pop("frame_deadline", DEFAULT_DEADLINE),
+                                         copy=frame_bus is None)
+
+        # The entities share the preprocessing stages and the threads
+        # computing them
+        tiles = libvision.TilePool(kwargs.pop("threads", 1))
+        preprocess = libvision.FrameCache(tiles)
+        inbox = FusedInbox(upstream_conn)
+        entities = []
+
+        def add_entity(entity_cls, name, entity_kwargs):
+            entity = entity_cls(FusedConn(inbox, name), camera_name, capture=capture,
+                                preprocess=preprocess, tiles=tiles,
+                                process_name=name, **entity_kwargs)
+            print "running", entity
+            entities.append((name, entity))
+
+        try:
+            for entity_cls, name in entity_specs:
+                add_entity(entity_cls, name, kwargs)
+
+            while True:
+                # Deliver messages and start entities that joined
+                inbox.receive()
+                while inbox.added:
+                    message = inbox.added.popleft()
+                    add_entity(message.entity_cls, message.name, message.kwargs)
+
+                frame = capture.get_frame()
+                capture_time = getattr(capture, "last_timestamp", None) or time.time()
+                preprocess.new_frame(frame, copy=False)
+
+                # Entities modify frames in place, so each gets its own
+                for name, entity in entities:
+                    entity.profiler.start_frame()
+                    entity.handle_frame(cv.CloneImage(frame), capture_time)
+                    entity.profiler.end_frame()
+
+        except KillSignal:
+            upstream_conn.send(KillSignal())
+
+        # Stops the entities' debug output and saves their profiles
+        finally:
+            for name, entity in entities:
+                entity.close()
+            tiles.close()
+            if drop_policy:
+                capture.stop()
+
+    except Exception as e:
+        upstream_conn.send(KillSignal())
+        traceback.print_exc()
+        sys.exit()
+
+
+def install_process_debug(kwargs):
+    '''Routes the svr.debug calls of the entities in this process through a
+    rate limited DebugOutput, using the debug options in the entity kwargs.'''
+    install_svr_debug(default_sinks(kwargs.get("debug_output"), kwargs.get("debug", False)),
+                      kwargs.get("debug_rate", DEFAULT_MAX_RATE))
+
+
+def wait_for_channels(channels, timeout=None):
+    '''
+    Waits until any of the channels (VisionProcess or FusedProcess) has a
+    message waiting.  Returns the ready channels, or an empty list if timeout
+    seconds passed first.
+    '''
+    ready, _, _ = select.select(channels, [], [], timeout)
+    return ready
+
+
+def take_output(process_manager, name, output, max_age):
+    '''Does the bookkeeping for an output about to be returned by get_data.'''
+    if output is None or is_stale(output, max_age):
+        return None
+    if process_manager.freeze_sensors:
+        freeze_sensors(name, output)
+    return output
+
+
+def freeze_sensors(name, output):
+    '''
+    Freezes sensor data for the named entity at the pose the robot was in
+    when the output's frame was captured.  Outputs without a capture time
+    rely on a SensorCapture message having been sent instead.
+    '''
+    capture_time = getattr(output, "capture_time", None)
+    if capture_time is not None:
+        sw3.data.freeze_at(name, capture_time)
+
+
+def is_stale(output, max_age):
+    '''
+    Returns True if output is an entity output captured more than max_age
+    seconds ago.  Outputs without a capture time are never stale.
+    '''
+    if max_age is None:
+        return False
+    capture_time = getattr(output, "capture_time", None)
+    return capture_time is not None and time.time() - capture_time > max_age
+
+
 class KillSignal(Exception):
     pass
 
 
+class AddEntity(object):
+
+    '''Sent to a fused process to start another entity in it.'''
+
+    def __init__(self, entity_cls, name, kwargs):
+        self.entity_cls = entity_cls
+        self.name = name
+        self.kwargs = kwargs
+
+
 class SensorCapture(object):
 
-    '''Sent to entity's parent process when it is capturing a frame.'''
+    '''Sent to entity's parent process when it is capturing a frame.
+
+    Only sent by entities whose outputs don't carry a capture time, like
+    MultiCameraVisionEntity.
+    '''
     pass
@@ -0,0 +1,169 @@
+'''
+Per-entity frame profiling.
+
+A FrameProfiler keeps a rolling window of how long each stage of an entity's
+frame loop took, and periodically writes the p50/p95/p99 of every stage to a
+JSON stats file.  VisionEntity.run() times capture, process_frame and the IPC
+send; entities mark their own sub-stages with lap().  For example:
+
+    def process_frame(self, frame):
+        binary = self.threshold(frame)
+        self.profiler.lap("threshold")
+        edges = cv2.Canny(binary, 30, 40)
+        self.profiler.lap("canny")
+
+'''
+
+from __future__ import division
+import json
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+DEFAULT_WINDOW = 300
+DEFAULT_PUBLISH_INTERVAL = 30
+PERCENTILES = (50, 95, 99)
+
+
+class _NullSection(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Section(object):
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        now = time.time()
+        self.profiler.record(self.stage, now - self.start)
+        self.profiler._last_lap = now
+        return False
+
+_null_section = _NullSection()
+
+
+class FrameProfiler(object):
+
+    '''Times the stages of an entity's frame loop.
+
+    Arguments:
+
+        name - Name of the entity being profiled, used in the stats file.
+
+        stats_path - JSON file that statistics are written to.  If None, no
+            file is written, but statistics are still available from stats().
+
+        window - Number of most recent samples of each stage that the
+            percentiles are calculated over.
+
+        publish_interval - Statistics are written every this many frames.
+
+        enabled - If False, every method is a no-op.
+
+    '''
+
+    def __init__(self, name, stats_path=None, window=DEFAULT_WINDOW,
+                 publish_interval=DEFAULT_PUBLISH_INTERVAL, enabled=True):
+        self.name = name
+        self.stats_path = stats_path
+        self.window = window
+        self.publish_interval = publish_interval
+        self.enabled = enabled
+
+        self.samples = {}  # Maps stage name -> deque of durations in seconds
+        self.frame_count = 0
+        self._frame_start = None
+        self._last_lap = None
+
+    def start_frame(self):
+        '''Marks the start of a frame.  Laps are timed from here.'''
+        if not self.enabled:
+            return
+        self._frame_start = self._last_lap = time.time()
+
+    def lap(self, stage):
+        '''Records the time since the previous lap, or the start of the frame.'''
+        if not self.enabled or self._last_lap is None:
+            return
+        now = time.time()
+        self.record(stage, now - self._last_lap)
+        self._last_lap = now
+
+    def section(self, stage):
+        '''Returns a context manager that times its block as stage.
+
+        Laps after the block do not include the time spent in it.
+        '''
+        if not self.enabled:
+            return _null_section
+        return _Section(self, stage)
+
+    def record(self, stage, duration):
+        '''Records a duration, in seconds, for stage.'''
+        if not self.enabled:
+            return
+        try:
+            self.samples[stage].append(duration)
+        except KeyError:
+            self.samples[stage] = deque([duration], maxlen=self.window)
+
+    def end_frame(self):
+        '''Marks the end of a frame and publishes statistics when due.'''
+        if not self.enabled or self._frame_start is None:
+            return
+        self.record("frame", time.time() - self._frame_start)
+        self._frame_start = self._last_lap = None
+
+        self.frame_count += 1
+        if self.stats_path and self.frame_count % self.publish_interval == 0:
+            self.publish()
+
+    def stats(self):
+        '''
+        Returns a dict mapping each stage to its count, mean and percentiles,
+        in milliseconds, over the current window.
+        '''
+        stats = {}
+        for stage, samples in self.samples.iteritems():
+            milliseconds = np.array(samples) * 1000
+            percentiles = np.percentile(milliseconds, PERCENTILES)
+            stage_stats = {
+                "count": len(milliseconds),
+                "mean": float(milliseconds.mean()),
+            }
+            for percentile, value in zip(PERCENTILES, percentiles):
+                stage_stats["p%d" % percentile] = float(value)
+            stats[stage] = stage_stats
+        return stats
+
+    def publish(self):
+        '''Writes the current statistics to the stats file.'''
+        directory = os.path.dirname(self.stats_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Write to a temporary file first so readers never see half a file
+        temp_path = self.stats_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({
+                "entity": self.name,
+                "frames": self.frame_count,
+                "time": time.time(),
+                "stages": self.stats(),
+            }, f, indent=2, sort_keys=True)
+        os.rename(temp_path, self.stats_path)
+
+    def __repr__(self):
+        return "<FrameProfiler name=%s frames=%d>" % (self.name, self.frame_count)
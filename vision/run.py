@@ -52,6 +52,35 @@ def setup_parser():
                         for debugging, but it isn't the way which mission control interacts with vision""",
                         dest="single_process", default=False, action="store_true")
 
+    parser.add_argument("-p", "--profile",
+                        help="""Time each stage of the entity's frame loop and write rolling
+                        percentiles to profile/<entity>.json""",
+                        dest="profile", default=False, action="store_true")
+
+    parser.add_argument("-D", "--drop-policy",
+                        help="""Grab frames in the background and only process the newest,
+                        dropping frames by the given policy.  By default every frame is processed""",
+                        dest="drop_policy", default=None,
+                        choices=["newest", "every_nth", "deadline"])
+
+    parser.add_argument("--every-nth",
+                        help="Process every nth frame with --drop-policy every_nth. Default is 2",
+                        type=int, dest="every_nth", default=2)
+
+    parser.add_argument("--frame-deadline",
+                        help="Maximum frame age, in seconds, with --drop-policy deadline. Default is 0.1",
+                        type=float, dest="frame_deadline", default=0.1)
+
+    parser.add_argument("-o", "--debug-output",
+                        help="""Publish debug frames to this sink: svr, window, disk:<directory>
+                        or ring[:<size>].  May be given more than once.  Default is svr, plus window
+                        unless --non-graphical.  Only debug_stream() frames go to windows""",
+                        type=str, dest="debug_output", default=None, action="append")
+
+    parser.add_argument("--debug-rate",
+                        help="Maximum debug frames/sec published per stream. Default is 5",
+                        type=float, dest="debug_rate", default=5.0)
+
     return parser
 
 def trace(frame, event, arg):
@@ -70,6 +99,8 @@ def main():
     graphical = args.graphical            # whether or not to show the streams
     delay = args.delay                    # delay in between frames
     single_process = args.single_process  # whether to run it in a single process
+    profile = args.profile                # whether to profile the entity
+    drop_policy = args.drop_policy        # which frames to drop when behind
 
     if len(streams) < 1:
         # user must provide at least one camera
@@ -94,9 +125,16 @@ def main():
             FakePipe(),
             entities.entity_classes[entity],
             *streams,
+            process_name=entity,
             cameras=cameras,
             delay=delay,
-            debug=graphical
+            debug=graphical,
+            profile=profile,
+            drop_policy=drop_policy,
+            every_nth=args.every_nth,
+            frame_deadline=args.frame_deadline,
+            debug_output=args.debug_output,
+            debug_rate=args.debug_rate
         )
 
     else:
@@ -106,6 +144,12 @@ def main():
                 "cameras": cameras,
                 "delay": delay,
                 "debug": graphical,
+                "profile": profile,
+                "drop_policy": drop_policy,
+                "every_nth": args.every_nth,
+                "frame_deadline": args.frame_deadline,
+                "debug_output": args.debug_output,
+                "debug_rate": args.debug_rate,
             }
         )
 
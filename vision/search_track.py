@@ -0,0 +1,135 @@
+'''
+Search and track modes.
+
+An entity normally searches the whole frame for its targets.  Once it has
+confirmed targets, most of that work is wasted: the targets are where they
+were last frame, give or take a few pixels.  In track mode only padded
+regions of interest (ROIs) around the predicted position of each target are
+processed.  The entity falls back to a full frame search:
+
+    - every search_interval frames, so new targets are still found,
+    - as soon as a target is lost, when not every target was found in its
+      ROI for max_misses frames in a row,
+    - whenever there are no targets to track.
+
+Each frame, an entity asks for the regions to process and reports whether it
+found its targets in them:
+
+    rois = self.search_track.regions(frame_size, targets)
+    if rois is None:
+        # Search the whole frame
+    else:
+        for (x, y, width, height) in rois:
+            # Process frame[y:y+height, x:x+width], offsetting results by x, y
+    self.search_track.report(found)
+
+'''
+
+import libvision
+
+SEARCH = "search"
+TRACK = "track"
+
+DEFAULT_SEARCH_INTERVAL = 15
+DEFAULT_MAX_MISSES = 2
+
+
+class SearchTrackMode(object):
+
+    '''Decides whether an entity searches the whole frame or only ROIs.
+
+    Arguments:
+
+        search_interval - Search the whole frame at least every this many
+            frames.
+
+        max_misses - Search the whole frame after the targets weren't all
+            found in their ROIs this many frames in a row.
+
+        padding - How far each ROI extends past its target, as a multiple of
+            the target's size.
+
+        min_padding - Minimum ROI padding, in pixels.  Leaves room for the
+            target to move between frames and for filters that look at
+            neighbouring pixels.
+
+        enabled - If False, every frame is a full frame search.
+
+    '''
+
+    def __init__(self, search_interval=DEFAULT_SEARCH_INTERVAL,
+                 max_misses=DEFAULT_MAX_MISSES, padding=1.0, min_padding=30,
+                 enabled=True):
+        self.search_interval = search_interval
+        self.max_misses = max_misses
+        self.padding = padding
+        self.min_padding = min_padding
+        self.enabled = enabled
+
+        self.mode = SEARCH
+        self.rois = None
+        self.misses = 0
+        self.frames_since_search = 0
+
+        # Frame counts, for profiling
+        self.searched = 0
+        self.tracked = 0
+
+    def regions(self, frame_size, targets):
+        '''Returns the ROIs to process this frame, or None for the whole frame.
+
+        Arguments:
+
+            frame_size - (width, height) of the frame.
+
+            targets - (x, y, size) of the predicted position of each target.
+                size is the radius or half width of the target, in pixels.
+
+        The returned ROIs are (x, y, width, height) rectangles inside the
+        frame, and never overlap.
+        '''
+        targets = list(targets)
+        if not self.enabled or not targets or \
+                self.misses >= self.max_misses or \
+                self.frames_since_search + 1 >= self.search_interval:
+            return self._search()
+
+        width, height = frame_size
+        rects = []
+        for x, y, size in targets:
+            padding = max(self.padding * size, self.min_padding)
+            rect = libvision.pad_rectangle((x - size, y - size, 2 * size, 2 * size),
+                                           padding, width, height)
+            if rect is None:
+                # The target is predicted to have left the frame
+                return self._search()
+            rects.append(rect)
+
+        self.mode = TRACK
+        self.rois = libvision.merge_rectangles(rects)
+        self.frames_since_search += 1
+        self.tracked += 1
+        return self.rois
+
+    def report(self, found):
+        '''Tells whether every target was found in the frame just processed.'''
+        if self.mode == TRACK and not found:
+            self.misses += 1
+        else:
+            self.misses = 0
+
+    def force_search(self):
+        '''Makes the next frame a full frame search.'''
+        self.misses = self.max_misses
+
+    def _search(self):
+        self.mode = SEARCH
+        self.rois = None
+        self.misses = 0
+        self.frames_since_search = 0
+        self.searched += 1
+        return None
+
+    def __repr__(self):
+        return "<SearchTrackMode mode=%s rois=%d searched=%d tracked=%d>" % (
+            self.mode, len(self.rois or ()), self.searched, self.tracked)